@@ -11,6 +11,33 @@ for h in settings.ALLOWED_HOSTS:
 _DEFAULTS = {
     "FEEDS_USER_AGENT": "django-feed-reader",  
     "FEEDS_SERVER": server,
+    "FEEDS_POOL_CONNECTIONS": 100,
+    "FEEDS_POOL_MAXSIZE": 10,
+    "FEEDS_HOST_RATE": 1.0,
+    "FEEDS_HOST_BURST": 5,
+    "FEEDS_HOST_RATE_LIMITS": {},
+    "FEEDS_LEASE_SECONDS": 600,
+    "FEEDS_PARSER_ENGINE": "feedparser",
+    "FEEDS_MAX_ENTRIES_PER_FETCH": None,
+    "FEEDS_INCREMENTAL_STOP_AFTER": 3,
+    "FEEDS_SCHEDULE_POLICY": "predictive",
+    "FEEDS_ADAPTIVE_BACKOFF": 1.5,
+    "FEEDS_ADAPTIVE_STEP": 30*60,
+    "FEEDS_ADAPTIVE_MAX_INTERVAL": 24*60*60,
+    "FEEDS_TIERS": {
+        "hot": {"budget": 0.6, "min_interval": None, "max_interval": 6*60*60},
+        "warm": {"budget": 0.3, "min_interval": None, "max_interval": None},
+        "cold": {"budget": 0.1, "min_interval": 7*24*60*60, "max_interval": None},
+    },
+    "FEEDS_TIER_HOT_DAYS": 2,
+    "FEEDS_TIER_HOT_RATE": 1.0,
+    "FEEDS_TIER_COLD_DAYS": 60,
+    "FEEDS_TIER_COLD_ERRORS": 5,
+    "FEEDS_FETCH_JITTER": 10*60,
+    "FEEDS_FETCH_HISTORY": True,
+    "FEEDS_HISTORY_BATCH_SIZE": 200,
+    "FEEDS_HISTORY_RETENTION_DAYS": 30,
+    "FEEDS_HISTORY_ROLLUP_INTERVAL": 60*60,
 }
 
 for key, value in _DEFAULTS.items():
@@ -2,10 +2,20 @@
 The methods to update feeds and their entries
 """
 import logging
+import multiprocessing
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import django
 from feeds.models import Source
 from .query import query_source
-from .parse import update_feed
-from .predict import set_next_fetch
+from .extract import ParsedFeed, extract_feed, content_digest
+from .parse import update_feed, known_fingerprints
+from .policies import schedule_next_fetch
+from .session import fetch_session
+from .throttle import HostThrottle, HostScheduler
+from .metrics import metrics, stage_seconds
+from .history import finish_attempt, note_attempt, flush_attempts
 
 logger = logging.getLogger('update_feed')
 
@@ -19,9 +29,12 @@ def new_feed(source: Source):
         logger.error('Error querying the source, changes will not be saved: %s', source)
         return
 
-    set_next_fetch(source)
     source.save() # first save is to give the source model an id
-    update_feed(source, feed_content)
+    counts = update_feed(source, feed_content, save=False, content_type=source.content_type)
+    schedule_next_fetch(source, counts.inserted if counts else 0)
+    source.save()
+    finish_attempt(source, new_entries=counts.inserted if counts else 0)
+    flush_attempts()
 
 
 
@@ -36,12 +49,211 @@ def fetch_feed(source: Source, no_cache: bool = False):
     logger.info('Updating Feed %s', source)
 
     feed_content = query_source(source, no_cache)
-    set_next_fetch(source)
+    process_feed(source, feed_content, no_cache)
+    flush_attempts()
+
+
+
+def process_feed(source: Source, feed_content: bytes | None, no_cache: bool = False, parsed_feed: ParsedFeed = None):
+    """
+    Everything after the query step: update the entries, predict when to query next and save the source.
+
+    If the content is exactly the same as the last content parsed, the parsing and entry updates are skipped.
+
+    ### Parameters
+    - source: the Source object that was queried
+    - feed_content: the content returned by `query_source`, None if there is nothing new to parse
+    - no_cache: parse the content even if it has not changed
+    - parsed_feed: the values already extracted from the content, eg: by a parse process
+    """
+    counts = None
+    unchanged = False
+    if feed_content and parsed_feed is None and not content_changed(source, feed_content, no_cache):
+        # the server sent the full feed again instead of a 304 not modified
+        logger.info('Feed content unchanged: %s', source)
+        source.unchanged_count += 1
+        unchanged = True
+
+    elif feed_content:
+        counts = update_feed(source, feed_content, parsed_feed=parsed_feed, save=False, content_type=source.content_type)
+
+    # count the failures in a row, a source that keeps failing is moved to the cold tier
+    if source.status_code >= 500:
+        source.error_count += 1
+    else:
+        source.error_count = 0
+
+    # schedule with the arrival statistics, which now include any new entries
+    schedule_next_fetch(source, counts.inserted if counts else 0)
     logger.debug('polled at %s', source.last_feched)
     logger.debug('due fetch set to %s', source.due_fetch)
+    source.save()
+    finish_attempt(source, unchanged=unchanged, new_entries=counts.inserted if counts else 0)
 
-    if not feed_content:
-        source.save()
-        return
 
-    update_feed(source, feed_content) # update feed will also save
+
+def content_changed(source: Source, feed_content: bytes, no_cache: bool = False) -> bool:
+    """True if the content has to be parsed, False if it is the same as the last content parsed for the source"""
+    return no_cache or content_digest(feed_content) != source.content_hash
+
+
+
+def create_parse_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Create a pool of processes to parse feeds on, to pass to `fetch_feeds`. The processes are started fresh rather
+    than forked, because forking while query threads are running can deadlock, and each one sets up django.
+
+    ### Parameters
+    - workers: the number of parse processes
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+
+
+
+def parse_pool_broken(parse_pool: ProcessPoolExecutor) -> bool:
+    """
+    True if a process of the pool has died, eg: killed for running out of memory. A broken pool refuses every new
+    task, so it has to be replaced with a new one from `create_parse_pool`.
+    """
+    try:
+        parse_pool.submit(int).result()
+    except BrokenProcessPool:
+        return True
+    return False
+
+
+
+def timed_extract_feed(content: bytes, known: dict = None, content_type: str = None) -> tuple[ParsedFeed, float]:
+    """`extract_feed` and the seconds it took, run on a parse process so the time can be recorded by the caller"""
+    start = perf_counter()
+    parsed_feed = extract_feed(content, content_type=content_type, known=known)
+    return parsed_feed, perf_counter() - start
+
+
+
+def fetch_feeds(sources, no_cache: bool = False, workers: int = 1, throttle: HostThrottle = None,
+                parse_pool: ProcessPoolExecutor = None) -> int:
+    """
+    Fetch many feeds, overlapping the network requests on a pool of threads.
+
+    Only the queries run on the worker threads, every database write happens on the calling thread as each
+    query completes, so this is safe to use with any database backend. All the queries share one http session so
+    connections to the same host are reused, called inside a `fetch_session` block they use its session. If a parse pool is given the feeds are parsed on it, so parsing runs on
+    other cores while the queries and database writes carry on.
+
+    The feeds are fetched taking turns between hosts, and each host is rate limited by the throttle. If a host
+    responds with 429 too many requests, the rest of its feeds are left for a later run. A feed that fails to update
+    is logged and does not stop the others.
+
+    ### Parameters
+    - sources: an iterable of Source objects to update
+    - no_cache: force a complete query of every feed
+    - workers: the number of queries to run at the same time, 1 fetches the feeds one after another
+    - throttle: the per host rate limits, defaults to new limits from the settings. Pass the same throttle to every
+      call to keep the limits between runs
+    - parse_pool: a process pool from `create_parse_pool` to parse the feeds on
+
+    ### Returns
+    - int: the number of sources fetched
+    """
+    scheduler = HostScheduler(sources, throttle or HostThrottle())
+
+    try:
+        with fetch_session(pool_maxsize=workers):
+            if workers <= 1 and parse_pool is None:
+                return _fetch_in_turn(scheduler, no_cache)
+            return _fetch_in_pool(scheduler, no_cache, max(workers, 1), parse_pool)
+    finally:
+        # write the fetch attempts that are still buffered
+        flush_attempts()
+
+
+
+def _fetch_in_turn(scheduler: HostScheduler, no_cache: bool) -> int:
+    """fetch the scheduled feeds one after another"""
+    count = 0
+
+    while scheduler:
+        source, delay = scheduler.next_source()
+        if source is None:
+            sleep(delay)
+            continue
+
+        logger.info('Updating Feed %s', source)
+        try:
+            # the fetch attempts are written together when all the feeds are done
+            process_feed(source, query_source(source, no_cache), no_cache)
+        except Exception: # pylint: disable=broad-exception-caught
+            logger.exception('Failed to update feed: %s', source)
+        scheduler.record(source)
+        count += 1
+
+    return count
+
+
+
+def _fetch_in_pool(scheduler: HostScheduler, no_cache: bool, workers: int, parse_pool: ProcessPoolExecutor = None) -> int:
+    """
+    fetch the scheduled feeds with up to `workers` queries running at the same time, and parse them on the parse
+    pool if one is given
+    """
+    count = 0
+    queries = {}
+    parses = {}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='feeds-query') as executor:
+        while scheduler or queries or parses:
+            # only submit as many queries as there are workers, so each one starts when its host allows it
+            # and finished responses do not pile up in memory. A backlog of parsing holds back new queries too.
+            delay = None
+            while scheduler and len(queries) < workers and len(parses) < workers:
+                source, delay = scheduler.next_source()
+                if source is None:
+                    break
+                logger.info('Updating Feed %s', source)
+                queries[executor.submit(query_source, source, no_cache)] = source
+
+            if not queries and not parses:
+                sleep(delay)
+                continue
+
+            done, _ = wait([*queries, *parses], timeout=delay or None, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in queries:
+                    source = queries.pop(future)
+                    scheduler.record(source)
+                    parsed_feed = None
+                    try:
+                        feed_content = future.result()
+                    except Exception: # pylint: disable=broad-exception-caught
+                        logger.exception('Failed to update feed: %s', source)
+                        count += 1
+                        continue
+
+                    if parse_pool is not None and feed_content and content_changed(source, feed_content, no_cache):
+                        try:
+                            known = known_fingerprints(source)
+                            parses[parse_pool.submit(timed_extract_feed, feed_content, known, source.content_type)] = (source, feed_content)
+                            continue
+                        except Exception: # pylint: disable=broad-exception-caught
+                            # eg: a parse process died and the pool is broken, parse on this thread instead
+                            logger.exception('Could not send feed to the parse pool: %s', source)
+
+                else:
+                    source, feed_content = parses.pop(future)
+                    try:
+                        parsed_feed, seconds = future.result()
+                        metrics.record(stage_seconds, seconds, stage='parse')
+                        note_attempt(source, parse_time=seconds)
+                    except Exception: # pylint: disable=broad-exception-caught
+                        # parse on this thread instead, which records the error on the source if it fails again
+                        logger.exception('Parse process failed for feed: %s', source)
+                        parsed_feed = None
+
+                try:
+                    process_feed(source, feed_content, no_cache, parsed_feed)
+                except Exception: # pylint: disable=broad-exception-caught
+                    logger.exception('Failed to update feed: %s', source)
+                count += 1
+
+    return count
@@ -0,0 +1,147 @@
+"""
+Conditional requests, so servers can answer 304 not modified instead of sending the whole feed again, and counts
+of how often they do
+"""
+import threading
+from django.db.models import Sum, F
+from requests import Response
+from feeds.models import Source
+
+# compression suffixes some servers (eg: Apache's mod_deflate) add to an etag but do not recognise when it is sent back
+ETAG_ENCODING_SUFFIXES = ('-gzip"', '-br"', '-deflate"')
+
+
+def request_etags(etag: str | None) -> list[str]:
+    """
+    The etags to send back to the server for a stored etag. Weak etags (W/"...") are sent as they are, servers
+    compare If-None-Match weakly.
+
+    ### Parameters
+    - etag: the etag stored from the last response
+
+    ### Returns
+    - list of etags to send, empty if there is no etag
+    """
+    if not etag or not (etag := etag.strip()):
+        return []
+
+    etags = [etag]
+    for suffix in ETAG_ENCODING_SUFFIXES:
+        if etag.endswith(suffix):
+            etags.append(etag[:-len(suffix)] + '"')
+
+    return etags
+
+
+
+def conditional_headers(source: Source) -> dict:
+    """
+    The conditional request headers for a source, only the validators the source actually has are sent
+
+    ### Parameters
+    - source: the source being queried
+
+    ### Returns
+    - dict of headers
+    """
+    headers = {}
+
+    if etags := request_etags(source.etag):
+        headers['If-None-Match'] = ', '.join(etags)
+
+    if source.last_modified and source.last_modified.strip():
+        headers['If-Modified-Since'] = source.last_modified.strip()
+
+    return headers
+
+
+
+def update_validators(source: Source, response: Response):
+    """Store the validators from a response, a 304 response may leave them out, in which case the old ones are kept"""
+    if etag := response.headers.get('ETag', '').strip():
+        source.etag = etag
+
+    if last_modified := response.headers.get('Last-Modified', '').strip():
+        source.last_modified = last_modified
+
+
+
+class ConditionalStats:
+    """Counts of not modified and full responses received by this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.not_modified = 0
+        self.full = 0
+        self.full_bytes = 0
+
+
+    def record(self, status_code: int, content_length: int = 0):
+        """count a response"""
+        with self.lock:
+            if status_code == 304:
+                self.not_modified += 1
+            elif 200 <= status_code < 300:
+                self.full += 1
+                self.full_bytes += content_length
+
+
+    @property
+    def hit_rate(self) -> float:
+        """the fraction of responses that were 304 not modified"""
+        total = self.not_modified + self.full
+        return self.not_modified / total if total else 0.0
+
+
+    def reset(self):
+        """set all the counts back to 0"""
+        with self.lock:
+            self.not_modified = 0
+            self.full = 0
+            self.full_bytes = 0
+
+
+# the counts for every query made by this process
+conditional_stats = ConditionalStats()
+
+
+def record_response(source: Source, response: Response):
+    """
+    Count a response as not modified or full, for the source and for this process
+
+    ### Parameters
+    - source: the source that was queried
+    - response: the response received
+    """
+    if response.status_code == 304:
+        source.not_modified_count += 1
+
+    elif 200 <= response.status_code < 300:
+        source.full_response_count += 1
+        source.content_length = len(response.content)
+
+    conditional_stats.record(response.status_code, len(response.content))
+
+
+
+def conditional_summary() -> dict:
+    """
+    Totals of the response counts recorded for all sources
+
+    ### Returns
+    - dict with:
+        - not_modified: the number of 304 not modified responses
+        - full: the number of full responses
+        - unchanged: the number of full responses that were skipped because the body had not changed
+        - hit_rate: the fraction of responses that were 304 not modified
+        - bytes_saved: an estimate of the bytes not downloaded thanks to 304 responses
+    """
+    totals = Source.objects.aggregate(
+        not_modified = Sum('not_modified_count', default=0),
+        full = Sum('full_response_count', default=0),
+        unchanged = Sum('unchanged_count', default=0),
+        bytes_saved = Sum(F('not_modified_count') * F('content_length'), default=0),
+    )
+    responses = totals['not_modified'] + totals['full']
+    totals['hit_rate'] = totals['not_modified'] / responses if responses else 0.0
+    return totals
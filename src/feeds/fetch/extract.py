@@ -0,0 +1,460 @@
+"""
+Turn the content of a feed into the field values of its source, entries and enclosures.
+
+Nothing here touches the database, so the extraction can run in another process. The result is a compact
+`ParsedFeed` of plain values that is cheap to send back between processes.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+from urllib.parse import urlparse, parse_qs, ParseResult
+from time import struct_time, strftime
+import feedparser
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from .fastparse import parse_fast
+from .jsonfeed import is_json_feed, parse_json_feed
+
+logger = logging.getLogger('Fetch Extract')
+
+
+SOURCE_FIELD_KEYS = {
+    'title': ('title',),
+    'subtitle': ('subtitle',),
+    'site_url': ('href',),
+    'image_url': ('image.href', 'image', 'img'),
+    'icon_url': ('logo', 'icon', 'facicon'),
+    'author': ('author',),
+    'description': ('info',),
+}
+
+ENTRY_FIELD_KEYS = {
+    'title':('title',),
+    'body':('content.0.value', 'content', 'summary'),
+    'link':('link',),
+    'created':('updated_parsed', 'published_parsed', 'created_parsed', 'updated', 'published', 'created'),
+    'guid':('id',),
+    'author':('author',),
+    'image_url':('image.href', 'image', 'media_thumbnail.0.url'),
+}
+
+
+
+# keys that feedparser stores under another name, eg: 'description' is 'summary' or 'subtitle'. These go through
+# FeedParserDict's own lookup, every other key is read straight from the dict.
+FEEDPARSER_ALIASES = frozenset(feedparser.util.FeedParserDict.keymap) | {'category', 'enclosures', 'license'}
+
+
+def compile_step(key: str):
+    """
+    Make a function that goes down one level of the parsed data: an index into a list, a key of a dict, or an
+    attribute of anything else. The function returns None if there is nothing there.
+    """
+    if key.isdigit():
+        index = int(key)
+
+        def index_step(value):
+            if isinstance(value, list):
+                return value[index] if index < len(value) else None
+            return dict.get(value, key) if isinstance(value, dict) else None
+
+        return index_step
+
+    aliased = key in FEEDPARSER_ALIASES
+
+    def key_step(value):
+        if isinstance(value, dict):
+            return value.get(key) if aliased else dict.get(value, key)
+        if isinstance(value, list):
+            return None
+        return getattr(value, key, None)
+
+    return key_step
+
+
+
+def compile_path(path: str):
+    """
+    Turn a dotted path, eg: 'content.0.value', into a function that follows it through the parsed data.
+    The path is split once here instead of every time a value is looked up.
+
+    feedparser's deprecated fallback from 'updated' to 'published' is not used, list the published path after the
+    updated path instead.
+
+    ### Returns
+    - function that takes the parsed data and returns the value at the path, or None
+    """
+    steps = tuple(compile_step(key) for key in path.split('.'))
+
+    if len(steps) == 1:
+        return steps[0]
+
+    def accessor(data):
+        for step in steps:
+            data = step(data)
+            if data is None:
+                return None
+        return data
+
+    return accessor
+
+
+
+class FieldMap:
+    """
+    The paths to look for each field's value in the parsed data, compiled into accessors.
+
+    More fields, or more paths for a field, can be registered by a project, eg: from its `AppConfig.ready`, which
+    also runs in the parse processes.
+
+    ### Parameters
+    - field_paths: the paths to try for each field by field name, in order
+    """
+
+    def __init__(self, field_paths: dict[str, tuple[str, ...]]):
+        self.field_paths = {}
+        self.accessors = []
+        for field_name, paths in field_paths.items():
+            self.register(field_name, *paths)
+
+
+    def register(self, field_name: str, *paths: str, first: bool = False):
+        """
+        Add paths to look for a field's value, the field is added if it is new
+
+        ### Parameters
+        - field_name: the name of the model field
+        - paths: dotted paths into the parsed data
+        - first: try these paths before the existing ones, otherwise they are tried after
+        """
+        existing = self.field_paths.get(field_name, ())
+        self.field_paths[field_name] = (*paths, *existing) if first else (*existing, *paths)
+        self.accessors = [
+            (name, tuple(compile_path(path) for path in field_paths)) for name, field_paths in self.field_paths.items()
+        ]
+
+
+    def extract(self, data) -> dict:
+        """
+        Find the value of each field in the parsed data
+
+        ### Returns
+        - dict: the field values that were found, by field name
+        """
+        values = {}
+        for field_name, accessors in self.accessors:
+            for accessor in accessors:
+                if (value := accessor(data)) is not None:
+                    values[field_name] = value
+                    break
+        return values
+
+
+
+SOURCE_FIELDS = FieldMap(SOURCE_FIELD_KEYS)
+ENTRY_FIELDS = FieldMap(ENTRY_FIELD_KEYS)
+
+
+def register_source_field(field_name: str, *paths: str, first: bool = False):
+    """Add paths to look for the value of a Source field, see `FieldMap.register`"""
+    SOURCE_FIELDS.register(field_name, *paths, first=first)
+
+
+
+def register_entry_field(field_name: str, *paths: str, first: bool = False):
+    """Add paths to look for the value of an Entry field, see `FieldMap.register`"""
+    ENTRY_FIELDS.register(field_name, *paths, first=first)
+
+
+
+class ParsedEntry(NamedTuple):
+    """The values extracted from one entry of a feed"""
+    # the entry field values by field name, including the guid and fingerprint
+    values: dict
+    # (href, type, length) of each enclosure
+    enclosures: list[tuple[str, str, int]]
+
+
+
+class ParsedFeed(NamedTuple):
+    """The values extracted from a feed"""
+    # the source field values by field name
+    feed: dict
+    entries: list[ParsedEntry]
+
+
+
+def extract_feed(content: str | bytes, engine: str = None, content_type: str = None, max_entries: int = None,
+                 known: dict = None) -> ParsedFeed:
+    """
+    Parse the content of a feed and extract the values to store
+
+    ### Parameters
+    - content: the content recieved from the query step
+    - engine: 'fast' to try the streaming parser first, 'feedparser' to always use feedparser.
+      Defaults to `FEEDS_PARSER_ENGINE`. JSON feeds are always read with the json module.
+    - content_type: the Content-Type header of the response, if it is known
+    - max_entries: the most entries to extract, defaults to `FEEDS_MAX_ENTRIES_PER_FETCH`, None extracts them all
+    - known: the fingerprints of stored entries by guid, for an incremental source. Extraction stops after a run of
+      `FEEDS_INCREMENTAL_STOP_AFTER` entries in a row that are known and unchanged, the rest of the feed is older.
+
+    ### Returns
+    - ParsedFeed: the source values and the values of each entry that has a guid
+    """
+    if max_entries is None:
+        max_entries = getattr(settings, 'FEEDS_MAX_ENTRIES_PER_FETCH')
+    max_entries = max_entries or None
+
+    parsed_data = parse_feed_content(content, engine, content_type, max_entries)
+    return map_parsed_feed(parsed_data, max_entries, known)
+
+
+
+def map_parsed_feed(parsed_data: feedparser.util.FeedParserDict, max_entries: int = None, known: dict = None) -> ParsedFeed:
+    """
+    Extract the values to store from a parsed feed, see `extract_feed`
+
+    ### Parameters
+    - parsed_data: the result of `parse_feed_content`
+    - max_entries: the most entries to extract, None extracts them all
+    - known: the fingerprints of stored entries by guid, for an incremental source
+
+    ### Returns
+    - ParsedFeed: the source values and the values of each entry that has a guid
+    """
+    stop_after = getattr(settings, 'FEEDS_INCREMENTAL_STOP_AFTER')
+
+    entries = []
+    known_run = 0
+    for entry_data in parsed_data.entries[:max_entries]:
+        values = map_entry(entry_data)
+        if values.get('guid') is None:
+            logger.warning('Skipping entry without an id or link')
+            continue
+        enclosures = entry_enclosures(entry_data)
+        values['fingerprint'] = entry_fingerprint(values, enclosures)
+        entries.append(ParsedEntry(values, enclosures))
+
+        if known is not None:
+            known_run = known_run + 1 if known.get(values['guid']) == values['fingerprint'] else 0
+            if known_run >= stop_after:
+                logger.debug('Stopping after %d known entries', known_run)
+                break
+
+    return ParsedFeed(map_source(parsed_data.feed), entries)
+
+
+
+def content_digest(content: str | bytes) -> str:
+    """Hash a response body, to tell if it is the same as the last one parsed"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+
+def tree_atribute(parser_data: feedparser.util.FeedParserDict, *paths):
+    """
+    follow a tree of attributes to attempt to find a value. The field maps use compiled paths instead, see `FieldMap`
+
+    ### Parameters
+    - parser_data (FeedParserDict): the data retrieved from the source
+    - paths: all the posible paths to go down.
+
+    ### Returns
+    the value or None
+    """
+    for path in paths:
+        value = parser_data
+
+        for key in path.split('.'):
+            if isinstance(value, list):
+                try:
+                    value = value[int(key)]
+                except Exception:
+                    break
+
+            elif isinstance(value, dict):
+                try:
+                    value = value[key]
+                except Exception:
+                    break
+
+            else:
+                try:
+                    value = getattr(value, key)
+                except Exception:
+                    break
+
+        else: # no break
+            if value is None:
+                continue
+            return value
+
+    return None
+
+
+
+def parse_feed_content(content:str, engine: str = None, content_type: str = None,
+                       max_entries: int = None) -> feedparser.util.FeedParserDict:
+    """Turn the string response from the query into a searchable dict, falling back to feedparser if the fast parsers can not read it"""
+    if is_json_feed(content, content_type) and (parsed_data := parse_json_feed(content, max_entries)) is not None:
+        return parsed_data
+    if (engine or getattr(settings, 'FEEDS_PARSER_ENGINE')) == 'fast' and (parsed_data := parse_fast(content, max_entries)) is not None:
+        return parsed_data
+    return feedparser.parse(content)
+
+
+
+def map_source(feed_data: feedparser.util.FeedParserDict) -> dict:
+    """
+    Find the value of each source field in the parsed data
+
+    ### Parameters
+    - feed_data (FeedParserDict): the feed level data parsed from the feed
+
+    ### Returns
+    - dict: the field values that were found, by field name
+    """
+    values = SOURCE_FIELDS.extract(feed_data)
+
+    for field_name, value in values.items():
+        if isinstance(value, struct_time):
+            values[field_name] = strftime('%Y-%m-%dT%H:%M:%SZ', value)
+
+    return values
+
+
+
+def map_entry(entry_data: feedparser.util.FeedParserDict) -> dict:
+    """
+    Find the value of each entry field in the parsed data
+
+    ### Parameters
+    - entry_data (FeedParserDict): the raw data of one entry
+
+    ### Returns
+    - dict: the field values that were found, by field name. If the entry has no id its link is used as the guid
+    """
+    values = ENTRY_FIELDS.extract(entry_data)
+
+    for field_name, value in values.items():
+        if isinstance(value, struct_time):
+            values[field_name] = datetime(*value[:6], tzinfo=timezone.utc)
+
+    # a date feedparser could not read is left as the raw string, which the database would reject
+    if isinstance(values.get('created'), str):
+        if (created := parse_entry_date(values['created'])) is None:
+            logger.debug('Unreadable entry date: %s', values['created'])
+            del values['created']
+        else:
+            values['created'] = created
+
+    if isinstance(values.get('image_url'), list):
+        image_url = values.pop('image_url')
+        if image_url and image_url[0].get('url') is not None:
+            values['image_url'] = image_url[0]['url']
+
+    if values.get('guid') is None and values.get('link') is not None:
+        values['guid'] = values['link']
+
+    return values
+
+
+
+def parse_entry_date(value: str) -> datetime | None:
+    """
+    Read an RFC 822 or ISO 8601 date string
+
+    ### Returns
+    - datetime: the date, in UTC if it has no time zone, None if it can not be read
+    """
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            date = parse_datetime(value.strip())
+        except ValueError:
+            date = None
+
+    if date is not None and date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+
+def entry_fingerprint(values: dict, enclosures: list[tuple[str, str, int]]) -> str:
+    """
+    Hash the mapped field values and enclosures of an entry, so an unchanged entry can be recognised without
+    reading it from the database
+
+    ### Parameters
+    - values: the field values found by `map_entry`
+    - enclosures: the enclosures found by `entry_enclosures`
+
+    ### Returns
+    - str: a 32 character hex digest
+    """
+    data = json.dumps([sorted(values.items()), enclosures], default=str, ensure_ascii=False)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+
+def entry_enclosures(entry_data: feedparser.util.FeedParserDict) -> list[tuple[str, str, int]]:
+    """
+    Find the enclosures of an entry
+
+    ### Parameters
+    - entry_data (FeedParserDict): the raw data of one entry
+
+    ### Returns
+    - list of (href, type, length) for each enclosure
+    """
+    enclosures = []
+
+    # add an enclosure for each youtube video link
+    # youtube links may be in the normal 'link' attribute
+    if link := entry_data.get('link', ''):
+        parsed_link = urlparse(link)
+
+        if parsed_link.netloc == 'www.youtube.com' and (embeded_link := youtube_embed_link(parsed_link)):
+            enclosures.append((embeded_link, 'youtube', 0))
+
+    # for each set of enclosure data:
+    for enclosure_data in entry_data.get('enclosures', []):
+        if not enclosure_data:
+            continue
+
+        parsed_link = urlparse(enclosure_data.get('href', ''))
+
+        if parsed_link.netloc == 'www.youtube.com' and (embeded_link := youtube_embed_link(parsed_link)):
+            enclosures.append((embeded_link, 'youtube', 0))
+            continue
+
+        try:
+            length = int(enclosure_data.get('length') or 0)
+        except (TypeError, ValueError):
+            length = 0
+
+        enclosures.append((enclosure_data.get('href', ''), enclosure_data.get('type', ''), length))
+
+    return enclosures
+
+
+
+def youtube_embed_link(youtube_link: ParseResult) -> str | None:
+    """youtube enclosures need to be modified to form an embedable link, returns None if the link is not to a video"""
+    # if the link is already an embeded link
+    if youtube_link.path.startswith('/embed/'):
+        return youtube_link.geturl()
+
+    # check if the youtube link contains a video id
+    query = parse_qs(youtube_link.query)
+    if 'v' not in query:
+        return None
+
+    video_id = query['v'][0]
+    return f"https://www.youtube.com/embed/{video_id}"
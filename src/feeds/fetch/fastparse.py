@@ -0,0 +1,293 @@
+"""
+A streaming parser for well formed RSS 2.0 and Atom feeds.
+
+feedparser handles every kind of feed, including broken ones, but builds a lot of state that is not used. This parser
+reads the feed with `xml.etree.ElementTree.iterparse`, keeps only the fields that are mapped to the models, and
+drops each entry as soon as it has been read. It produces the same shape of data as feedparser so the same mapping
+is used for both. When a feed is not well formed, or is a format this parser does not know, it returns None and
+the feed should be parsed with feedparser instead.
+"""
+import io
+import logging
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import struct_time
+from xml.sax.saxutils import escape
+import feedparser
+
+try:
+    # feedparser's own sanitizer is private, but much faster than sanitizing through feedparser.parse
+    from feedparser.sanitizer import _sanitize_html
+except ImportError: # moved or removed in another feedparser release
+    _sanitize_html = None
+
+logger = logging.getLogger('Fetch Fastparse')
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+XHTML = '{http://www.w3.org/1999/xhtml}'
+CONTENT = '{http://purl.org/rss/1.0/modules/content/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+ITUNES = '{http://www.itunes.com/dtds/podcast-1.0.dtd}'
+MEDIA = '{http://search.yahoo.com/mrss/}'
+
+# the elements an author can come from, when there are several the last one in the feed is used like feedparser does
+RSS_AUTHOR_TAGS = {'author', 'managingEditor', f'{DC}creator', f'{ITUNES}author'}
+
+# a feed of one entry, to sanitize html with feedparser's public api when its sanitizer can not be imported
+SANITIZE_FEED = '<rss version="2.0"><channel><item><description>{}</description></item></channel></rss>'
+
+
+class FastFeed(dict):
+    """The parsed feed, a dict with `feed` and `entries` that can also be read as attributes like feedparser's"""
+    __getattr__ = dict.__getitem__
+
+
+
+def parse_fast(content: str | bytes, max_entries: int = None) -> FastFeed | None:
+    """
+    Parse an RSS 2.0 or Atom feed
+
+    ### Parameters
+    - content: the content recieved from the query step
+    - max_entries: the most entries to read, the rest are skipped without being read. None reads them all
+
+    ### Returns
+    - FastFeed: with `feed`, the feed level values, and `entries`, the values of each entry, in the same form as
+      feedparser. None if the content is not a well formed RSS 2.0 or Atom feed.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    feed, entries = None, []
+    try:
+        for event, element in ET.iterparse(io.BytesIO(content), events=('start', 'end')):
+            if event == 'start':
+                # the root element decides the format, anything else is left to feedparser
+                if feed is None:
+                    if element.tag not in ('rss', f'{ATOM}feed'):
+                        return None
+                    feed = element
+                continue
+
+            if element.tag in ('item', f'{ATOM}entry'):
+                if max_entries is None or len(entries) < max_entries:
+                    entries.append(rss_entry(element) if element.tag == 'item' else atom_entry(element))
+                element.clear()
+
+    except ET.ParseError as error:
+        logger.debug('Not well formed, falling back to feedparser: %s', error)
+        return None
+
+    if feed is None:
+        return None
+
+    if feed.tag == 'rss':
+        channel = feed.find('channel')
+        return FastFeed(feed=rss_feed(channel) if channel is not None else {}, entries=entries)
+
+    return FastFeed(feed=atom_feed(feed), entries=entries)
+
+
+
+def text(element: ET.Element | None) -> str | None:
+    """the stripped text of an element, or None if there is no element"""
+    if element is None:
+        return None
+    return (element.text or '').strip()
+
+
+
+def sanitize(html: str | None) -> str | None:
+    """remove anything unsafe from html, using the same rules as feedparser"""
+    if not html:
+        return html
+    if _sanitize_html is not None:
+        return _sanitize_html(html, 'utf-8', 'text/html')
+
+    parsed_data = feedparser.parse(SANITIZE_FEED.format(escape(html)))
+    return parsed_data.entries[0].get('summary', '') if parsed_data.entries else ''
+
+
+
+def inner_xml(element: ET.Element) -> str:
+    """the markup inside an element, eg: an xhtml body, without the namespace prefixes"""
+    for child in element.iter():
+        if isinstance(child.tag, str) and child.tag.startswith('{'):
+            child.tag = child.tag.split('}', 1)[1]
+
+    markup = (element.text or '') + ''.join(ET.tostring(child, encoding='unicode') for child in element)
+    return markup.strip()
+
+
+
+def date_struct(value: datetime | None) -> struct_time | None:
+    """a datetime as a UTC struct_time, the way feedparser gives dates"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).timetuple()
+
+
+
+def rss_date(value: str | None) -> struct_time | None:
+    """parse an RFC 822 date"""
+    if not value:
+        return None
+    try:
+        return date_struct(parsedate_to_datetime(value))
+    except (TypeError, ValueError):
+        return None
+
+
+
+def iso_date(value: str | None) -> struct_time | None:
+    """parse an RFC 3339 date"""
+    if not value:
+        return None
+    try:
+        return date_struct(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+
+
+def atom_text(element: ET.Element | None) -> str | None:
+    """the value of an Atom text construct, html and xhtml are sanitized"""
+    if element is None:
+        return None
+
+    text_type = element.get('type', 'text')
+    if text_type == 'xhtml':
+        return sanitize(inner_xml(element))
+    if text_type in ('html', 'text/html'):
+        return sanitize(text(element))
+    return text(element)
+
+
+
+def rss_feed(channel: ET.Element) -> dict:
+    """the feed level values of an RSS channel"""
+    values = {}
+    for child in channel:
+        tag = child.tag
+        if tag == 'title':
+            values['title'] = text(child)
+        elif tag == 'link':
+            values['link'] = text(child)
+        elif tag == 'description':
+            values.setdefault('subtitle', text(child))
+        elif tag == f'{ITUNES}subtitle':
+            values['subtitle'] = text(child)
+        elif tag == 'image' and (url := text(child.find('url'))):
+            values['image'] = {'href': url}
+        elif tag == f'{ITUNES}image' and child.get('href'):
+            values['image'] = {'href': child.get('href')}
+        elif tag in RSS_AUTHOR_TAGS:
+            values['author'] = text(child)
+        elif tag == f'{ITUNES}owner' and (name := text(child.find(f'{ITUNES}name'))):
+            values['author'] = name
+
+    return values
+
+
+
+def rss_entry(item: ET.Element) -> dict:
+    """the values of an RSS item"""
+    values = {}
+    enclosures = []
+    for child in item:
+        tag = child.tag
+        if tag == 'title':
+            values['title'] = text(child)
+        elif tag == 'link':
+            values['link'] = text(child)
+        elif tag == 'guid':
+            values['id'] = text(child)
+        elif tag == 'description':
+            values['summary'] = sanitize(text(child))
+        elif tag == f'{CONTENT}encoded':
+            values['content'] = [{'value': sanitize(text(child))}]
+        elif tag == f'{XHTML}body':
+            values['content'] = [{'value': sanitize(inner_xml(child))}]
+        elif tag == 'pubDate':
+            values['published_parsed'] = rss_date(text(child))
+        elif tag == f'{DC}date':
+            values['updated_parsed'] = iso_date(text(child))
+        elif tag in RSS_AUTHOR_TAGS:
+            values['author'] = text(child)
+        elif tag == f'{ITUNES}image' and child.get('href'):
+            values['image'] = {'href': child.get('href')}
+        elif tag == f'{MEDIA}thumbnail' and child.get('url'):
+            values.setdefault('media_thumbnail', []).append({'url': child.get('url')})
+        elif tag == 'enclosure':
+            enclosures.append({'href': child.get('url', ''), 'type': child.get('type', ''), 'length': child.get('length')})
+
+    values['enclosures'] = enclosures
+    return values
+
+
+
+def atom_feed(feed: ET.Element) -> dict:
+    """the feed level values of an Atom feed"""
+    values = {}
+    for child in feed:
+        tag = child.tag
+        if tag == f'{ATOM}title':
+            values['title'] = atom_text(child)
+        elif tag == f'{ATOM}subtitle':
+            values['subtitle'] = atom_text(child)
+        elif tag == f'{ATOM}logo':
+            values['logo'] = text(child)
+        elif tag == f'{ATOM}icon':
+            values['icon'] = text(child)
+        elif tag == f'{ATOM}link' and child.get('rel', 'alternate') == 'alternate':
+            values['link'] = child.get('href')
+        elif tag == f'{ATOM}author':
+            if name := text(child.find(f'{ATOM}name')):
+                values['author'] = name
+            # feedparser gives the author's uri as the feed's href
+            if uri := text(child.find(f'{ATOM}uri')):
+                values['href'] = uri
+
+    return values
+
+
+
+def atom_entry(entry: ET.Element) -> dict:
+    """the values of an Atom entry"""
+    values = {}
+    enclosures = []
+    for child in entry:
+        tag = child.tag
+        if tag == f'{ATOM}title':
+            values['title'] = atom_text(child)
+        elif tag == f'{ATOM}id':
+            values['id'] = text(child)
+        elif tag == f'{ATOM}content':
+            values['content'] = [{'value': atom_text(child)}]
+        elif tag == f'{ATOM}summary':
+            values['summary'] = atom_text(child)
+        elif tag == f'{ATOM}published':
+            values['published_parsed'] = iso_date(text(child))
+        elif tag == f'{ATOM}updated':
+            values['updated_parsed'] = iso_date(text(child))
+        elif tag == f'{ATOM}author' and (name := text(child.find(f'{ATOM}name'))):
+            values['author'] = name
+        elif tag == f'{ATOM}link':
+            rel = child.get('rel', 'alternate')
+            if rel == 'alternate':
+                values['link'] = child.get('href')
+            elif rel == 'enclosure':
+                enclosures.append({'href': child.get('href', ''), 'type': child.get('type', ''), 'length': child.get('length')})
+        elif tag == f'{MEDIA}group':
+            if (description := text(child.find(f'{MEDIA}description'))) is not None:
+                values.setdefault('summary', description)
+            for thumbnail in child.iter(f'{MEDIA}thumbnail'):
+                values.setdefault('media_thumbnail', []).append({'url': thumbnail.get('url')})
+        elif tag == f'{MEDIA}thumbnail' and child.get('url'):
+            values.setdefault('media_thumbnail', []).append({'url': child.get('url')})
+
+    values['enclosures'] = enclosures
+    return values
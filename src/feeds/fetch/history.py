@@ -0,0 +1,221 @@
+"""
+A log of every fetch attempt, with daily totals for each source and a limit on how long the attempts are kept.
+
+The query of a source starts a `FetchAttempt`, which is kept on the source until the fetch has been processed and
+is then buffered. The buffer is written with one bulk insert once it holds `FEEDS_HISTORY_BATCH_SIZE` attempts, or
+when `flush_attempts` is called at the end of a batch of fetches, so the fetches themselves do not wait on it.
+
+`rollup_fetch_history` adds the attempts up into a `FetchDailyStats` row for each source and day, and
+`prune_fetch_history` deletes the attempts that are older than `FEEDS_HISTORY_RETENTION_DAYS`.
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from feeds.models import Source, FetchAttempt, FetchDailyStats
+
+logger = logging.getLogger('Fetch History')
+
+# the most rows to delete in one query when pruning, the ids are sent as parameters so this stays under the
+# parameter limits of the databases, eg: 999 on older SQLite builds and 1000 items in an Oracle IN list. A LIMIT
+# subquery would avoid the parameters, but MySQL does not support one inside IN.
+PRUNE_BATCH_SIZE = 500
+
+# the totals of FetchDailyStats and how each is calculated from the attempts of a day
+DAILY_TOTALS = {
+    'attempts': Count('pk'),
+    'not_modified': Count('pk', filter=Q(status_code=304)),
+    'unchanged': Count('pk', filter=Q(unchanged=True)),
+    'errors': Count('pk', filter=Q(status_code__gte=400)),
+    'new_entries': Sum('new_entries', default=0),
+    'content_length': Sum('content_length', default=0),
+    'elapsed': Sum('elapsed', default=0.0),
+    'max_elapsed': Max('elapsed', default=0.0),
+    'parse_time': Sum('parse_time', default=0.0),
+}
+
+
+def history_enabled() -> bool:
+    """True if fetch attempts are recorded, see `FEEDS_FETCH_HISTORY`"""
+    return bool(getattr(settings, 'FEEDS_FETCH_HISTORY'))
+
+
+
+def start_attempt(source: Source, started: datetime) -> FetchAttempt | None:
+    """
+    Start the record of a query, kept on the source as `fetch_attempt` until `finish_attempt`
+
+    ### Parameters
+    - source: the source being queried
+    - started: when the query started
+
+    ### Returns
+    - FetchAttempt: the unsaved attempt, None if the history is turned off
+    """
+    source.fetch_attempt = FetchAttempt(source=source, started=started) if history_enabled() else None
+    return source.fetch_attempt
+
+
+
+def note_attempt(source: Source, **values):
+    """set values on the source's current attempt, if one was started"""
+    if (attempt := getattr(source, 'fetch_attempt', None)) is not None:
+        for name, value in values.items():
+            setattr(attempt, name, value)
+
+
+
+def finish_attempt(source: Source, **values):
+    """
+    Complete the source's current attempt and add it to the buffer, the status code is taken from the source
+
+    ### Parameters
+    - source: the source that was fetched
+    - values: other values of the attempt, eg: new_entries
+    """
+    attempt = getattr(source, 'fetch_attempt', None)
+    if attempt is None:
+        return
+
+    note_attempt(source, status_code=source.status_code, **values)
+    source.fetch_attempt = None
+    attempt_buffer.add(attempt)
+
+
+
+class AttemptBuffer:
+    """The attempts waiting to be written, shared by the threads of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = []
+
+
+    def add(self, attempt: FetchAttempt):
+        """buffer an attempt, and write the buffer if it is full"""
+        with self.lock:
+            self.attempts.append(attempt)
+            full = len(self.attempts) >= getattr(settings, 'FEEDS_HISTORY_BATCH_SIZE')
+        if full:
+            self.flush()
+
+
+    def flush(self) -> int:
+        """
+        Write the buffered attempts in one bulk insert. Attempts of sources that have since been deleted are
+        dropped.
+
+        ### Returns
+        - int: the number of attempts written
+        """
+        with self.lock:
+            attempts, self.attempts = self.attempts, []
+        if not attempts:
+            return 0
+
+        # a new source is saved after its first query, so take the id it was given
+        for attempt in attempts:
+            attempt.source_id = attempt.source.pk
+        live_ids = set(Source.objects.filter(pk__in={attempt.source_id for attempt in attempts}).values_list('pk', flat=True))
+        attempts = [attempt for attempt in attempts if attempt.source_id in live_ids]
+
+        FetchAttempt.objects.bulk_create(attempts, batch_size=getattr(settings, 'FEEDS_HISTORY_BATCH_SIZE'))
+        logger.debug('Wrote %d fetch attempts', len(attempts))
+        return len(attempts)
+
+
+    def clear(self):
+        """drop the buffered attempts without writing them"""
+        with self.lock:
+            self.attempts = []
+
+
+# the attempts of this process that have not been written yet
+attempt_buffer = AttemptBuffer()
+
+
+def flush_attempts() -> int:
+    """write the buffered attempts, returns the number written"""
+    return attempt_buffer.flush()
+
+
+
+def rollup_fetch_history(since: date = None) -> int:
+    """
+    Add up the attempts of each source for each day into `FetchDailyStats`. Each day is recalculated from all of
+    its attempts, so a day can be rolled up again as more attempts are made and the result is the same however
+    often it is run.
+
+    ### Parameters
+    - since: the first day to roll up, defaults to the last day already rolled up, or every day if there are none
+
+    ### Returns
+    - int: the number of daily rows written
+    """
+    if since is None:
+        since = FetchDailyStats.objects.aggregate(last=Max('day'))['last']
+
+    attempts = FetchAttempt.objects.all()
+    if since is not None:
+        start = datetime.combine(since, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+        attempts = attempts.filter(started__gte=start)
+
+    # the totals are given other names, an aggregate can not have the name of a field of the attempts
+    rows = attempts.annotate(day=TruncDate('started')).order_by().values('source_id', 'day').annotate(
+        **{f'{name}_total': aggregate for name, aggregate in DAILY_TOTALS.items()}
+    )
+    stats = [
+        FetchDailyStats(source_id=row['source_id'], day=row['day'], **{name: row[f'{name}_total'] for name in DAILY_TOTALS})
+        for row in rows
+    ]
+
+    FetchDailyStats.objects.bulk_create(
+        stats,
+        batch_size=getattr(settings, 'FEEDS_HISTORY_BATCH_SIZE'),
+        update_conflicts=True,
+        unique_fields=['source', 'day'],
+        update_fields=list(DAILY_TOTALS),
+    )
+    logger.info('Rolled up %d days of fetch attempts', len(stats))
+    return len(stats)
+
+
+
+def prune_fetch_history(retention_days: float = None) -> int:
+    """
+    Delete the attempts older than the retention window, in batches so no one query holds the table for long.
+    Roll the attempts up first, the daily totals of a pruned day are not recalculated.
+
+    ### Parameters
+    - retention_days: the days of attempts to keep, defaults to `FEEDS_HISTORY_RETENTION_DAYS`
+
+    ### Returns
+    - int: the number of attempts deleted
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'FEEDS_HISTORY_RETENTION_DAYS')
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    deleted = 0
+    while ids := list(FetchAttempt.objects.filter(started__lt=cutoff).values_list('pk', flat=True)[:PRUNE_BATCH_SIZE]):
+        count, _ = FetchAttempt.objects.filter(pk__in=ids).delete()
+        deleted += count
+
+    logger.info('Pruned %d fetch attempts older than %s', deleted, cutoff)
+    return deleted
+
+
+
+def maintain_fetch_history() -> tuple[int, int]:
+    """
+    Write the buffered attempts, roll them up and prune the old ones
+
+    ### Returns
+    - int: the number of daily rows written
+    - int: the number of attempts deleted
+    """
+    flush_attempts()
+    return rollup_fetch_history(), prune_fetch_history()
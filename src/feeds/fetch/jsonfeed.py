@@ -0,0 +1,130 @@
+"""
+Read JSON Feed (https://jsonfeed.org) versions 1 and 1.1 with the standard `json` module.
+
+feedparser only reads XML, so JSON feeds are mapped here into the same shape of data that feedparser gives for
+RSS and Atom, and the same field mapping is used for all of them.
+"""
+import html
+import json
+import logging
+from .fastparse import FastFeed, sanitize, iso_date
+
+logger = logging.getLogger('Fetch JSON Feed')
+
+JSON_CONTENT_TYPES = ('application/feed+json', 'application/json')
+
+
+def is_json_feed(content: str | bytes, content_type: str = None) -> bool:
+    """
+    Tell if the content looks like a JSON feed, from the content type if the server sent one, otherwise from the
+    first character of the content
+
+    ### Parameters
+    - content: the content recieved from the query step
+    - content_type: the Content-Type header of the response, if it is known
+    """
+    if content_type and content_type.split(';', 1)[0].strip().lower() in JSON_CONTENT_TYPES:
+        return True
+
+    if isinstance(content, bytes):
+        return content[:64].lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'{')
+    return content[:64].lstrip('\ufeff \t\r\n').startswith('{')
+
+
+
+def parse_json_feed(content: str | bytes, max_entries: int = None) -> FastFeed | None:
+    """
+    Parse a JSON feed
+
+    ### Parameters
+    - content: the content recieved from the query step
+    - max_entries: the most items to read, None reads them all
+
+    ### Returns
+    - FastFeed: with `feed`, the feed level values, and `entries`, the values of each item, in the same form as
+      feedparser. None if the content is not a JSON feed.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError as error:
+        logger.debug('Not valid JSON: %s', error)
+        return None
+
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return None
+
+    return FastFeed(
+        feed=json_feed(data),
+        entries=[json_entry(item) for item in data['items'][:max_entries] if isinstance(item, dict)],
+    )
+
+
+
+def title_text(value) -> str | None:
+    """titles are plain text, but some feeds put markup in them anyway"""
+    if not isinstance(value, str):
+        return None
+    return sanitize(value) if '<' in value else value
+
+
+
+def author_name(data: dict) -> str | None:
+    """the name of the first author, version 1.1 has a list of authors, version 1 a single author"""
+    authors = data.get('authors') or [data.get('author')]
+    if isinstance(authors, list) and authors and isinstance(authors[0], dict):
+        return authors[0].get('name')
+    return None
+
+
+
+def json_feed(data: dict) -> dict:
+    """the feed level values of a JSON feed"""
+    values = {
+        'title': title_text(data.get('title')),
+        'subtitle': data.get('description'),
+        'href': data.get('home_page_url'),
+        'icon': data.get('favicon'),
+        'author': author_name(data),
+    }
+    if data.get('icon'):
+        values['image'] = {'href': data['icon']}
+
+    return {key: value for key, value in values.items() if value is not None}
+
+
+
+def json_entry(item: dict) -> dict:
+    """the values of a JSON feed item"""
+    values = {
+        'id': str(item['id']) if item.get('id') is not None else None,
+        'title': title_text(item.get('title')),
+        'link': item.get('url') or item.get('external_url'),
+        'summary': item.get('summary'),
+        'published_parsed': iso_date(item.get('date_published')),
+        'updated_parsed': iso_date(item.get('date_modified')),
+        'author': author_name(item),
+    }
+
+    if item.get('content_html'):
+        values['content'] = [{'value': sanitize(item['content_html'])}]
+    elif item.get('content_text'):
+        values['content'] = [{'value': html.escape(item['content_text'])}]
+
+    if image := item.get('image') or item.get('banner_image'):
+        values['image'] = {'href': image}
+
+    values = {key: value for key, value in values.items() if value is not None}
+    values['enclosures'] = [
+        {'href': attachment.get('url', ''), 'type': attachment.get('mime_type', ''), 'length': attachment_size(attachment)}
+        for attachment in item.get('attachments') or [] if isinstance(attachment, dict)
+    ]
+    return values
+
+
+
+def attachment_size(attachment: dict) -> int:
+    """the size of an attachment in bytes, 0 if it is missing or not a number"""
+    try:
+        return int(attachment.get('size_in_bytes') or 0)
+    except (TypeError, ValueError):
+        return 0
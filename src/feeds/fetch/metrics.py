@@ -0,0 +1,269 @@
+"""
+Counters and histograms of the fetch pipeline, kept in memory by each process.
+
+Each stage of fetching a feed is timed: the query, parsing, writing the entries, syncing their enclosures and
+scheduling the next fetch. The bytes downloaded and the entries and enclosures written are counted. The totals can
+be written out in the Prometheus text format with `prometheus_text`, or every measurement can be passed on as it
+is made to a listener added with `metrics.add_listener`, eg: to send it to statsd.
+"""
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable
+
+logger = logging.getLogger('Fetch Metrics')
+
+# the upper bounds in seconds of the stage timing histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the stages of fetching a feed
+STAGES = ('query', 'parse', 'entries', 'enclosures', 'schedule')
+
+
+class Counter:
+    """
+    A total that only goes up, kept separately for each set of label values
+
+    ### Parameters
+    - name: the metric name
+    - help_text: a description of the metric
+    - label_names: the names of the labels each value is kept by
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+
+
+    def record(self, labels: tuple, amount: float):
+        """add to the total for the label values, the registry holds the lock"""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        """the (name, labels, value) of each value"""
+        return [(self.name, dict(zip(self.label_names, labels)), value) for labels, value in sorted(self.values.items())]
+
+
+
+class Histogram:
+    """
+    Counts of measurements by bucket, with their sum and count, kept separately for each set of label values
+
+    ### Parameters
+    - name: the metric name
+    - help_text: a description of the metric
+    - label_names: the names of the labels each histogram is kept by
+    - buckets: the upper bound of each bucket, in increasing order
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # the bucket counts, sum and count for each set of label values
+        self.values = {}
+
+
+    def record(self, labels: tuple, amount: float):
+        """add a measurement for the label values, the registry holds the lock"""
+        counts, total, count = self.values.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+        for i, bound in enumerate(self.buckets):
+            if amount <= bound:
+                counts[i] += 1
+                break
+        self.values[labels] = (counts, total + amount, count + 1)
+
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        """the (name, labels, value) of the cumulative buckets, sum and count of each histogram"""
+        samples = []
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            labels = dict(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+            samples.append((f'{self.name}_bucket', {**labels, 'le': '+Inf'}, count))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+    def totals(self, **labels) -> tuple[float, int]:
+        """the sum and count of the measurements for the label values"""
+        _, total, count = self.values.get(tuple(str(labels.get(name, '')) for name in self.label_names)) or (None, 0.0, 0)
+        return total, count
+
+
+
+class MetricsRegistry:
+    """The metrics of this process, and the listeners that are told about each measurement"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.listeners = []
+
+
+    def counter(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Counter:
+        """register a counter"""
+        return self.register(Counter(name, help_text, label_names))
+
+
+    def histogram(self, name: str, help_text: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """register a histogram"""
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+
+    def register(self, metric):
+        """add a metric, a metric with the same name is replaced"""
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+
+    def record(self, metric: Counter | Histogram, amount: float, **labels):
+        """
+        Add to a counter or a measurement to a histogram, then pass it on to the listeners
+
+        ### Parameters
+        - metric: the counter or histogram
+        - amount: the amount to add to the counter, or the measurement
+        - labels: the value of each of the metric's labels
+        """
+        with self.lock:
+            metric.record(tuple(str(labels.get(name, '')) for name in metric.label_names), amount)
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            try:
+                listener(metric.name, amount, labels)
+            except Exception: # pylint: disable=broad-exception-caught
+                logger.exception('Metrics listener %s failed', listener)
+
+
+    def add_listener(self, listener: Callable[[str, float, dict], None]):
+        """
+        Call a function with every measurement as it is recorded
+
+        ### Parameters
+        - listener: called with the metric name, the amount and a dict of the label values
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+
+    def remove_listener(self, listener: Callable[[str, float, dict], None]):
+        """stop calling a listener"""
+        with self.lock:
+            self.listeners.remove(listener)
+
+
+    def reset(self):
+        """clear the values of every metric"""
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+
+
+    def prometheus_text(self) -> str:
+        """the value of every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f'# HELP {metric.name} {metric.help_text}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                for name, labels, value in metric.samples():
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+
+def format_labels(labels: dict) -> str:
+    """labels in the Prometheus text format, eg: {stage="query"}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + '}'
+
+
+
+def escape_label(value) -> str:
+    """escape the backslashes, quotes and new lines of a label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+
+def format_value(value: float) -> str:
+    """a number in the Prometheus text format"""
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+
+# the metrics of every fetch made by this process
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram('feeds_fetch_stage_seconds', 'Seconds spent in each stage of fetching a feed', ('stage',))
+fetches = metrics.counter('feeds_fetches_total', 'Feed queries by response status code', ('status',))
+bytes_downloaded = metrics.counter('feeds_fetch_bytes_total', 'Bytes of feed content downloaded')
+entries_written = metrics.counter('feeds_entries_written_total', 'Entries written by kind of write', ('kind',))
+enclosures_written = metrics.counter('feeds_enclosures_written_total', 'Enclosures written by kind of write', ('kind',))
+
+
+class StageTiming:
+    """The seconds a stage took, set when the `stage_timer` context exits"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Time the code inside the context as a stage of fetching a feed. The time is recorded even if the code raises.
+
+    ### Parameters
+    - stage: one of `STAGES`
+
+    ### Returns
+    - StageTiming: holds the seconds the stage took once the context exits
+    """
+    timing = StageTiming()
+    start = perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.seconds = perf_counter() - start
+        metrics.record(stage_seconds, timing.seconds, stage=stage)
+
+
+
+def write_metrics_file(path: str):
+    """
+    Write the metrics in the Prometheus text format, eg: for node exporter's textfile collector. The file is
+    replaced in one step so a collector never reads it half written.
+
+    ### Parameters
+    - path: the file to write
+    """
+    text = metrics.prometheus_text()
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temp_path, path)
@@ -2,244 +2,219 @@
 Functions for updating feeds
 """
 import logging
-from urllib.parse import urlencode, urlparse, parse_qs, ParseResult
-from time import struct_time, strftime
-import feedparser
+from collections import Counter, defaultdict
+from typing import NamedTuple
+from django.db import transaction
+from django.utils import timezone
 from feeds.models import Source, Entry, Enclosure
+from .extract import ParsedFeed, ParsedEntry, extract_feed, content_digest
+from .predict import record_arrivals
+from .metrics import metrics, stage_timer, entries_written, enclosures_written
+from .history import note_attempt
 
 logger = logging.getLogger('Fetch Predict')
 
 # status codes for errors in parsing
 PARSING_ERROR_STATUS_CODE = 600
 
+# the most rows to write in one bulk query
+BULK_BATCH_SIZE = 500
 
-SOURCE_FIELD_KEYS = {
-    'title': ('title',),
-    'subtitle': ('subtitle',),
-    'site_url': ('href',),
-    'image_url': ('image.href', 'image', 'img'),
-    'icon_url': ('logo', 'icon', 'facicon'),
-    'author': ('author',),
-    'description': ('description'),
-}
-
-ENTRY_FIELD_KEYS = {
-    'title':('title',),
-    'body':('content.0.value', 'content', 'summary'),
-    'link':('link',),
-    'created':('updated_parsed', 'published_parsed', 'created_parsed', 'updated', 'published', 'created'),
-    'guid':('id',),
-    'author':('author',),
-    'image_url':('image.href', 'image', 'media_thumbnail.0.url'),
-}
-
-
-def update_feed(source: Source, content:str):
+# the most recent entries of an incremental source to compare with the top of its feed
+KNOWN_ENTRIES_LIMIT = 500
+
+
+def update_feed(source: Source, content:str, digest: str = None, parsed_feed: ParsedFeed = None, save: bool = True,
+                content_type: str = None):
     """
     Update the data for the given feed.
 
     ### Parameters
     - source (Source): the source object to update
     - content (str): the content recieved from the query step
+    - digest (str): the `content_digest` of the content, if it has already been calculated
+    - parsed_feed (ParsedFeed): the values extracted from the content, if it has already been parsed
+    - save (bool): save the source, pass False if the caller changes it further and saves it
+    - content_type (str): the Content-Type header of the response, if it is known
+
+    ### Returns
+    - EntryCounts: how many entries were inserted, updated and unchanged, None if the feed could not be parsed
     """
+    counts = None
     try:
-        parsed_data = parse_feed_content(content)
-        update_source_attributes(source, parsed_data.feed)
-        update_entries(source, parsed_data.entries)
+        if parsed_feed is None:
+            known = known_fingerprints(source)
+            with stage_timer('parse') as timing:
+                parsed_feed = extract_feed(content, content_type=content_type, known=known)
+            note_attempt(source, parse_time=timing.seconds)
+        update_source_attributes(source, parsed_feed.feed)
+        counts = update_entries(source, parsed_feed.entries)
+        source.content_hash = digest or content_digest(content)
 
     except Exception as exc:
         logger.exception('Failed to parse source: %s', source.feed_url)
         source.status_code = PARSING_ERROR_STATUS_CODE
         source.last_result = str(exc)
 
-    source.save()
+    if save:
+        source.save()
+    return counts
 
 
 
-def tree_atribute(parser_data: feedparser.util.FeedParserDict, *paths):
+def known_fingerprints(source: Source) -> dict | None:
     """
-    follow a tree of attributes to attempt to find a value
-
-    ### Parameters
-    - parser_data (FeedParserDict): the data retrieved from the source
-    - paths: all the posible paths to go down.
+    The fingerprints of the most recently found entries of an incremental source, to pass to `extract_feed` so it
+    can stop at the entries that are already stored
 
     ### Returns
-    the value or None
+    - dict of fingerprint by guid, None if the source is not incremental
     """
-    for path in paths:
-        value = parser_data
-
-        for key in path.split('.'):
-            if isinstance(value, list):
-                try:
-                    value = value[int(key)]
-                except Exception:
-                    break
-
-            elif isinstance(value, dict):
-                try:
-                    value = value[key]
-                except Exception:
-                    break
-
-            else:
-                try:
-                    value = getattr(value, key)
-                except Exception:
-                    break
-
-        else: # no break
-            if value is None:
-                continue
-            return value
-
-    return None
-
-
+    if not source.incremental or source.pk is None:
+        return None
 
-def parse_feed_content(content:str) -> feedparser.util.FeedParserDict:
-    """Turn the string response from the query into a searchable dict"""
-    return feedparser.parse(content)
+    return dict(Entry.objects.filter(source=source).order_by('-id').values_list('guid', 'fingerprint')[:KNOWN_ENTRIES_LIMIT])
 
 
 
-def update_source_attributes(source: Source, feed_data: feedparser.util.FeedParserDict):
+def update_source_attributes(source: Source, feed_values: dict):
     """
-    Update the Source from the data
+    Update the Source from the data, the source is not saved
 
     ### Parameters
     - source (Source): the Source instance to update
-    - parsed_data (FeedParserDict): the data parsed from the feed fetch
+    - feed_values (dict): the source field values extracted from the feed
     """
-    # for each field, attempt each known path to get to the data
-    for field_name, paths in SOURCE_FIELD_KEYS.items():
-        value = tree_atribute(feed_data, *paths)
-        if value is None:
-            continue
+    for field_name, value in feed_values.items():
+        setattr(source, field_name, value)
 
-        if isinstance(value, struct_time):
-            value = strftime('%Y-%m-%dT%H:%M:%SZ', value)
 
-        setattr(source, field_name, value)
 
-    source.save()
+class EntryCounts(NamedTuple):
+    """The number of entries written by `update_entries`"""
+    inserted: int
+    updated: int
+    unchanged: int
 
 
-def update_entries(source: Source, entries_data: feedparser.util.FeedParserDict):
+
+def update_entries(source: Source, entries: list[ParsedEntry]) -> EntryCounts:
     """
-    Create any new entries for a source
+    Create any new entries for a source and update the ones that changed.
+
+    Each entry carries a fingerprint of its fields and enclosures. The guid and fingerprint of the existing
+    entries are looked up in a few large queries, entries with an unchanged fingerprint are skipped completely and the rest
+    are written in bulk inside a single transaction.
 
     ### Parameters
     - source (Source): the source instance we're creating entried for
-    - entries_data (FeedParserDict): the raw data parsed from the fetch operation
+    - entries (list[ParsedEntry]): the entries extracted from the feed
+
+    ### Returns
+    - EntryCounts: how many entries were inserted, updated and unchanged
     """
-    logger.debug('Parsing %d Entries', len(entries_data))
+    logger.debug('Parsing %d Entries', len(entries))
 
-    for entry_data in entries_data:
-        entry = get_or_create_entry(source, entry_data)
-        update_enclosures(entry, entry_data)
+    # map the entries by guid, if a feed repeats a guid the last one wins
+    mapped = {entry.values['guid']: entry for entry in entries}
 
+    with transaction.atomic():
+        with stage_timer('entries'):
+            existing = {}
+            for batch in chunks(list(mapped), BULK_BATCH_SIZE):
+                for entry_id, guid, fingerprint in Entry.objects.filter(source=source, guid__in=batch).values_list('id', 'guid', 'fingerprint'):
+                    existing[guid] = (entry_id, fingerprint)
 
-def get_or_create_entry(source: Source, entry_data: feedparser.util.FeedParserDict):
-    """
-    Create any new entries for a source
+            new_entries = []
+            changed_entries = defaultdict(list)
+            for guid, (values, _) in mapped.items():
+                if guid not in existing:
+                    new_entries.append(Entry(source=source, **values))
+                    continue
 
-    ### Parameters
-    - source (Source): the source instance we're creating entried for
-    - entry_data (FeedParserDict): the raw data parsed from the fetch operation
-    """
-    try:
-        entry = Entry.objects.get(source=source, guid=entry_data.id)
+                entry_id, fingerprint = existing[guid]
+                if fingerprint == values['fingerprint']:
+                    continue
 
-    except Entry.DoesNotExist:
-        entry = Entry(source=source, guid=entry_data.id)
+                # only write the fields found in the feed, so fields missing from it keep their stored values
+                changed_entries[tuple(values)].append(Entry(pk=entry_id, source=source, **values))
 
-    for field_name, paths in ENTRY_FIELD_KEYS.items():
-        value = tree_atribute(entry_data, *paths)
-        if value is None:
-            continue
+            Entry.objects.bulk_create(new_entries, batch_size=BULK_BATCH_SIZE)
+            for field_names, changed in changed_entries.items():
+                Entry.objects.bulk_update(changed, field_names, batch_size=BULK_BATCH_SIZE)
 
-        if isinstance(value, struct_time):
-            value = strftime('%Y-%m-%dT%H:%M:%SZ', value)
+            # not every database returns the ids of bulk created rows
+            if new_entries and new_entries[0].pk is None:
+                ids = {}
+                for batch in chunks([entry.guid for entry in new_entries], BULK_BATCH_SIZE):
+                    ids.update(Entry.objects.filter(source=source, guid__in=batch).values_list('guid', 'id'))
+                for entry in new_entries:
+                    entry.pk = ids[entry.guid]
 
-        setattr(entry, field_name, value)
+            written = new_entries + [entry for changed in changed_entries.values() for entry in changed]
 
-    if isinstance(entry.image_url, list) and entry.image_url:
-        entry.image_url = entry.image_url[0].get('url', None)
+        with stage_timer('enclosures'):
+            sync_enclosures([(entry, mapped[entry.guid].enclosures) for entry in written])
 
-    entry.save()
-    return entry
+    # saved with the rest of the source by the caller
+    record_arrivals(source, [entry.created for entry in new_entries])
+    if new_entries:
+        source.last_new_entry = timezone.now()
 
+    updated = len(written) - len(new_entries)
+    counts = EntryCounts(len(new_entries), updated, len(existing) - updated)
+    metrics.record(entries_written, counts.inserted, kind='inserted')
+    metrics.record(entries_written, counts.updated, kind='updated')
+    logger.info('%s: %d entries inserted, %d updated, %d unchanged', source, *counts)
+    return counts
 
-def update_enclosures(entry: Entry, entry_data: feedparser.util.FeedParserDict):
-    """
-    Create enclosures for the given entry
 
-    ### Parameters
-    - entry (Entry): the netry to update
-    - encloure_data (FeedParserDict): the data to parse into enclosures
-    """
-    # delete enclosures that don't exist
-    entry.enclosures.all().delete()
 
-    # add an enclosure for each youtube video link
-    # youtube links may be in the normal 'link' attribute
-    if link := entry_data.get('link', ''):
-        parsed_link = urlparse(link)
+def chunks(items: list, size: int):
+    """split a list into lists of at most `size` items, to keep queries under the database's parameter limit"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
-        if parsed_link.netloc == 'www.youtube.com':
-            create_embeded_youtube_enclosure(entry, None, parsed_link)
 
-    # for each set of enclosure data:
-    for enclosure_data in entry_data.get('enclosures', []):
-        parsed_link = urlparse(link)
 
-        if parsed_link.netloc == 'www.youtube.com':
-            create_embeded_youtube_enclosure(entry, enclosure_data, parsed_link)
-            continue
+def sync_enclosures(entry_enclosure_pairs: list[tuple[Entry, list[tuple[str, str, int]]]]) -> tuple[int, int]:
+    """
+    Make the stored enclosures of each entry match the given enclosures. Only the differences are written, the
+    existing enclosures of every entry are read in one query and the changes are written in bulk.
 
-        create_enclosure(entry, enclosure_data)
+    ### Parameters
+    - entry_enclosure_pairs: each entry with the list of (href, type, length) it should have
 
+    ### Returns
+    - int: the number of enclosures created
+    - int: the number of enclosures deleted
+    """
+    existing = defaultdict(list)
+    entry_ids = [entry.pk for entry, _ in entry_enclosure_pairs]
+    for batch in chunks(entry_ids, BULK_BATCH_SIZE):
+        for enclosure_id, entry_id, href, enclosure_type, length in Enclosure.objects.filter(entry_id__in=batch).values_list(
+                'id', 'entry_id', 'href', 'type', 'length'):
+            existing[entry_id].append((enclosure_id, (href, enclosure_type, length)))
+
+    to_create = []
+    to_delete = []
+    for entry, enclosures in entry_enclosure_pairs:
+        remaining = Counter(enclosures)
+
+        for enclosure_id, key in existing[entry.pk]:
+            if remaining[key] > 0:
+                remaining[key] -= 1
+            else:
+                to_delete.append(enclosure_id)
 
+        for (href, enclosure_type, length), count in remaining.items():
+            to_create.extend(Enclosure(entry=entry, href=href, type=enclosure_type, length=length) for _ in range(count))
 
-def create_enclosure(entry: Entry, enclosure_data: feedparser.util.FeedParserDict) -> Enclosure:
-    """the standard way to create an enclosure"""
-    if not enclosure_data:
-        return None
+    for batch in chunks(to_delete, BULK_BATCH_SIZE):
+        Enclosure.objects.filter(pk__in=batch).delete()
+    Enclosure.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
 
-    return Enclosure.objects.create(
-        entry = entry,
-        length = enclosure_data.get('length', 0),
-        href = enclosure_data.get('href', ''),
-        type = enclosure_data.get('type', ''),
-    )
-
-
-
-def create_embeded_youtube_enclosure(entry: Entry, enclosure_data: feedparser.util.FeedParserDict, youtube_link:ParseResult) -> Enclosure:
-    """youtube enclosures need to be modified to form an embedable link"""
-    # if the link is already an embeded link
-    if youtube_link.path.startswith('embed/'):
-        return Enclosure.objects.create(
-            entry = entry,
-            length = 0,
-            href = youtube_link.geturl(),
-            type = 'youtube',
-        )
-
-    # check if the youtube link contains a video id
-    # if no video id is present, create a normal enclosure
-    query = parse_qs(youtube_link.query)
-    if 'v' not in query:
-        return create_enclosure(entry, enclosure_data)
-
-    video_id = query['v'][0]
-    embeded_link = f"https://www.youtube.com/embed/{video_id}"
-
-    return Enclosure.objects.create(
-        entry = entry,
-        length = 0,
-        href = embeded_link,
-        type = 'youtube',
-    )
+    metrics.record(enclosures_written, len(to_create), kind='created')
+    metrics.record(enclosures_written, len(to_delete), kind='deleted')
+    logger.debug('%d enclosures created, %d deleted', len(to_create), len(to_delete))
+    return len(to_create), len(to_delete)
@@ -0,0 +1,156 @@
+"""
+Scheduling policies decide when a source is next fetched, from its state after a fetch.
+
+A policy is a class with a `next_fetch` method. The built in policies are registered by name in `POLICIES`, any
+other policy can be given by its dotted import path. Each source uses the policy named by its `schedule_policy`, or
+the `FEEDS_SCHEDULE_POLICY` setting if it has none.
+"""
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.utils.module_loading import import_string
+from feeds.models import Source
+from .predict import set_next_fetch, fetch_jitter
+from .tiers import apply_cadence, classify_tier
+from .metrics import stage_timer
+
+logger = logging.getLogger('Fetch Policies')
+
+
+class SchedulePolicy:
+    """The interface of a scheduling policy"""
+    name = ''
+
+    def next_fetch(self, source: Source, now: datetime, new_entries: int) -> datetime:
+        """
+        When to fetch a source next. The policy may keep its own state on the source, which is saved by the caller.
+
+        ### Parameters
+        - source: the source that was just fetched, with its arrival statistics already updated
+        - now: the time of the fetch
+        - new_entries: the number of new entries the fetch found
+
+        ### Returns
+        - datetime: when the source is next due
+        """
+        raise NotImplementedError
+
+
+
+class FixedIntervalPolicy(SchedulePolicy):
+    """
+    Fetch every source at the same interval
+
+    ### Parameters
+    - interval: the seconds between fetches
+    """
+    name = 'fixed'
+
+    def __init__(self, interval: float = 60*60):
+        self.interval = interval
+
+
+    def next_fetch(self, source: Source, now: datetime, new_entries: int) -> datetime:
+        return now + timedelta(seconds=self.interval)
+
+
+
+class PredictivePolicy(SchedulePolicy):
+    """Predict the next entry from the time of day and weekday the source's entries arrive, see `set_next_fetch`"""
+    name = 'predictive'
+
+    def next_fetch(self, source: Source, now: datetime, new_entries: int) -> datetime:
+        set_next_fetch(source, now)
+        return source.due_fetch
+
+
+
+class AdaptivePolicy(SchedulePolicy):
+    """
+    Adjust each source's interval from the results of its fetches, backing off multiplicatively and tightening
+    additively. Every fetch that finds nothing new, including 304 not modified responses, multiplies the interval by the backoff
+    so quiet sources are fetched less and less often. Every fetch that finds new entries takes a fixed step off the
+    interval so busy sources are fetched sooner. The interval stays between the source's `min_interval` and the
+    max interval, and is kept on the source's `fetch_interval`.
+
+    ### Parameters
+    - backoff: what to multiply the interval by after a fetch finds nothing new, defaults to `FEEDS_ADAPTIVE_BACKOFF`
+    - step: the seconds to take off the interval after a fetch finds new entries, defaults to `FEEDS_ADAPTIVE_STEP`
+    - max_interval: the longest seconds between fetches, defaults to `FEEDS_ADAPTIVE_MAX_INTERVAL`
+    """
+    name = 'adaptive'
+
+    def __init__(self, backoff: float = None, step: float = None, max_interval: float = None):
+        self.backoff = getattr(settings, 'FEEDS_ADAPTIVE_BACKOFF') if backoff is None else backoff
+        self.step = getattr(settings, 'FEEDS_ADAPTIVE_STEP') if step is None else step
+        self.max_interval = getattr(settings, 'FEEDS_ADAPTIVE_MAX_INTERVAL') if max_interval is None else max_interval
+
+
+    def next_fetch(self, source: Source, now: datetime, new_entries: int) -> datetime:
+        interval = source.fetch_interval or source.min_interval
+
+        if new_entries:
+            interval -= self.step
+        else:
+            interval *= self.backoff
+
+        source.fetch_interval = min(max(interval, source.min_interval), max(self.max_interval, source.min_interval))
+        return now + timedelta(seconds=source.fetch_interval)
+
+
+
+POLICIES = {policy.name: policy for policy in (FixedIntervalPolicy, PredictivePolicy, AdaptivePolicy)}
+
+
+@lru_cache
+def policy_class(name: str) -> type[SchedulePolicy]:
+    """the policy class for a registered name or dotted import path"""
+    return POLICIES[name] if name in POLICIES else import_string(name)
+
+
+
+def get_policy(name: str, **kwargs) -> SchedulePolicy:
+    """
+    Create a policy by its registered name or dotted import path
+
+    ### Parameters
+    - name: eg: 'predictive', or 'myapp.scheduling.MyPolicy'
+    - kwargs: passed to the policy class
+    """
+    return policy_class(name)(**kwargs)
+
+
+
+def source_policy_name(source: Source) -> str:
+    """the name of the policy a source uses"""
+    return source.schedule_policy or getattr(settings, 'FEEDS_SCHEDULE_POLICY')
+
+
+
+def schedule_next_fetch(source: Source, new_entries: int = 0, now: datetime = None):
+    """
+    Set when a source is next due, with the source's scheduling policy, after moving the source to the tier that
+    fits its activity. The due time is kept within the cadence of the tier and at least the source's `min_interval`
+    after the fetch, then delayed by the source's jitter. The source is not saved.
+
+    ### Parameters
+    - source: the source that was just fetched
+    - new_entries: the number of new entries the fetch found
+    - now: the time of the fetch, defaults to the current time
+    """
+    now = now or datetime.now(tz=ZoneInfo('UTC'))
+
+    with stage_timer('schedule'):
+        try:
+            policy = get_policy(source_policy_name(source))
+        except ImportError:
+            logger.exception('Unknown scheduling policy for %s, using the default policy', source)
+            policy = get_policy(getattr(settings, 'FEEDS_SCHEDULE_POLICY'))
+
+        source.tier = classify_tier(source, now)
+        due_fetch = apply_cadence(source, policy.next_fetch(source, now, new_entries), now)
+        # a prediction can fall before the fetch, eg: earlier today, which would leave the source due and claimed
+        due_fetch = max(due_fetch, now + timedelta(seconds=source.min_interval))
+        source.due_fetch = due_fetch + fetch_jitter(source)
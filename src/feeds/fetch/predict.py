@@ -1,26 +1,32 @@
 """
 This module contains the functions that predict when the next feed entry will be posted based on past data
 """
+import math
 from statistics import stdev, mean
 from datetime import datetime, timedelta, time, date
 from zoneinfo import ZoneInfo
+from django.conf import settings
 from django.db.models import Q
-from feeds.models import Source, Entry
+from django.utils import timezone
+from feeds.models import Source, empty_weekdays
 
-MAX_ENTRIES = 50
+SECONDS_PER_DAY = 86400
 
+# Knuth's multiplicative hash constant, spreads consecutive source ids evenly over the jitter window
+JITTER_MULTIPLIER = 2654435761
 
-def set_next_fetch(source: Source) -> datetime:
-    """Calculate and set when the given source should next be polled
+
+def set_next_fetch(source: Source, now: datetime = None) -> datetime:
+    """Calculate and set when the given source should next be polled, from the source's arrival statistics
 
     ### Parameters
     - source: the feed source to set the poll date on
+    - now: the time to predict from, defaults to the current time
     """
-    entries = list(Entry.objects.all()[:MAX_ENTRIES])
+    now = now or datetime.now(tz=ZoneInfo('UTC'))
 
-    mean_time, std_dev = predict_time(entries)
-    predicted_date = predict_day(entries)
-    now = datetime.now(tz=ZoneInfo('UTC'))
+    mean_time, std_dev = predict_time(source)
+    predicted_date = predict_day(source, now.date())
 
     tomarrow = (now + timedelta(days=1)).date()
 
@@ -41,22 +47,56 @@ def set_next_fetch(source: Source) -> datetime:
 
 
 
-def predict_time(entries: list[Entry]) -> tuple[time, timedelta]:
-    """Predicts the time of day and standard deviation from it of the next entry
+def record_arrivals(source: Source, created_times: list[datetime]):
+    """Add the creation times of newly found entries to the arrival statistics of their source. The source is not saved.
 
     ### Parameters
-    - entries, a list of feed entries
+    - source: the source the entries were found in
+    - created_times: the creation time of each new entry
+    """
+    weekdays = list(source.arrival_weekdays or empty_weekdays())
+
+    for created in created_times:
+        if created.tzinfo is not None:
+            created = created.astimezone(ZoneInfo('UTC'))
+
+        angle = 2 * math.pi * seconds_since_midnight(created) / SECONDS_PER_DAY
+        source.arrival_sin += math.sin(angle)
+        source.arrival_cos += math.cos(angle)
+        source.arrival_count += 1
+        weekdays[created.weekday()] += 1
+
+        if source.arrival_first is None or created < source.arrival_first:
+            source.arrival_first = created
+
+    source.arrival_weekdays = weekdays
+
+
+
+def predict_time(source: Source) -> tuple[time, timedelta]:
+    """Predicts the time of day and standard deviation from it of the next entry, from the circular mean of the
+    times of day the source's entries were created
+
+    ### Parameters
+    - source: the source with its arrival statistics
 
     ### Returns
     - time: the of day predicted
     - timedelta: the standard defiation
     """
-    if not entries:
+    if not source.arrival_count:
         return time(hour=12), timedelta(seconds=0)
 
-    # convert all created times to seconds since midnight
-    seconds = [seconds_since_midnight(entry.created) for entry in entries]
-    mean_value, deviation = circled_mean(seconds, 0, 86400)
+    mean_angle = math.atan2(source.arrival_sin, source.arrival_cos) % (2 * math.pi)
+    mean_value = min(mean_angle * SECONDS_PER_DAY / (2 * math.pi), SECONDS_PER_DAY - 1)
+
+    # the mean resultant length is 1 when every entry is at the same time of day and near 0 when they are spread out
+    resultant = min(math.hypot(source.arrival_sin, source.arrival_cos) / source.arrival_count, 1.0)
+    if resultant > 0:
+        deviation = math.sqrt(-2 * math.log(resultant)) * SECONDS_PER_DAY / (2 * math.pi)
+    else:
+        deviation = SECONDS_PER_DAY / 2
+    deviation = min(deviation, SECONDS_PER_DAY / 2)
 
     deviation_dt = timedelta(seconds=deviation)
     predicted_time = (datetime.min + timedelta(seconds=mean_value)).time()
@@ -77,6 +117,9 @@ def circled_mean(data: list, min_value, max_value) -> tuple:
     - the average
     - the standard deviation
     """
+    if len(data) < 2:
+        return mean(data), 0.0
+
     middle = (min_value + max_value)/2
     range_length = max_value - min_value
     sorted_data = sorted(data)
@@ -118,7 +161,7 @@ def seconds_since_midnight(date_time: datetime) -> float:
 
 
 
-def predict_day(entries: list[Entry]) -> date:
+def predict_day(source: Source, today: date = None) -> date:
     """Predict the next day that there will be a new entry. It does this by tallying what days of the week new
     entries happen and finding the next one where an entry was posted.
 
@@ -126,38 +169,88 @@ def predict_day(entries: list[Entry]) -> date:
     split over many weekdays
     
     ### Parameters
-    - entries: list of entries
+    - source: the source with its arrival statistics
+    - today: the day to predict from, defaults to the current UTC date
 
     ### Returns
     date of next predicted entry
     """
-    # if less than a week of entries present, assume dayly
-    if len(entries) == 0 or (entries[-1].created).date() > date.today() - timedelta(days=7):
-        return date.today()
+    today = today or datetime.now(tz=ZoneInfo('UTC')).date()
 
-    # count by weekday and determine days with entries
-    weekday_tally = [0]*7
-    for entry in entries:
-        weekday_tally[entry.created.weekday()] += 1
+    # if less than a week of entries present, assume dayly
+    if not source.arrival_count or source.arrival_first is None or source.arrival_first.date() > today - timedelta(days=7):
+        return today
 
-    today_weekday = datetime.now().weekday()
+    # the count by weekday of the days with entries
+    weekday_tally = source.arrival_weekdays
+    today_weekday = today.weekday()
 
     # shift the week tally to start on todays weekday
     reordered_weekdays = weekday_tally[today_weekday:] + weekday_tally[:today_weekday]
 
     for i, tally in enumerate(reordered_weekdays):
         if tally > 0:
-            return date.today() + timedelta(days=i)
+            return today + timedelta(days=i)
 
-    return date.today() + timedelta(days=1)
+    return today + timedelta(days=1)
 
 
 
-def due_sources() -> list:
-    """Get the list of sources due for a fetch.
+def due_sources(tier: str = None, now: datetime = None) -> list:
+    """Get the list of sources due for a fetch, served in due order by the indexes of live sources by due time,
+    and by tier and due time, on `Source`.
+
+    ### Parameters
+    - tier: only the sources in this tier, see feeds.fetch.tiers
+    - now: the time the sources are due by, defaults to the current time
 
     ### Returns
     - list of sources to update
     """
-    sources = Source.objects.filter(Q(due_fetch__lt = datetime.now()) & Q(live = True))
+    now = now or timezone.now()
+    sources = Source.objects.filter(Q(live = True) & Q(due_fetch__lt = now))
+    if tier:
+        sources = sources.filter(tier=tier)
     return sources.order_by("due_fetch")
+
+
+
+def next_due(count: int = 1, tier: str = None) -> list[Source]:
+    """The next live sources to fall due, whether they are due yet or not
+
+    ### Parameters
+    - count: the number of sources
+    - tier: only the sources in this tier
+
+    ### Returns
+    - list of up to `count` sources, earliest due first
+    """
+    sources = Source.objects.filter(live=True)
+    if tier:
+        sources = sources.filter(tier=tier)
+    return list(sources.order_by('due_fetch')[:count])
+
+
+
+def next_due_time() -> datetime | None:
+    """The earliest time a live source is due for a fetch, or None if there are no live sources"""
+    sources = Source.objects.filter(live=True).order_by('due_fetch').values_list('due_fetch', flat=True)[:1]
+    return sources[0] if sources else None
+
+
+
+def fetch_jitter(source: Source) -> timedelta:
+    """
+    A delay between 0 and `FEEDS_FETCH_JITTER` seconds that is always the same for a source, added to its due time
+    so sources predicted for the same minute are spread out instead of all falling due together
+
+    ### Parameters
+    - source: a saved source, unsaved sources get no delay
+
+    ### Returns
+    - timedelta: the delay
+    """
+    if source.pk is None:
+        return timedelta(0)
+    fraction = (source.pk * JITTER_MULTIPLIER) % 2**32 / 2**32
+    return timedelta(seconds=fraction * getattr(settings, 'FEEDS_FETCH_JITTER'))
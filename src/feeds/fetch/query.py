@@ -5,10 +5,13 @@ import logging
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import feedparser
-import requests
 from requests.exceptions import RequestException
 from django.conf import settings
 from feeds.models import Source
+from .session import get_session
+from .conditional import conditional_headers, update_validators, record_response
+from .metrics import metrics, stage_timer, fetches, bytes_downloaded
+from .history import start_attempt, note_attempt
 
 logger = logging.getLogger('Fetch Query')
 
@@ -26,6 +29,7 @@ def query_source(source: Source, no_cache: bool) -> feedparser.util.FeedParserDi
     """
     logger.info('Requesting Source: %s', source)
     now = datetime.now(tz=ZoneInfo('UTC'))
+    start_attempt(source, now)
 
     if source.last_feched is not None:
         interval = (now - source.last_feched).total_seconds()
@@ -37,21 +41,26 @@ def query_source(source: Source, no_cache: bool) -> feedparser.util.FeedParserDi
         "User-Agent": getattr(settings, 'FEEDS_USER_AGENT'),
         }
     if not no_cache:
-        headers["If-None-Match"] = str(source.etag)
-        headers["If-Modified-Since"] = str(source.last_modified)
-
-    # query the feed
-    try:
-        response = requests.get(
-            source.feed_url,
-            timeout=10,
-            headers=headers
-            )
-
-    except RequestException as exc:
-        logger.exception('Error querying the source: %s', source.feed_url)
-        source.last_result = str(exc)
+        headers.update(conditional_headers(source))
+
+    # query the feed, the error is handled once the timer has stopped so the attempt records how long it took
+    response = error = None
+    with stage_timer('query') as timing:
+        try:
+            response = get_session().get(
+                source.feed_url,
+                timeout=10,
+                headers=headers
+                )
+        except RequestException as exc:
+            error = exc
+
+    if error is not None:
+        logger.error('Error querying the source: %s', source.feed_url, exc_info=error)
+        source.last_result = str(error)
         source.status_code = 600
+        metrics.record(fetches, 1, status=source.status_code)
+        note_attempt(source, elapsed=timing.seconds)
         return None
 
     # record the feed status and codes
@@ -59,9 +68,12 @@ def query_source(source: Source, no_cache: bool) -> feedparser.util.FeedParserDi
 
     source.last_feched = now
     source.status_code = response.status_code
-    source.etag = response.headers.get('Etag', source.etag)
-    source.last_modified = response.headers.get('Last-Modified', source.last_modified)
     source.last_result = response.reason
+    update_validators(source, response)
+    record_response(source, response)
+    metrics.record(fetches, 1, status=response.status_code)
+    metrics.record(bytes_downloaded, len(response.content))
+    note_attempt(source, elapsed=timing.seconds, content_length=len(response.content))
 
     # handle response codes
     if response.status_code in (301, 308): # perminent redirect
@@ -72,8 +84,8 @@ def query_source(source: Source, no_cache: bool) -> feedparser.util.FeedParserDi
         return None
 
     elif response.status_code == 429: # 429 means too many requests,
-        if interval > source.min_cadence: # avoid doing anything if fetched early
-            source.min_cadence += 1200 # add 20 minuts to minimum interval
+        if interval > source.min_interval: # avoid doing anything if fetched early
+            source.min_interval += 1200 # add 20 minuts to minimum interval
         return None
 
     # turn off source if we get a 404 or any other 400 code
@@ -82,4 +94,5 @@ def query_source(source: Source, no_cache: bool) -> feedparser.util.FeedParserDi
         return None
 
     source.last_success = source.last_feched
+    source.content_type = response.headers.get('Content-Type')
     return response.content
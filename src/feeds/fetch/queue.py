@@ -0,0 +1,153 @@
+"""
+Claim due sources with an expiring lease, so many fetch processes can work through the due sources together
+without fetching the same source twice
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from feeds.models import Source
+from .predict import due_sources
+from .tiers import tier_quotas
+
+logger = logging.getLogger('Fetch Queue')
+
+
+def worker_name() -> str:
+    """A name for this process to record as the owner of the sources it claims"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+
+def unleased(now) -> Q:
+    """Filter for sources that are not claimed by a worker, or whose claim has run out"""
+    return Q(lease_expires__isnull=True) | Q(lease_expires__lt=now)
+
+
+
+def claim_due_sources(limit: int = None, owner: str = None, lease_seconds: float = None) -> list[Source]:
+    """
+    Claim a batch of due sources. Claimed sources are not handed to any other worker until they are released or
+    the lease runs out.
+
+    A limited batch is shared between the hot, warm and cold tiers in proportion to their budgets, see
+    `feeds.fetch.tiers`.
+
+    On databases that support it the rows are locked with `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent
+    workers each get a different batch without waiting on each other. Other databases (eg: SQLite) claim each row
+    with a conditional update that only succeeds if the row is still unclaimed.
+
+    ### Parameters
+    - limit: the most sources to claim, None claims every due source
+    - owner: the name of the claiming worker, defaults to the host name and process id
+    - lease_seconds: how long the claim lasts, defaults to `FEEDS_LEASE_SECONDS`
+
+    ### Returns
+    - list of the claimed sources, in due order
+    """
+    owner = owner or worker_name()
+    now = timezone.now()
+    expires = now + timedelta(seconds=lease_seconds or getattr(settings, 'FEEDS_LEASE_SECONDS'))
+
+    if limit:
+        quotas = tier_quotas(limit, due_tier_counts(now))
+        batches = [(due_sources(tier, now), quota) for tier, quota in quotas.items() if quota]
+    else:
+        batches = [(due_sources(now=now), None)]
+
+    sources = []
+    for due, quota in batches:
+        sources.extend(_claim(due.filter(unleased(now)), quota, owner, expires, now))
+    sources.sort(key=lambda source: source.due_fetch)
+
+    for source in sources:
+        source.lease_owner = owner
+        source.lease_expires = expires
+
+    logger.info('%s claimed %d sources', owner, len(sources))
+    return sources
+
+
+
+def due_tier_counts(now) -> dict[str, int]:
+    """the number of unclaimed due sources in each tier"""
+    counts = due_sources(now=now).filter(unleased(now)).order_by().values('tier').annotate(count=Count('pk'))
+    return {row['tier']: row['count'] for row in counts}
+
+
+
+def _claim(candidates, limit: int | None, owner: str, expires, now) -> list[Source]:
+    """claim up to `limit` of the candidate sources, see `claim_due_sources`"""
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            sources = candidates.select_for_update(skip_locked=True)
+            if limit:
+                sources = sources[:limit]
+            sources = list(sources)
+            Source.objects.filter(pk__in=[source.pk for source in sources]).update(lease_owner=owner, lease_expires=expires)
+        return sources
+
+    # read a few more candidates than needed in case other workers claim some of them first
+    if limit:
+        candidates = candidates[:limit * 2]
+
+    sources = []
+    for source in candidates:
+        # only claim the row if no other worker has claimed or fetched it since it was read
+        claimed = Source.objects.filter(unleased(now), pk=source.pk, due_fetch=source.due_fetch).update(
+            lease_owner=owner,
+            lease_expires=expires,
+        )
+        if claimed:
+            sources.append(source)
+        if limit and len(sources) >= limit:
+            break
+    return sources
+
+
+
+def next_claim_time(now=None):
+    """
+    The earliest time a live source can be claimed: when it is due, or when its lease runs out if it is claimed.
+    Sources that failed stay claimed while they are still due, see `release_sources`, so going by the due time
+    alone would find them due again straight away.
+
+    ### Parameters
+    - now: the time leases are checked against, defaults to the current time
+
+    ### Returns
+    - datetime: the time, None if there are no live sources
+    """
+    now = now or timezone.now()
+    live = Source.objects.filter(live=True)
+    times = list(live.filter(unleased(now)).order_by('due_fetch').values_list('due_fetch', flat=True)[:1])
+    times.append(live.exclude(unleased(now)).aggregate(time=Min(Greatest('due_fetch', 'lease_expires')))['time'])
+    times = [time for time in times if time is not None]
+    return min(times) if times else None
+
+
+
+def release_sources(sources: list[Source], owner: str = None):
+    """
+    Release the claim on sources so they can be claimed again once they are due. Sources that are still due, eg:
+    because they failed to update, keep their claim until it runs out so they are not retried straight away.
+
+    ### Parameters
+    - sources: the sources to release
+    - owner: the name of the worker that claimed them, defaults to the host name and process id
+    """
+    owner = owner or worker_name()
+    Source.objects.filter(
+        pk__in=[source.pk for source in sources],
+        lease_owner=owner,
+        due_fetch__gte=timezone.now(),
+    ).update(lease_owner=None, lease_expires=None)
+
+    for source in sources:
+        source.lease_owner = None
+        source.lease_expires = None
@@ -0,0 +1,166 @@
+"""
+Re-plan when every source is next due in one pass, eg: after changing the scheduling or recovering from an outage.
+
+The prediction is the same as `set_next_fetch`, but when NumPy is installed it is calculated for a whole batch of
+sources at once with array operations. Without NumPy each source is predicted in turn. Only the sources that use
+the predictive scheduling policy are rescheduled, the other policies plan from the result of each fetch.
+"""
+import logging
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from feeds.models import Source
+from .predict import set_next_fetch, fetch_jitter, SECONDS_PER_DAY
+from .tiers import apply_cadence
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, install the 'fast' extra to vectorize
+    np = None
+
+logger = logging.getLogger('Fetch Reschedule')
+
+# the most sources to read and predict at a time
+RESCHEDULE_BATCH_SIZE = 10000
+
+# the fields the prediction reads
+PREDICT_FIELDS = ('min_interval', 'tier', 'arrival_count', 'arrival_sin', 'arrival_cos', 'arrival_weekdays', 'arrival_first')
+
+
+def reschedule_sources(sources=None, now: datetime = None, batch_size: int = RESCHEDULE_BATCH_SIZE,
+                       vectorize: bool = None) -> int:
+    """
+    Set the due time of many sources from their arrival statistics, written back in bulk
+
+    ### Parameters
+    - sources: a queryset of the sources to reschedule, defaults to every live source. Only the ones that use the
+      predictive policy are rescheduled
+    - now: the time to predict from, defaults to the current time
+    - batch_size: the most sources to read, predict and write at a time
+    - vectorize: predict with NumPy, defaults to True if NumPy is installed
+
+    ### Returns
+    - int: the number of sources rescheduled
+    """
+    if sources is None:
+        sources = Source.objects.filter(live=True)
+    sources = sources.filter(predictive_sources())
+    now = now or datetime.now(tz=ZoneInfo('UTC'))
+    vectorize = np is not None if vectorize is None else vectorize
+    if vectorize and np is None:
+        raise ImportError('NumPy is needed to vectorize rescheduling')
+
+    count = 0
+    batch = []
+    for source in sources.only(*PREDICT_FIELDS).order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(source)
+        if len(batch) >= batch_size:
+            count += _reschedule_batch(batch, now, vectorize)
+            batch = []
+
+    if batch:
+        count += _reschedule_batch(batch, now, vectorize)
+
+    logger.info('Rescheduled %d sources', count)
+    return count
+
+
+
+def predictive_sources() -> Q:
+    """Filter for the sources that use the predictive scheduling policy"""
+    predictive = Q(schedule_policy='predictive')
+    if getattr(settings, 'FEEDS_SCHEDULE_POLICY') == 'predictive':
+        predictive |= Q(schedule_policy__isnull=True) | Q(schedule_policy='')
+    return predictive
+
+
+
+def _reschedule_batch(sources: list[Source], now: datetime, vectorize: bool) -> int:
+    """predict and write the due time of a batch of sources, within the cadence of their tiers and jittered"""
+    if vectorize:
+        for source, due_fetch in zip(sources, predict_due_times(sources, now)):
+            source.due_fetch = due_fetch
+    else:
+        for source in sources:
+            set_next_fetch(source, now)
+
+    for source in sources:
+        source.due_fetch = apply_cadence(source, source.due_fetch, now) + fetch_jitter(source)
+
+    write_due_times(sources)
+    return len(sources)
+
+
+
+def write_due_times(sources: list[Source]):
+    """
+    Write the due time of many sources in one transaction. `bulk_update` builds a CASE expression for every row,
+    which takes longer than the prediction itself, so a single parameterised UPDATE is run for all the rows instead.
+    """
+    field = Source._meta.get_field('due_fetch')
+    quote = connection.ops.quote_name
+    sql = (
+        f"UPDATE {quote(Source._meta.db_table)} SET {quote(field.column)} = %s "
+        f"WHERE {quote(Source._meta.pk.column)} = %s"
+    )
+    params = [(field.get_db_prep_save(source.due_fetch, connection), source.pk) for source in sources]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+
+def predict_due_times(sources: list[Source], now: datetime) -> list[datetime]:
+    """
+    The due time `set_next_fetch` would give each source, calculated with array operations
+
+    ### Parameters
+    - sources: the sources with their arrival statistics
+    - now: the time to predict from
+
+    ### Returns
+    - list of the due time of each source
+    """
+    count = np.array([source.arrival_count for source in sources], dtype=float)
+    sin_sum = np.array([source.arrival_sin for source in sources], dtype=float)
+    cos_sum = np.array([source.arrival_cos for source in sources], dtype=float)
+    min_interval = np.array([source.min_interval for source in sources], dtype=float)
+    weekdays = np.array([source.arrival_weekdays or [0] * 7 for source in sources], dtype=float).reshape(len(sources), 7)
+
+    today = now.date()
+    week_ago = today - timedelta(days=7)
+    recent = np.array([source.arrival_first is None or source.arrival_first.date() > week_ago for source in sources])
+
+    # the circular mean time of day and its deviation, see predict_time
+    has_entries = count > 0
+    safe_count = np.where(has_entries, count, 1)
+    mean = np.mod(np.arctan2(sin_sum, cos_sum), 2 * np.pi) * SECONDS_PER_DAY / (2 * np.pi)
+    mean = np.minimum(mean, SECONDS_PER_DAY - 1)
+    resultant = np.minimum(np.hypot(sin_sum, cos_sum) / safe_count, 1.0)
+    with np.errstate(divide='ignore'):
+        deviation = np.sqrt(-2 * np.log(resultant)) * SECONDS_PER_DAY / (2 * np.pi)
+    deviation = np.minimum(np.nan_to_num(deviation, nan=SECONDS_PER_DAY / 2, posinf=SECONDS_PER_DAY / 2), SECONDS_PER_DAY / 2)
+    mean = np.where(has_entries, mean, 12 * 3600)
+    deviation = np.where(has_entries, deviation, 0.0)
+
+    # the days until the next weekday with entries, see predict_day
+    reordered = np.roll(weekdays, -today.weekday(), axis=1) > 0
+    day = np.where(reordered.any(axis=1), reordered.argmax(axis=1), 1)
+    day = np.where(~has_entries | recent, 0, day)
+
+    # seconds from now to the start of today and of tomarrow
+    midnight = datetime.combine(today, datetime.min.time(), tzinfo=ZoneInfo('UTC'))
+    today_start = (midnight - now).total_seconds()
+    tomarrow_start = today_start + SECONDS_PER_DAY
+
+    # the branches of set_next_fetch
+    zone_end = today_start + mean + deviation
+    offset = np.where(
+        day > 1,
+        tomarrow_start + mean + deviation,
+        np.where((day < 1) & (zone_end > 0), min_interval, tomarrow_start + mean - deviation),
+    )
+
+    return [now + timedelta(seconds=seconds) for seconds in offset.tolist()]
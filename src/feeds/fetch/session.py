@@ -0,0 +1,82 @@
+"""
+A shared http session so that connections to a host are kept alive and reused between feeds
+"""
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+_session = None # pylint: disable=invalid-name
+_session_lock = threading.Lock()
+# the number of fetch_session blocks open, the blocks inside the first one share its session
+_fetch_session_depth = 0 # pylint: disable=invalid-name
+
+
+def create_session(pool_connections: int = None, pool_maxsize: int = None) -> requests.Session:
+    """
+    Create a session with a connection pool per host
+
+    ### Parameters
+    - pool_connections: the number of hosts to keep a connection pool for, defaults to `FEEDS_POOL_CONNECTIONS`
+    - pool_maxsize: the number of connections to keep open to each host, defaults to `FEEDS_POOL_MAXSIZE`
+
+    ### Returns
+    - requests.Session: the new session
+    """
+    adapter = HTTPAdapter(
+        pool_connections = pool_connections or getattr(settings, 'FEEDS_POOL_CONNECTIONS'),
+        pool_maxsize = pool_maxsize or getattr(settings, 'FEEDS_POOL_MAXSIZE'),
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+
+def get_session() -> requests.Session:
+    """Get the session feeds are currently queried with, creating one if none exists"""
+    global _session # pylint: disable=global-statement
+
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+
+@contextmanager
+def fetch_session(pool_maxsize: int = None):
+    """
+    Query feeds with a fresh session for the duration of the block, so a whole refresh run shares its connections.
+    All the connections are closed when the block exits. A block inside another one shares the outer session and
+    leaves it open, so a long running process can keep its connections between runs.
+
+    ### Parameters
+    - pool_maxsize: the number of connections to keep open to each host, it should be at least the number of
+    queries made at the same time. Defaults to `FEEDS_POOL_MAXSIZE`
+    """
+    global _session, _fetch_session_depth # pylint: disable=global-statement
+
+    with _session_lock:
+        nested = _fetch_session_depth > 0
+        _fetch_session_depth += 1
+        if nested:
+            session = previous = _session
+        else:
+            if pool_maxsize is not None:
+                pool_maxsize = max(pool_maxsize, getattr(settings, 'FEEDS_POOL_MAXSIZE'))
+            session = create_session(pool_maxsize=pool_maxsize)
+            previous, _session = _session, session
+
+    try:
+        yield session
+
+    finally:
+        with _session_lock:
+            _fetch_session_depth -= 1
+            _session = previous
+        if not nested:
+            session.close()
@@ -0,0 +1,102 @@
+"""
+Replay the arrival times of entries through scheduling policies under a simulated clock, to compare how many
+fetches each policy makes and how long new entries wait before they are found.
+
+Nothing is written to the database, each replay uses an unsaved copy of the source.
+"""
+import math
+from datetime import datetime, timedelta
+from feeds.models import Source
+from .policies import SchedulePolicy
+from .predict import record_arrivals
+
+# the shortest simulated time between fetches, so a policy that returns a due time in the past still moves forward
+MIN_STEP = timedelta(minutes=1)
+
+
+class SimulationResult:
+    """The totals of one or more replays of a policy"""
+
+    def __init__(self, policy: str):
+        self.policy = policy
+        self.fetches = 0
+        self.wasted = 0
+        self.latencies = []
+
+
+    def add(self, other: 'SimulationResult'):
+        """add the totals of another replay"""
+        self.fetches += other.fetches
+        self.wasted += other.wasted
+        self.latencies.extend(other.latencies)
+
+
+    @property
+    def entries(self) -> int:
+        """the number of entries found"""
+        return len(self.latencies)
+
+
+    @property
+    def mean_latency(self) -> float:
+        """the mean seconds between an entry being posted and being found"""
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+
+    @property
+    def p95_latency(self) -> float:
+        """the 95th percentile of the seconds between an entry being posted and being found"""
+        return percentile(self.latencies, 95)
+
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """the nearest rank percentile of the values, 0 if there are none"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+
+def simulate_source(policy: SchedulePolicy, arrivals: list[datetime], start: datetime, end: datetime,
+                    min_interval: float = 60*60) -> SimulationResult:
+    """
+    Replay the arrivals of one source through a policy
+
+    ### Parameters
+    - policy: the policy to schedule the fetches with
+    - arrivals: the times the source's entries were posted
+    - start: when the replay starts, the arrivals before it are the history the policy starts with
+    - end: when the replay ends
+    - min_interval: the source's minimum seconds between fetches
+
+    ### Returns
+    - SimulationResult: the fetches made, the fetches that found nothing, and the latency of each entry found
+    """
+    result = SimulationResult(policy.name)
+    arrivals = sorted(arrivals)
+    source = Source(feed_url='https://simulated.invalid/', min_interval=min_interval)
+
+    index = 0
+    while index < len(arrivals) and arrivals[index] < start:
+        index += 1
+    record_arrivals(source, arrivals[:index])
+
+    now = start
+    while now <= end:
+        first_new = index
+        while index < len(arrivals) and arrivals[index] <= now:
+            index += 1
+        new_arrivals = arrivals[first_new:index]
+
+        result.fetches += 1
+        if not new_arrivals:
+            result.wasted += 1
+        result.latencies.extend((now - arrival).total_seconds() for arrival in new_arrivals)
+
+        record_arrivals(source, new_arrivals)
+        now = max(policy.next_fetch(source, now, len(new_arrivals)), now + MIN_STEP)
+
+    return result
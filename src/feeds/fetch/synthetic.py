@@ -0,0 +1,275 @@
+"""
+Generated RSS, Atom and JSON feeds and a local http server for them, to benchmark fetching and parsing without
+the network.
+
+Every feed is made from a sequence of entries that never changes, a feed at version `v` lists the entries from
+`v * NEW_ENTRIES_PER_VERSION` onwards. Moving a feed to the next version adds that many new entries, the same way
+a real feed gains new posts and drops its oldest ones.
+"""
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger('Synthetic Feeds')
+
+FEED_KINDS = ('rss', 'atom', 'json')
+
+CONTENT_TYPES = {
+    'rss': 'application/rss+xml',
+    'atom': 'application/atom+xml',
+    'json': 'application/feed+json',
+}
+
+# the entries added to a feed each time it moves to its next version
+NEW_ENTRIES_PER_VERSION = 5
+
+# the time of the first entry of every feed, each later entry is an hour after the one before
+FIRST_ENTRY_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+    'magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo'
+).split()
+
+
+def entry_text(index: int, size: int) -> str:
+    """about `size` characters of words, different for each entry"""
+    words = []
+    length = 0
+    position = index
+    while length < size:
+        word = WORDS[position % len(WORDS)]
+        words.append(word)
+        length += len(word) + 1
+        position += 7
+    return ' '.join(words)
+
+
+
+def synthetic_feed(kind: str, feed_id: int, entries: int = 20, version: int = 0, entry_size: int = 500) -> bytes:
+    """
+    Generate a feed
+
+    ### Parameters
+    - kind: one of `FEED_KINDS`
+    - feed_id: a number that makes the feed's urls and guids unique
+    - entries: the number of entries in the feed
+    - version: the version of the feed, each version adds `NEW_ENTRIES_PER_VERSION` new entries
+    - entry_size: the number of characters in each entry's body
+
+    ### Returns
+    - bytes: the feed document, newest entry first
+    """
+    first = version * NEW_ENTRIES_PER_VERSION
+    items = []
+    for index in reversed(range(first, first + entries)):
+        items.append({
+            'guid': f'https://feeds.invalid/{feed_id}/entries/{index}',
+            'title': f'Entry {index} of feed {feed_id}',
+            'body': f'<p>{entry_text(index, entry_size)}</p>',
+            'published': FIRST_ENTRY_TIME + timedelta(hours=index),
+            'enclosure': f'https://feeds.invalid/{feed_id}/media/{index}.mp3' if index % 4 == 0 else None,
+        })
+
+    title = f'Synthetic feed {feed_id}'
+    link = f'https://feeds.invalid/{feed_id}/'
+
+    if kind == 'json':
+        return json.dumps({
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': title,
+            'home_page_url': link,
+            'items': [{
+                'id': item['guid'],
+                'url': item['guid'],
+                'title': item['title'],
+                'content_html': item['body'],
+                'date_published': item['published'].isoformat(),
+                **({'attachments': [{'url': item['enclosure'], 'mime_type': 'audio/mpeg', 'size_in_bytes': 1000}]}
+                   if item['enclosure'] else {}),
+            } for item in items],
+        }).encode('utf-8')
+
+    if kind == 'atom':
+        parts = [
+            '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">',
+            f'<title>{escape(title)}</title><link href="{link}"/><id>{link}</id>',
+        ]
+        for item in items:
+            enclosure = f'<link rel="enclosure" type="audio/mpeg" length="1000" href="{item["enclosure"]}"/>' if item['enclosure'] else ''
+            parts.append(
+                f'<entry><title>{escape(item["title"])}</title><id>{item["guid"]}</id><link href="{item["guid"]}"/>'
+                f'<updated>{item["published"].isoformat()}</updated>{enclosure}'
+                f'<content type="html">{escape(item["body"])}</content></entry>'
+            )
+        parts.append('</feed>')
+        return '\n'.join(parts).encode('utf-8')
+
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>',
+        f'<title>{escape(title)}</title><link>{link}</link><description>{escape(title)}</description>',
+    ]
+    for item in items:
+        enclosure = f'<enclosure url="{item["enclosure"]}" type="audio/mpeg" length="1000"/>' if item['enclosure'] else ''
+        parts.append(
+            f'<item><title>{escape(item["title"])}</title><guid>{item["guid"]}</guid><link>{item["guid"]}</link>'
+            f'<pubDate>{format_datetime(item["published"])}</pubDate>{enclosure}'
+            f'<description>{escape(item["body"])}</description></item>'
+        )
+    parts.append('</channel></rss>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+
+class SyntheticFeedServer:
+    """
+    A local http server for generated feeds, at `/<kind>/<feed id>`, running on a background thread
+
+    ### Parameters
+    - entries: the number of entries in each feed
+    - entry_size: the number of characters in each entry's body
+    - latency: the seconds to wait before answering each request
+    - error_rate: the fraction of requests answered with 500 internal server error
+    - etags: send an ETag with each feed and answer a matching If-None-Match with 304 not modified
+    - seed: the seed of the random errors, so runs are repeatable
+    """
+
+    def __init__(self, entries: int = 20, entry_size: int = 500, latency: float = 0.0, error_rate: float = 0.0,
+                 etags: bool = True, seed: int = 0):
+        self.entries = entries
+        self.entry_size = entry_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.etags = etags
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # the version of each feed, by (kind, feed id)
+        self.versions = {}
+        self.bodies = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.httpd = None
+        self.thread = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    def start(self):
+        """start serving on a free port of 127.0.0.1"""
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='synthetic-feeds', daemon=True)
+        self.thread.start()
+        logger.info('Serving synthetic feeds on port %d', self.httpd.server_port)
+
+
+    def stop(self):
+        """stop serving"""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+
+
+    def url(self, kind: str, feed_id: int) -> str:
+        """the url of a feed"""
+        return f'http://127.0.0.1:{self.httpd.server_port}/{kind}/{feed_id}'
+
+
+    def body(self, kind: str, feed_id: int) -> tuple[bytes, str]:
+        """the content and etag of the current version of a feed, generated once for each version"""
+        version = self.versions.get((kind, feed_id), 0)
+        key = (kind, feed_id, version)
+        if key not in self.bodies:
+            self.bodies[key] = synthetic_feed(kind, feed_id, self.entries, version, self.entry_size)
+        return self.bodies[key], f'"{feed_id}-{version}"'
+
+
+    def change(self, fraction: float) -> int:
+        """
+        Move a random fraction of the feeds that have been served to their next version
+
+        ### Returns
+        - int: the number of feeds changed
+        """
+        with self.lock:
+            feeds = sorted({(kind, feed_id) for kind, feed_id, _ in self.bodies})
+            changed = self.random.sample(feeds, round(len(feeds) * fraction))
+            for feed in changed:
+                self.versions[feed] = self.versions.get(feed, 0) + 1
+        return len(changed)
+
+
+    def handler_class(self) -> type[BaseHTTPRequestHandler]:
+        """the request handler, bound to this server's feeds"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """answer a request for a generated feed"""
+
+            def do_GET(self): # pylint: disable=invalid-name
+                """send the feed, a 304 or an error"""
+                if server.latency:
+                    sleep(server.latency)
+
+                try:
+                    _, kind, feed_id = self.path.split('/')
+                    feed_id = int(feed_id)
+                except ValueError:
+                    kind = None
+                if kind not in FEED_KINDS:
+                    self.send_error(404)
+                    return
+
+                content = etag = None
+                not_modified = False
+                with server.lock:
+                    server.requests += 1
+                    failed = server.error_rate and server.random.random() < server.error_rate
+                    if failed:
+                        server.errors += 1
+                    else:
+                        content, etag = server.body(kind, feed_id)
+                        not_modified = server.etags and self.headers.get('If-None-Match') == etag
+                        if not_modified:
+                            server.not_modified += 1
+
+                if failed:
+                    self.send_error(500)
+                    return
+
+                if not_modified:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPES[kind])
+                self.send_header('Content-Length', str(len(content)))
+                if server.etags:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(content)
+
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                """log to the module logger instead of stderr"""
+                logger.debug(format, *args)
+
+        return Handler
@@ -0,0 +1,157 @@
+"""
+Per host rate limiting so a refresh run does not send bursts of requests to the same server
+"""
+import logging
+from collections import deque
+from time import monotonic
+from urllib.parse import urlparse
+from django.conf import settings
+from feeds.models import Source
+
+logger = logging.getLogger('Fetch Throttle')
+
+
+class TokenBucket:
+    """
+    A token bucket, tokens are added at a fixed rate up to a capacity and each request takes one
+
+    ### Parameters
+    - rate: the number of tokens added per second
+    - capacity: the most tokens the bucket can hold, which is the largest burst of requests allowed
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+
+
+    def consume(self) -> float:
+        """
+        Take a token if one is available
+
+        ### Returns
+        - float: 0 if a token was taken, otherwise the number of seconds until one will be available
+        """
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+
+
+class HostThrottle:
+    """
+    A token bucket for each host. The default rate and burst come from the `FEEDS_HOST_RATE` and `FEEDS_HOST_BURST`
+    settings, individual hosts can be given their own `(rate, burst)` in `FEEDS_HOST_RATE_LIMITS`.
+    A rate of 0 or None does not limit the host.
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, host_limits: dict = None):
+        self.rate = getattr(settings, 'FEEDS_HOST_RATE') if rate is None else rate
+        self.burst = getattr(settings, 'FEEDS_HOST_BURST') if burst is None else burst
+        self.host_limits = getattr(settings, 'FEEDS_HOST_RATE_LIMITS') if host_limits is None else host_limits
+        self.buckets = {}
+
+
+    def consume(self, host: str) -> float:
+        """
+        Take a token for a request to the given host
+
+        ### Returns
+        - float: 0 if the request may go ahead, otherwise the number of seconds until it may
+        """
+        if host not in self.buckets:
+            rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+            self.buckets[host] = TokenBucket(rate, burst) if rate else None
+
+        if (bucket := self.buckets[host]) is None:
+            return 0.0
+        return bucket.consume()
+
+
+
+def source_host(source: Source) -> str:
+    """The host name a source is fetched from"""
+    return urlparse(source.feed_url).netloc.lower()
+
+
+
+class HostScheduler:
+    """
+    Hands out sources to fetch, taking turns between hosts and only handing out a source once its host's throttle
+    allows another request. This is not thread safe, it should only be used by the thread submitting the queries.
+
+    ### Parameters
+    - sources: the sources to fetch, sources for the same host are handed out in the order given
+    - throttle: the per host rate limits
+    """
+
+    def __init__(self, sources, throttle: HostThrottle):
+        self.throttle = throttle
+        self.hosts = {}
+        for source in sources:
+            self.hosts.setdefault(source_host(source), deque()).append(source)
+
+        self.turns = deque(self.hosts)
+
+
+    def __bool__(self):
+        return bool(self.turns)
+
+
+    def next_source(self) -> tuple[Source | None, float]:
+        """
+        Get the next source that may be fetched now
+
+        ### Returns
+        - Source: the source to fetch, or None if every remaining host has to wait
+        - float: if no source is ready, the number of seconds until one will be
+        """
+        delay = float('inf')
+
+        for _ in range(len(self.turns)):
+            host = self.turns[0]
+            self.turns.rotate(-1)
+
+            wait_time = self.throttle.consume(host)
+            if wait_time > 0:
+                delay = min(delay, wait_time)
+                continue
+
+            source = self.hosts[host].popleft()
+            if not self.hosts[host]:
+                self.drop_host(host)
+            return source, 0.0
+
+        return None, delay
+
+
+    def drop_host(self, host: str) -> int:
+        """
+        Stop handing out sources for a host, eg: after it responds with 429 too many requests.
+        The dropped sources stay due and will be fetched by a later run.
+
+        ### Returns
+        - int: the number of sources dropped
+        """
+        remaining = self.hosts.pop(host, ())
+        if host in self.turns:
+            self.turns.remove(host)
+        return len(remaining)
+
+
+    def record(self, source: Source):
+        """Update the schedule from the result of a query"""
+        if source.status_code != 429:
+            return
+
+        host = source_host(source)
+        if dropped := self.drop_host(host):
+            logger.warning('Too many requests to %s, skipping %d more sources this run', host, dropped)
@@ -0,0 +1,119 @@
+"""
+Sort sources into hot, warm and cold tiers by how active they are, so fetch capacity goes to the feeds that post.
+
+Each tier has a share of every batch of fetches, its budget, and a cadence that bounds the time between its fetches,
+set by the `FEEDS_TIERS` setting. A source's tier is worked out again after each fetch from when it last had new
+entries, how often it posts and how many of its fetches in a row have failed.
+"""
+import math
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from feeds.models import Source
+from .predict import SECONDS_PER_DAY
+
+HOT = 'hot'
+WARM = 'warm'
+COLD = 'cold'
+
+
+def tier_settings(tier: str) -> dict:
+    """the budget and cadence of a tier, from `FEEDS_TIERS`"""
+    return getattr(settings, 'FEEDS_TIERS').get(tier) or {}
+
+
+
+def post_rate(source: Source, now: datetime) -> float:
+    """the mean entries per day since the oldest entry found, counting at least one day"""
+    if not source.arrival_count or source.arrival_first is None:
+        return 0.0
+    days = max((now - source.arrival_first).total_seconds() / SECONDS_PER_DAY, 1.0)
+    return source.arrival_count / days
+
+
+
+def classify_tier(source: Source, now: datetime = None) -> str:
+    """
+    Work out which tier a source belongs in
+
+    - cold: its last `FEEDS_TIER_COLD_ERRORS` fetches failed, or it has had no new entries for `FEEDS_TIER_COLD_DAYS`
+    - hot: it had new entries in the last `FEEDS_TIER_HOT_DAYS` and posts at least `FEEDS_TIER_HOT_RATE` entries a day
+    - warm: everything else, including sources that have not had new entries yet
+
+    ### Parameters
+    - source: the source with its arrival statistics and error count
+    - now: the time to classify at, defaults to the current time
+
+    ### Returns
+    - str: the name of the tier
+    """
+    now = now or datetime.now(tz=ZoneInfo('UTC'))
+
+    if source.error_count >= getattr(settings, 'FEEDS_TIER_COLD_ERRORS'):
+        return COLD
+
+    if source.last_new_entry is None:
+        return WARM
+
+    quiet = now - source.last_new_entry
+    if quiet > timedelta(days=getattr(settings, 'FEEDS_TIER_COLD_DAYS')):
+        return COLD
+
+    if quiet <= timedelta(days=getattr(settings, 'FEEDS_TIER_HOT_DAYS')) and \
+            post_rate(source, now) >= getattr(settings, 'FEEDS_TIER_HOT_RATE'):
+        return HOT
+
+    return WARM
+
+
+
+def apply_cadence(source: Source, due_fetch: datetime, now: datetime) -> datetime:
+    """
+    Keep a due time within the `min_interval` and `max_interval` seconds of the source's tier
+
+    ### Parameters
+    - source: the source to schedule
+    - due_fetch: the due time from the scheduling policy
+    - now: the time of the fetch
+
+    ### Returns
+    - datetime: the due time moved into the tier's cadence
+    """
+    cadence = tier_settings(source.tier)
+    if (min_interval := cadence.get('min_interval')) is not None:
+        due_fetch = max(due_fetch, now + timedelta(seconds=min_interval))
+    if (max_interval := cadence.get('max_interval')) is not None:
+        due_fetch = min(due_fetch, now + timedelta(seconds=max_interval))
+    return due_fetch
+
+
+
+def tier_quotas(limit: int, available: dict[str, int]) -> dict[str, int]:
+    """
+    Split a batch of fetches between the tiers in proportion to their budgets. The share a tier can not use,
+    because it has fewer due sources, goes to the other tiers in order of their budgets.
+
+    ### Parameters
+    - limit: the number of sources in the batch
+    - available: the number of due sources in each tier
+
+    ### Returns
+    - dict of the number of sources to take from each tier
+    """
+    budgets = {tier: tier_settings(tier).get('budget', 0) for tier in available}
+    total = sum(budgets.values())
+    quotas = {
+        # the small margin keeps float error, eg: 0.6 + 0.3 + 0.1 < 1, from rounding a whole share down
+        tier: min(count, math.floor(limit * budgets[tier] / total + 1e-9)) if total else 0
+        for tier, count in available.items()
+    }
+
+    remaining = limit - sum(quotas.values())
+    for tier in sorted(available, key=budgets.get, reverse=True):
+        if remaining <= 0:
+            break
+        extra = min(remaining, available[tier] - quotas[tier])
+        quotas[tier] += extra
+        remaining -= extra
+
+    return quotas
@@ -0,0 +1,74 @@
+"""
+CLI for comparing scheduling policies against the stored history of entries
+"""
+import logging
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from feeds.models import Source, Entry
+from feeds.fetch.policies import FixedIntervalPolicy, get_policy
+from feeds.fetch.simulate import SimulationResult, simulate_source
+
+
+logger = logging.getLogger('Backtest')
+
+DEFAULT_POLICIES = ['fixed', 'predictive', 'adaptive']
+DEFAULT_INTERVAL = 60*60
+DEFAULT_MIN_ENTRIES = 10
+DEFAULT_WARMUP_DAYS = 14
+
+
+class Command(BaseCommand):
+    """
+    Command to replay when each source's entries were posted through scheduling policies and report how many fetches
+    each one makes and how long entries wait to be found
+    """
+    help = 'Compare scheduling policies on the stored entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--policy", action='append', dest='policies',
+                            help=f"a policy name or dotted import path, can be repeated (default {', '.join(DEFAULT_POLICIES)})")
+        parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help='the seconds between fetches of the fixed policy')
+        parser.add_argument("--min-entries", type=int, default=DEFAULT_MIN_ENTRIES, help='skip sources with fewer entries')
+        parser.add_argument("--warmup-days", type=float, default=DEFAULT_WARMUP_DAYS,
+                            help='days of each source\'s history the policies start with before the replay')
+        parser.add_argument("--max-sources", type=int, default=0, help='the most sources to replay, 0 replays them all')
+
+
+    def handle(self, *args, **options):
+        policies = []
+        for name in options['policies'] or DEFAULT_POLICIES:
+            try:
+                policy = get_policy(name)
+            except ImportError as error:
+                raise CommandError(f"Unknown policy {name}: {error}") from error
+            if isinstance(policy, FixedIntervalPolicy):
+                policy.interval = options['interval']
+            policies.append(policy)
+
+        sources = Source.objects.annotate(entry_count=Count('entries')).filter(entry_count__gte=options['min_entries']).order_by('pk')
+        if options['max_sources']:
+            sources = sources[:options['max_sources']]
+
+        totals = [SimulationResult(policy.name) for policy in policies]
+        replayed = 0
+        for source in sources.only('pk', 'min_interval'):
+            arrivals = list(Entry.objects.filter(source=source).order_by('created').values_list('created', flat=True))
+            start = arrivals[0] + timedelta(days=options['warmup_days'])
+            end = arrivals[-1]
+            if start >= end:
+                continue
+
+            for policy, total in zip(policies, totals):
+                total.add(simulate_source(policy, arrivals, start, end, source.min_interval))
+            replayed += 1
+
+        self.stdout.write(f"Replayed {replayed} sources")
+        self.stdout.write(f"{'policy':<16} {'fetches':>9} {'wasted':>9} {'wasted %':>9} {'entries':>8} {'mean h':>8} {'p95 h':>8}")
+        for total in totals:
+            wasted_rate = total.wasted / total.fetches if total.fetches else 0.0
+            self.stdout.write(
+                f"{total.policy:<16} {total.fetches:>9} {total.wasted:>9} {wasted_rate:>9.1%} {total.entries:>8} "
+                f"{total.mean_latency / 3600:>8.2f} {total.p95_latency / 3600:>8.2f}"
+            )
@@ -0,0 +1,180 @@
+"""
+CLI for benchmarking the whole fetch pipeline against a local server of generated feeds
+"""
+import json
+import logging
+import sys
+from contextlib import nullcontext
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from feeds.models import Source
+from feeds.fetch import fetch_feeds, create_parse_pool
+from feeds.fetch.metrics import STAGES, metrics, stage_seconds
+from feeds.fetch.simulate import percentile
+from feeds.fetch.synthetic import FEED_KINDS, SyntheticFeedServer
+from feeds.fetch.throttle import HostThrottle
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+
+logger = logging.getLogger('BenchFeeds')
+
+DEFAULT_FEEDS = 100
+DEFAULT_ROUNDS = 2
+DEFAULT_ENTRIES = 20
+DEFAULT_ENTRY_SIZE = 500
+DEFAULT_CHANGE_RATE = 0.2
+
+
+def peak_rss_mb() -> float | None:
+    """the most memory this process has used, in MB, None if it can not be found"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+
+class Command(BaseCommand):
+    """
+    Command to serve generated feeds on 127.0.0.1 and fetch them with the real pipeline, inside a transaction that
+    is rolled back so the database is left as it was. Nothing is fetched from the network.
+    """
+    help = 'Benchmark fetching feeds from a local server of generated feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--feeds", type=int, default=DEFAULT_FEEDS, help='the number of feeds, split between rss, atom and json')
+        parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS,
+                            help='the number of times every feed is fetched, the rounds after the first can answer 304')
+        parser.add_argument("--entries", type=int, default=DEFAULT_ENTRIES, help='the number of entries in each feed')
+        parser.add_argument("--entry-size", type=int, default=DEFAULT_ENTRY_SIZE, help='the characters in each entry body')
+        parser.add_argument("--latency", type=float, default=0.0, help='the milliseconds the server waits before each response')
+        parser.add_argument("--error-rate", type=float, default=0.0, help='the fraction of requests answered with 500')
+        parser.add_argument("--change-rate", type=float, default=DEFAULT_CHANGE_RATE,
+                            help='the fraction of feeds that get new entries between rounds')
+        parser.add_argument("--no-etags", action='store_true', help='never answer 304 not modified')
+        parser.add_argument("--workers", type=int, default=1, help='number of feeds to query at the same time')
+        parser.add_argument("--parse-workers", type=int, default=0,
+                            help='number of processes to parse feeds on, 0 parses on the main process')
+        parser.add_argument("--output", type=str, help='also write the results to this file as json')
+
+
+    def handle(self, *args, **options):
+        if options['feeds'] < 1 or options['rounds'] < 1:
+            raise CommandError('--feeds and --rounds must be at least 1')
+        if not 0 <= options['error_rate'] <= 1 or not 0 <= options['change_rate'] <= 1:
+            raise CommandError('--error-rate and --change-rate must be between 0 and 1')
+
+        server = SyntheticFeedServer(
+            entries=options['entries'],
+            entry_size=options['entry_size'],
+            latency=options['latency'] / 1000,
+            error_rate=options['error_rate'],
+            etags=not options['no_etags'],
+        )
+        metrics.reset()
+        samples = []
+
+        def collect(name, amount, labels):
+            if name == stage_seconds.name:
+                samples.append((labels['stage'], amount))
+
+        metrics.add_listener(collect)
+        try:
+            with server, transaction.atomic():
+                results = self.run(server, options)
+                transaction.set_rollback(True)
+        finally:
+            metrics.remove_listener(collect)
+
+        results['stages'] = {}
+        for stage in STAGES:
+            seconds = [amount for sample_stage, amount in samples if sample_stage == stage]
+            if seconds:
+                results['stages'][stage] = {
+                    'count': len(seconds),
+                    'p50_ms': percentile(seconds, 50) * 1000,
+                    'p95_ms': percentile(seconds, 95) * 1000,
+                }
+        results['peak_rss_mb'] = peak_rss_mb()
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+
+
+    def run(self, server: SyntheticFeedServer, options: dict) -> dict:
+        """create the sources and fetch them for each round, returns the results"""
+        sources = [
+            Source(feed_url=server.url(FEED_KINDS[feed_id % len(FEED_KINDS)], feed_id), name=f'benchfeeds {feed_id}')
+            for feed_id in range(options['feeds'])
+        ]
+        Source.objects.bulk_create(sources)
+        sources = list(Source.objects.filter(name__startswith='benchfeeds ').order_by('pk'))
+
+        # generate the first version of every feed before the clock starts
+        for source in sources:
+            _, kind, feed_id = source.feed_url.rsplit('/', 2)
+            server.body(kind, int(feed_id))
+
+        rounds = []
+        with create_parse_pool(options['parse_workers']) if options['parse_workers'] else nullcontext() as parse_pool:
+            for number in range(options['rounds']):
+                if number:
+                    server.change(options['change_rate'])
+                requests, not_modified, errors = server.requests, server.not_modified, server.errors
+
+                with CaptureQueriesContext(connection) as queries:
+                    start = perf_counter()
+                    # the sources all share one host, so it is not rate limited
+                    count = fetch_feeds(sources, workers=options['workers'], throttle=HostThrottle(rate=0), parse_pool=parse_pool)
+                    elapsed = perf_counter() - start
+
+                rounds.append({
+                    'feeds': count,
+                    'seconds': elapsed,
+                    'feeds_per_second': count / elapsed if elapsed else 0.0,
+                    'requests': server.requests - requests,
+                    'not_modified': server.not_modified - not_modified,
+                    'errors': server.errors - errors,
+                    'queries_per_feed': len(queries) / count if count else 0.0,
+                })
+
+        total_feeds = sum(result['feeds'] for result in rounds)
+        total_seconds = sum(result['seconds'] for result in rounds)
+        return {
+            'options': {name: options[name] for name in (
+                'feeds', 'rounds', 'entries', 'entry_size', 'latency', 'error_rate', 'change_rate', 'workers', 'parse_workers',
+            )},
+            'rounds': rounds,
+            'feeds_per_second': total_feeds / total_seconds if total_seconds else 0.0,
+            'queries_per_feed': sum(result['queries_per_feed'] * result['feeds'] for result in rounds) / total_feeds,
+        }
+
+
+    def report(self, results: dict):
+        """write the results as tables"""
+        self.stdout.write(f"{'round':>5} {'feeds':>6} {'seconds':>8} {'feeds/s':>8} {'304s':>6} {'errors':>6} {'queries/feed':>13}")
+        for number, result in enumerate(results['rounds'], 1):
+            self.stdout.write(
+                f"{number:>5} {result['feeds']:>6} {result['seconds']:>8.2f} {result['feeds_per_second']:>8.1f} "
+                f"{result['not_modified']:>6} {result['errors']:>6} {result['queries_per_feed']:>13.1f}"
+            )
+
+        self.stdout.write('')
+        self.stdout.write(f"{'stage':<11} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, timing in results['stages'].items():
+            self.stdout.write(f"{stage:<11} {timing['count']:>6} {timing['p50_ms']:>9.2f} {timing['p95_ms']:>9.2f}")
+
+        self.stdout.write('')
+        self.stdout.write(f"{results['feeds_per_second']:.1f} feeds/sec, {results['queries_per_feed']:.1f} queries per feed")
+        if results['peak_rss_mb'] is not None:
+            self.stdout.write(f"peak RSS {results['peak_rss_mb']:.1f} MB")
@@ -0,0 +1,269 @@
+"""
+CLI for comparing the speed of the feed parsers, and timing each stage of parsing and storing a feed against a
+saved baseline
+"""
+import json
+import os
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from feeds.models import Source
+from feeds.fetch.extract import (
+    ENTRY_FIELD_KEYS, ENTRY_FIELDS, extract_feed, map_parsed_feed, parse_feed_content, tree_atribute,
+)
+from feeds.fetch.fastparse import parse_fast
+from feeds.fetch.jsonfeed import is_json_feed, parse_json_feed
+from feeds.fetch.parse import update_entries, update_source_attributes
+from feeds.fetch.synthetic import FEED_KINDS, synthetic_feed
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'tests', 'test_data')
+DEFAULT_REPEAT = 20
+ENGINES = ('feedparser', 'fast')
+
+# the sizes of the generated feeds added to the files, in entries
+DEFAULT_SYNTHETIC_ENTRIES = [1000]
+
+# the stages of parsing and storing a feed that are timed against the baseline
+STAGES = ('parse', 'mapping', 'source_attributes', 'entries_insert', 'entries_unchanged')
+
+# how much slower than the baseline a stage can be, as a fraction, before the run fails
+DEFAULT_THRESHOLD = 0.25
+
+# stages that are slower by less than this many seconds are not counted as regressions, however large the fraction
+NOISE_FLOOR = 200e-6
+
+
+def time_call(func, repeat: int) -> float:
+    """the fastest of several timings of a call, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+
+def path_map_entry(entry_data) -> dict:
+    """map the entry fields by splitting and following each path string, the way it was done before `FieldMap`"""
+    values = {}
+    for field_name, paths in ENTRY_FIELD_KEYS.items():
+        if (value := tree_atribute(entry_data, *paths)) is not None:
+            values[field_name] = value
+    return values
+
+
+
+def time_entries_insert(source: Source, entries: list, repeat: int) -> float:
+    """the fastest of several timings of storing entries that are all new, each one is rolled back after it is timed"""
+    best = float('inf')
+    for _ in range(repeat):
+        savepoint = transaction.savepoint()
+        start = perf_counter()
+        update_entries(source, entries)
+        best = min(best, perf_counter() - start)
+        transaction.savepoint_rollback(savepoint)
+    return best
+
+
+
+def time_stages(name: str, content: bytes, repeat: int, engine: str = None) -> dict[str, float]:
+    """
+    Time each stage of parsing and storing a feed. Must be run in a transaction, the source and entries it
+    writes are left for the caller to roll back.
+
+    ### Parameters
+    - name: a name for the feed, used for its source url
+    - content: the feed
+    - repeat: the number of times to time each stage, the fastest is kept
+    - engine: the parser engine, defaults to `FEEDS_PARSER_ENGINE`
+
+    ### Returns
+    - dict of the seconds each stage took, the entry stages are left out if the feed has no entries
+    """
+    parsed_data = parse_feed_content(content, engine)
+    parsed_feed = map_parsed_feed(parsed_data)
+    source = Source(feed_url=f'https://benchparse.invalid/{name}')
+    source.save()
+
+    timings = {
+        'parse': time_call(lambda: parse_feed_content(content, engine), repeat),
+        'mapping': time_call(lambda: map_parsed_feed(parsed_data), repeat),
+        'source_attributes': time_call(lambda: update_source_attributes(Source(), parsed_feed.feed), repeat),
+    }
+    if parsed_feed.entries:
+        timings['entries_insert'] = time_entries_insert(source, parsed_feed.entries, repeat)
+        update_entries(source, parsed_feed.entries)
+        timings['entries_unchanged'] = time_call(lambda: update_entries(source, parsed_feed.entries), repeat)
+    return timings
+
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[tuple[str, str, float, float]]:
+    """
+    The stages that are slower than the baseline by more than the threshold
+
+    ### Parameters
+    - results: the seconds of each stage by feed name
+    - baseline: the saved results to compare with
+    - threshold: how much slower a stage can be, as a fraction of its baseline time
+
+    ### Returns
+    - list of the (feed name, stage, baseline seconds, seconds) of each regression, feeds and stages that are not
+      in both are skipped
+    """
+    regressions = []
+    for name, timings in results.items():
+        for stage, seconds in timings.items():
+            before = baseline.get(name, {}).get(stage)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and seconds - before > NOISE_FLOOR:
+                regressions.append((name, stage, before, seconds))
+    return regressions
+
+
+
+class Command(BaseCommand):
+    """
+    Command to time parsing and mapping feed files with each parser engine, and each stage of parsing and storing
+    the feeds. The stage timings can be saved as a baseline, and compared with a baseline to fail when a stage
+    has become slower.
+    """
+    help = 'Compare the speed of the feed parser engines and time each stage of parsing and storing feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs='*', help='feed files to parse, defaults to the test data files')
+        parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help='number of times to parse each file')
+        parser.add_argument("--synthetic", type=int, nargs='*', default=DEFAULT_SYNTHETIC_ENTRIES,
+                            help='also time generated rss, atom and json feeds with these numbers of entries, '
+                                 'give no numbers to leave them out')
+        parser.add_argument("--engine", choices=ENGINES, help='the parser engine of the stage timings, defaults to FEEDS_PARSER_ENGINE')
+        parser.add_argument("--stages-only", action='store_true', help='only time the stages, not the engine and mapping comparisons')
+        parser.add_argument("--save-baseline", type=str, help='save the stage timings to this json file')
+        parser.add_argument("--baseline", type=str, help='fail if any stage is slower than in this json file')
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f'how much slower than the baseline a stage can be, as a fraction (default {DEFAULT_THRESHOLD})')
+
+
+    def handle(self, *args, **options):
+        paths = options['files'] or [
+            os.path.join(TEST_DATA_DIR, file_name) for file_name in sorted(os.listdir(TEST_DATA_DIR))
+        ]
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        files = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as file:
+                    files.append((os.path.basename(path), file.read()))
+            except OSError as error:
+                raise CommandError(f"Could not read {path}: {error}") from error
+
+        for entries in options['synthetic'] or []:
+            for kind in FEED_KINDS:
+                files.append((f'synthetic-{kind}-{entries}', synthetic_feed(kind, 0, entries)))
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)['results']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f"Could not read the baseline {options['baseline']}: {error}") from error
+
+        if not options['stages_only']:
+            self.parse_table(files, options['repeat'])
+            self.stdout.write('')
+            self.mapping_table(files, options['repeat'])
+            self.stdout.write('')
+
+        results = self.stage_table(files, options['repeat'], options['engine'], baseline)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as file:
+                json.dump({'repeat': options['repeat'], 'engine': options['engine'], 'results': results}, file, indent=2)
+            self.stdout.write(f"Saved the baseline to {options['save_baseline']}")
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['threshold'])
+            for name, stage, before, seconds in regressions:
+                self.stderr.write(f"{name} {stage}: {before * 1000:.3f}ms -> {seconds * 1000:.3f}ms ({seconds / before - 1:+.0%})")
+            if regressions:
+                raise CommandError(f"{len(regressions)} stages are more than {options['threshold']:.0%} slower than the baseline")
+            self.stdout.write(f"No stage is more than {options['threshold']:.0%} slower than the baseline")
+
+
+    def parse_table(self, files: list[tuple[str, bytes]], repeat: int):
+        """time parsing and mapping each file with each engine"""
+        totals = dict.fromkeys(ENGINES, 0.0)
+        self.stdout.write(f"{'file':<32} {'feedparser ms':>14} {'fast ms':>10} {'speedup':>8}  parser")
+
+        for file_name, content in files:
+            timings = {
+                engine: time_call(lambda engine=engine, content=content: extract_feed(content, engine), repeat)
+                for engine in ENGINES
+            }
+            for engine, seconds in timings.items():
+                totals[engine] += seconds
+
+            if is_json_feed(content) and parse_json_feed(content) is not None:
+                used = 'json'
+            else:
+                used = 'fast' if parse_fast(content) is not None else 'fallback'
+            self.stdout.write(
+                f"{file_name:<32} {timings['feedparser'] * 1000:>14.3f} {timings['fast'] * 1000:>10.3f} "
+                f"{timings['feedparser'] / timings['fast']:>7.1f}x  {used}"
+            )
+
+        self.stdout.write(
+            f"{'total':<32} {totals['feedparser'] * 1000:>14.3f} {totals['fast'] * 1000:>10.3f} "
+            f"{totals['feedparser'] / totals['fast'] if totals['fast'] else 0.0:>7.1f}x"
+        )
+
+
+    def mapping_table(self, files: list[tuple[str, bytes]], repeat: int):
+        """time mapping the fields of each entry, following path strings compared to the compiled field map"""
+        self.stdout.write(f"{'file':<32} {'entries':>8} {'paths us/entry':>15} {'compiled us/entry':>18} {'speedup':>8}")
+
+        for file_name, content in files:
+            entries = parse_feed_content(content, 'feedparser').entries
+            if not entries:
+                continue
+
+            path_time = time_call(lambda entries=entries: [path_map_entry(entry) for entry in entries], repeat)
+            compiled_time = time_call(lambda entries=entries: [ENTRY_FIELDS.extract(entry) for entry in entries], repeat)
+            self.stdout.write(
+                f"{file_name:<32} {len(entries):>8} {path_time / len(entries) * 1e6:>15.2f} "
+                f"{compiled_time / len(entries) * 1e6:>18.2f} {path_time / compiled_time:>7.1f}x"
+            )
+
+
+    def stage_table(self, files: list[tuple[str, bytes]], repeat: int, engine: str = None, baseline: dict = None) -> dict:
+        """
+        time each stage of parsing and storing each file, in a transaction that is rolled back. The change from
+        the baseline is shown after each time, when there is one.
+        """
+        self.stdout.write(f"{'file':<32} " + ' '.join(f'{stage + " ms":>22}' for stage in STAGES))
+        results = {}
+
+        with transaction.atomic():
+            for file_name, content in files:
+                timings = results[file_name] = time_stages(file_name, content, repeat, engine)
+
+                columns = []
+                for stage in STAGES:
+                    if stage not in timings:
+                        columns.append(f"{'-':>22}")
+                        continue
+                    before = (baseline or {}).get(file_name, {}).get(stage)
+                    change = f" ({timings[stage] / before - 1:+5.0%})" if before else ''
+                    columns.append(f"{f'{timings[stage] * 1000:.3f}{change}':>22}")
+                self.stdout.write(f"{file_name:<32} " + ' '.join(columns))
+
+            transaction.set_rollback(True)
+
+        return results
@@ -0,0 +1,25 @@
+"""
+CLI for dumping the fetch metrics in the Prometheus text format
+"""
+from django.core.management.base import BaseCommand
+
+from feeds.fetch.metrics import metrics, write_metrics_file
+
+
+class Command(BaseCommand):
+    """
+    Command to write the fetch metrics of the process it runs in, in the Prometheus text format. The metrics are
+    kept in memory, so run it in a process that fetches feeds, eg: with `call_command('metricsdump')`. `runfetcher`
+    runs it when it is sent SIGUSR1.
+    """
+    help = 'Dump the fetch metrics in the Prometheus text format'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", type=str, help='write the metrics to this file instead of stdout')
+
+
+    def handle(self, *args, **options):
+        if options['output']:
+            write_metrics_file(options['output'])
+        else:
+            self.stdout.write(metrics.prometheus_text(), ending='')
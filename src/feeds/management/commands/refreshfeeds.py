@@ -2,16 +2,22 @@
 CLI for fetching and updating a feed
 """
 import logging
+from contextlib import nullcontext
+from time import perf_counter
 from django.core.management.base import BaseCommand, CommandError
 
 from feeds.models import Source
-from feeds.fetch import fetch_feed
-from feeds.fetch.predict import due_sources
+from feeds.fetch import fetch_feeds, create_parse_pool
+from feeds.fetch.queue import claim_due_sources, release_sources
+from feeds.fetch.conditional import conditional_stats
+from feeds.fetch.metrics import STAGES, metrics, stage_seconds, write_metrics_file
 
 
 logger = logging.getLogger('RefreshFeeds')
 
 DEFAULT_MAX_FEEDS = 10
+DEFAULT_WORKERS = 1
+DEFAULT_PARSE_WORKERS = 0
 
 
 class Command(BaseCommand):
@@ -26,9 +32,15 @@ class Command(BaseCommand):
         parser.add_argument("--max", type=int, default=DEFAULT_MAX_FEEDS)
         parser.add_argument("--all-feeds", action='store_true')
         parser.add_argument("--no-cache", action='store_true')
+        parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help='number of feeds to query at the same time')
+        parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS,
+                            help='number of processes to parse feeds on, 0 parses on the main process')
+        parser.add_argument("--metrics-file", type=str,
+                            help='write the fetch metrics to this file in the Prometheus text format, - writes them to stdout')
 
 
     def handle(self, *args, **options):
+        claimed = False
 
         if options['all_feeds']:
             logger.info('Updating all feeds')
@@ -44,13 +56,36 @@ class Command(BaseCommand):
 
         else:
             logger.info('Updating Due Feeds')
-            sources = due_sources()
+            # claim the due sources so other refreshes running at the same time skip them
+            sources = claim_due_sources(options['max'])
+            claimed = True
 
         if options['max']:
             sources = sources[:options['max']]
 
         logger.info('Updating %d Sources', len(sources))
-        for source in sources:
-            fetch_feed(source, options['no_cache'])
-
+        start = perf_counter()
+        try:
+            with create_parse_pool(options['parse_workers']) if options['parse_workers'] else nullcontext() as parse_pool:
+                count = fetch_feeds(sources, options['no_cache'], options['workers'], parse_pool=parse_pool)
+        finally:
+            if claimed:
+                release_sources(sources)
+        elapsed = perf_counter() - start
+
+        rate = count / elapsed if elapsed > 0 else 0.0
         logger.info('Finished')
+        self.stdout.write(f"Fetched {count} feeds in {elapsed:.2f}s ({rate:.2f} feeds/sec)")
+        self.stdout.write(
+            f"{conditional_stats.not_modified} not modified, {conditional_stats.full} full responses "
+            f"({conditional_stats.hit_rate:.0%} not modified)"
+        )
+        for stage in STAGES:
+            total, stage_count = stage_seconds.totals(stage=stage)
+            if stage_count:
+                self.stdout.write(f"{stage:<11} {stage_count:>6} x {total / stage_count * 1000:>9.2f}ms mean {total:>9.2f}s total")
+
+        if options['metrics_file'] == '-':
+            self.stdout.write(metrics.prometheus_text(), ending='')
+        elif options['metrics_file']:
+            write_metrics_file(options['metrics_file'])
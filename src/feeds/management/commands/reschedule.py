@@ -0,0 +1,38 @@
+"""
+CLI for re-planning when every feed is next due
+"""
+import logging
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+
+from feeds.models import Source
+from feeds.fetch import reschedule
+
+
+logger = logging.getLogger('Reschedule')
+
+
+class Command(BaseCommand):
+    """
+    Command to set the due time of every live source from its arrival statistics
+    """
+    help = 'Re-plan when every feed is next due'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all-feeds", action='store_true', help='include feeds that are not live')
+        parser.add_argument("--batch", type=int, default=reschedule.RESCHEDULE_BATCH_SIZE, help='the most feeds to plan at a time')
+        parser.add_argument("--no-numpy", action='store_true', help='plan each feed in turn even if NumPy is installed')
+
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1:
+            raise CommandError('--batch must be at least 1')
+
+        sources = Source.objects.all() if options['all_feeds'] else Source.objects.filter(live=True)
+        vectorize = reschedule.np is not None and not options['no_numpy']
+
+        start = perf_counter()
+        count = reschedule.reschedule_sources(sources, batch_size=options['batch'], vectorize=vectorize)
+        elapsed = perf_counter() - start
+
+        self.stdout.write(f"Rescheduled {count} feeds in {elapsed:.2f}s ({'numpy' if vectorize else 'python'})")
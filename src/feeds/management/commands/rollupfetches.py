@@ -0,0 +1,74 @@
+"""
+CLI for rolling up and pruning the fetch history
+"""
+import logging
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from feeds.models import FetchDailyStats
+from feeds.fetch.history import rollup_fetch_history, prune_fetch_history
+
+
+logger = logging.getLogger('RollupFetches')
+
+DEFAULT_REPORT_DAYS = 7
+
+
+class Command(BaseCommand):
+    """
+    Command to add the fetch attempts up into daily totals for each source, delete the attempts past the retention
+    window, and optionally list the sources that cost the most to fetch for what they post
+    """
+    help = 'Roll up the fetch attempts into daily totals and prune old attempts'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=str, help='the first day to roll up (YYYY-MM-DD), defaults to the last day rolled up')
+        parser.add_argument("--retention-days", type=float, help='the days of attempts to keep, defaults to FEEDS_HISTORY_RETENTION_DAYS')
+        parser.add_argument("--no-prune", action='store_true', help='keep every attempt')
+        parser.add_argument("--report", type=int, default=0,
+                            help='list this many sources that downloaded the most bytes per new entry in the last week')
+
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError as error:
+                raise CommandError(f"Invalid --since date {options['since']}: {error}") from error
+
+        rows = rollup_fetch_history(since)
+        self.stdout.write(f"Rolled up {rows} source days")
+
+        if not options['no_prune']:
+            deleted = prune_fetch_history(options['retention_days'])
+            self.stdout.write(f"Pruned {deleted} fetch attempts")
+
+        if options['report']:
+            self.report(options['report'])
+
+
+    def report(self, count: int):
+        """list the sources that downloaded the most bytes for each new entry found"""
+        since = timezone.now().date() - timedelta(days=DEFAULT_REPORT_DAYS)
+        sources = (
+            FetchDailyStats.objects.filter(day__gte=since)
+            .values('source_id', 'source__feed_url')
+            .annotate(
+                attempts=Sum('attempts'),
+                content_length=Sum('content_length'),
+                new_entries=Sum('new_entries'),
+                elapsed=Sum('elapsed'),
+            )
+            .annotate(cost=F('content_length') / (F('new_entries') + 1))
+            .order_by('-cost')[:count]
+        )
+
+        self.stdout.write(f"{'attempts':>9} {'MB':>9} {'new':>6} {'mean s':>7}  feed")
+        for row in sources:
+            self.stdout.write(
+                f"{row['attempts']:>9} {row['content_length'] / 1e6:>9.2f} {row['new_entries']:>6} "
+                f"{row['elapsed'] / row['attempts'] if row['attempts'] else 0.0:>7.2f}  {row['source__feed_url']}"
+            )
@@ -0,0 +1,149 @@
+"""
+Long running process that fetches feeds as they become due
+"""
+import logging
+import signal
+import threading
+from datetime import timedelta
+from time import monotonic
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, reset_queries
+from django.utils import timezone
+
+from feeds.fetch import fetch_feeds, create_parse_pool, parse_pool_broken
+from feeds.fetch.session import fetch_session
+from feeds.fetch.throttle import HostThrottle
+from feeds.fetch.queue import claim_due_sources, release_sources, next_claim_time, worker_name
+from feeds.fetch.metrics import write_metrics_file
+from feeds.fetch.history import history_enabled, maintain_fetch_history
+
+
+logger = logging.getLogger('RunFetcher')
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_WORKERS = 1
+DEFAULT_PARSE_WORKERS = 0
+DEFAULT_MAX_SLEEP = 60
+
+
+class Command(BaseCommand):
+    """
+    Command that keeps running, fetching due feeds in batches and sleeping until the next feed is due
+    """
+    help = 'Continuously fetch feeds as they become due'
+    parse_pool = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help='the most feeds to claim at a time')
+        parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help='number of feeds to query at the same time')
+        parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS,
+                            help='number of processes to parse feeds on, 0 parses on the main process')
+        parser.add_argument("--max-sleep", type=float, default=DEFAULT_MAX_SLEEP,
+                            help='the longest to sleep in seconds before checking for new feeds')
+        parser.add_argument("--max-batches", type=int, default=0,
+                            help='exit after this many batches so a supervisor can restart a fresh process, 0 runs forever')
+        parser.add_argument("--metrics-file", type=str,
+                            help='write the fetch metrics to this file in the Prometheus text format after each batch')
+
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+
+        def stop(signum, _frame):
+            logger.info('Received signal %d, stopping after the current batch', signum)
+            stopping.set()
+
+        def dump_metrics(_signum, _frame):
+            # written on another thread, the signal may arrive while this one holds the metrics lock
+            threading.Thread(
+                target=call_command,
+                args=('metricsdump',),
+                kwargs={'output': options['metrics_file'], 'stdout': self.stdout},
+                daemon=True,
+            ).start()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        if hasattr(signal, 'SIGUSR1'): # not available on windows
+            signal.signal(signal.SIGUSR1, dump_metrics)
+
+        owner = worker_name()
+        logger.info('Fetcher %s started', owner)
+
+        # the parse processes are started once and reused for every batch, unless one of them dies
+        self.parse_pool = create_parse_pool(options['parse_workers']) if options['parse_workers'] else None
+        try:
+            # one session and one set of host rate limits for the life of the process, so the connections are
+            # kept open and the hosts do not get a fresh burst of requests with every batch
+            with fetch_session(pool_maxsize=options['workers']):
+                self.run(owner, stopping, HostThrottle(), options)
+        finally:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown(cancel_futures=True)
+
+        close_old_connections()
+        logger.info('Fetcher %s stopped', owner)
+
+
+    def run(self, owner: str, stopping: threading.Event, throttle: HostThrottle, options: dict):
+        """fetch batches of due feeds until stopped"""
+        batches = 0
+        next_rollup = 0.0
+
+        while not stopping.is_set():
+            # drop connections the database has closed and the query log that grows when DEBUG is on
+            close_old_connections()
+            reset_queries()
+
+            # roll up and prune the fetch history every so often, so it stays bounded without a separate cron job
+            if history_enabled() and monotonic() >= next_rollup:
+                try:
+                    maintain_fetch_history()
+                except Exception: # pylint: disable=broad-exception-caught
+                    logger.exception('Failed to roll up the fetch history')
+                next_rollup = monotonic() + getattr(settings, 'FEEDS_HISTORY_ROLLUP_INTERVAL')
+
+            sources = claim_due_sources(options['batch'], owner=owner)
+            if sources:
+                self.check_parse_pool(options['parse_workers'])
+                try:
+                    count = fetch_feeds(sources, workers=options['workers'], throttle=throttle, parse_pool=self.parse_pool)
+                finally:
+                    release_sources(sources, owner=owner)
+                logger.info('Fetched %d feeds', count)
+                if options['metrics_file']:
+                    write_metrics_file(options['metrics_file'])
+
+                batches += 1
+                if options['max_batches'] and batches >= options['max_batches']:
+                    logger.info('Finished %d batches', batches)
+                    return
+
+                # go straight on to the next batch, there may be more due
+                continue
+
+            stopping.wait(self.sleep_time(options['max_sleep']))
+
+
+    def check_parse_pool(self, workers: int):
+        """replace the parse pool if one of its processes has died, a broken pool would refuse every feed"""
+        if self.parse_pool is not None and parse_pool_broken(self.parse_pool):
+            logger.error('A parse process died, starting %d new parse processes', workers)
+            self.parse_pool.shutdown(wait=False, cancel_futures=True)
+            self.parse_pool = create_parse_pool(workers)
+
+
+    @staticmethod
+    def sleep_time(max_sleep: float) -> float:
+        """
+        the seconds until the next source can be claimed, capped so new sources and changes by other workers are
+        noticed
+        """
+        due = next_claim_time()
+        if due is None:
+            return max_sleep
+
+        wait = (due - timezone.now()) + timedelta(seconds=1)
+        return min(max(wait.total_seconds(), 1.0), max_sleep)
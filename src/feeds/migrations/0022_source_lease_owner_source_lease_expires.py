@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0021_delete_webproxy_remove_enclosure_description_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0022_source_lease_owner_source_lease_expires'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
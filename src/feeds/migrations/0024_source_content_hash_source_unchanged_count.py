@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0023_entry_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='unchanged_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
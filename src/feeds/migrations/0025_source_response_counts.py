@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0024_source_content_hash_source_unchanged_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='content_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='full_response_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='not_modified_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
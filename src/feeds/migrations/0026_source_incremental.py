@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0025_source_response_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+    ]
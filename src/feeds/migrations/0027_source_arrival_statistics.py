@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:47
+
+import math
+from datetime import timezone
+import feeds.models
+from django.db import migrations, models
+
+
+def backfill_arrivals(apps, schema_editor):
+    """calculate the arrival statistics of each source from its stored entries"""
+    Source = apps.get_model('feeds', 'Source')
+    Entry = apps.get_model('feeds', 'Entry')
+
+    for source in Source.objects.all().iterator():
+        weekdays = [0] * 7
+        for created in Entry.objects.filter(source=source).values_list('created', flat=True).iterator():
+            if created.tzinfo is not None:
+                created = created.astimezone(timezone.utc)
+            seconds = created.hour * 3600 + created.minute * 60 + created.second + created.microsecond / 1e6
+            angle = 2 * math.pi * seconds / 86400
+            source.arrival_sin += math.sin(angle)
+            source.arrival_cos += math.cos(angle)
+            source.arrival_count += 1
+            weekdays[created.weekday()] += 1
+            if source.arrival_first is None or created < source.arrival_first:
+                source.arrival_first = created
+
+        source.arrival_weekdays = weekdays
+        source.save(update_fields=['arrival_sin', 'arrival_cos', 'arrival_count', 'arrival_weekdays', 'arrival_first'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0026_source_incremental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='arrival_cos',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='arrival_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='arrival_first',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='arrival_sin',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='arrival_weekdays',
+            field=models.JSONField(default=feeds.models.empty_weekdays),
+        ),
+        migrations.RunPython(backfill_arrivals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0027_source_arrival_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='fetch_interval',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='last_new_entry',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='schedule_policy',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:57
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_last_new_entry(apps, schema_editor):
+    """set when each source last had new entries from when its newest stored entry was found, to classify its tier"""
+    Source = apps.get_model('feeds', 'Source')
+    Entry = apps.get_model('feeds', 'Entry')
+
+    newest = Entry.objects.filter(source=OuterRef('pk')).order_by().values('source').annotate(found=Max('found')).values('found')
+    Source.objects.filter(last_new_entry__isnull=True).update(last_new_entry=Subquery(newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0028_source_schedule_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='error_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')], default='warm', max_length=8),
+        ),
+        migrations.RunPython(backfill_last_new_entry, migrations.RunPython.noop),
+    ]
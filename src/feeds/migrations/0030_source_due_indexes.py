@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0029_source_tiers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='source',
+            index=models.Index(condition=models.Q(('live', True)), fields=['due_fetch'], name='feeds_source_live_due'),
+        ),
+        migrations.AddIndex(
+            model_name='source',
+            index=models.Index(condition=models.Q(('live', True)), fields=['tier', 'due_fetch'], name='feeds_source_live_tier_due'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0030_source_due_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FetchAttempt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(db_index=True)),
+                ('status_code', models.PositiveIntegerField(default=0)),
+                ('elapsed', models.FloatField(default=0.0)),
+                ('content_length', models.PositiveIntegerField(default=0)),
+                ('parse_time', models.FloatField(default=0.0)),
+                ('unchanged', models.BooleanField(default=False)),
+                ('new_entries', models.PositiveIntegerField(default=0)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fetch_attempts', to='feeds.source')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FetchDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('not_modified', models.PositiveIntegerField(default=0)),
+                ('unchanged', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('new_entries', models.PositiveIntegerField(default=0)),
+                ('content_length', models.PositiveBigIntegerField(default=0)),
+                ('elapsed', models.FloatField(default=0.0)),
+                ('max_elapsed', models.FloatField(default=0.0)),
+                ('parse_time', models.FloatField(default=0.0)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='feeds.source')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source', 'day'), name='feeds_fetchdailystats_source_day')],
+            },
+        ),
+    ]
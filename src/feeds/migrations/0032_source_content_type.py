@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0031_fetch_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
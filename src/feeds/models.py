@@ -9,6 +9,20 @@ from django.utils.timezone import now
 
 
 
+def empty_weekdays() -> list[int]:
+    """a count for each day of the week"""
+    return [0] * 7
+
+
+
+TIER_CHOICES = [
+    ('hot', 'Hot'),
+    ('warm', 'Warm'),
+    ('cold', 'Cold'),
+]
+
+
+
 class Source(models.Model):
     """
     This is the data describing the source of a feed and the fetch behavior
@@ -32,6 +46,14 @@ class Source(models.Model):
     min_interval = models.FloatField(default=60*60)
     # the next time to fetch, default to distant past to put new sources to front of queue
     due_fetch = models.DateTimeField(default=datetime.datetime(1900, 1, 1, tzinfo=datetime.timezone.utc))
+    # the scheduling policy name or import path, see feeds.fetch.policies. Blank uses the FEEDS_SCHEDULE_POLICY setting
+    schedule_policy = models.CharField(max_length=255, blank=True, null=True)
+    # the current seconds between fetches of the adaptive policy
+    fetch_interval = models.FloatField(blank=True, null=True)
+    # the last time a fetch found new entries
+    last_new_entry = models.DateTimeField(blank=True, null=True)
+    # how active the source is, hot, warm or cold, which sets its share of the fetches, see feeds.fetch.tiers
+    tier = models.CharField(max_length=8, choices=TIER_CHOICES, default='warm')
 
     # === request metadata ===
     # Some feeds will only send new enties since the last query this etag was used for
@@ -42,8 +64,54 @@ class Source(models.Model):
     last_result = models.CharField(max_length=255,blank=True,null=True)
     # the http status code of the last query
     status_code = models.PositiveIntegerField(default=0)
+    # the number of fetches in a row that failed with a server, connection or parsing error
+    error_count = models.PositiveIntegerField(default=0)
     # If the feed is not live, then the fetch routine will not query it
     live = models.BooleanField(default=True)
+    # hash of the last response body that was parsed successfully
+    content_hash = models.CharField(max_length=32, blank=True, null=True)
+    # the number of full responses that were skipped because the body had not changed
+    unchanged_count = models.PositiveIntegerField(default=0)
+    # the number of 304 not modified responses
+    not_modified_count = models.PositiveIntegerField(default=0)
+    # the number of full responses
+    full_response_count = models.PositiveIntegerField(default=0)
+    # the size in bytes of the last full response
+    content_length = models.PositiveIntegerField(default=0)
+    # the Content-Type header of the last full response, JSON feeds are recognised by it
+    content_type = models.CharField(max_length=255, blank=True, null=True)
+    # stop reading the feed at the first run of entries that are already stored and unchanged, for large newest first feeds
+    incremental = models.BooleanField(default=False)
+
+    # === arrival statistics, updated as new entries are found, see feeds.fetch.predict ===
+    # the number of entries found
+    arrival_count = models.PositiveIntegerField(default=0)
+    # the sums of the sine and cosine of each entry's time of day as an angle, for the circular mean time of day
+    arrival_sin = models.FloatField(default=0.0)
+    arrival_cos = models.FloatField(default=0.0)
+    # the number of entries created on each weekday, monday first
+    arrival_weekdays = models.JSONField(default=empty_weekdays)
+    # the creation time of the oldest entry found
+    arrival_first = models.DateTimeField(blank=True, null=True)
+
+    # === fetch queue ===
+    # the fetch worker that has claimed this source, see feeds.fetch.queue
+    lease_owner = models.CharField(max_length=255, blank=True, null=True)
+    # when the claim runs out and other workers may claim the source
+    lease_expires = models.DateTimeField(blank=True, null=True)
+
+
+    class Meta:
+        indexes = [
+            # the due queue, see feeds.fetch.predict.due_sources. The composite index works on every backend,
+            # including MySQL and Oracle which do not support conditional indexes and filter by a comparison
+            # (eg: WHERE live = 1 AND due_fetch < ... ORDER BY due_fetch)
+            models.Index(fields=['live', 'due_fetch'], name='feeds_source_live_due_fetch'),
+            # smaller indexes of only the live sources, for the backends that support conditional indexes. SQLite
+            # filters a boolean as a bare condition (eg: WHERE live) and only searches the partial index by it
+            models.Index(fields=['due_fetch'], condition=models.Q(live=True), name='feeds_source_live_due'),
+            models.Index(fields=['tier', 'due_fetch'], condition=models.Q(live=True), name='feeds_source_live_tier_due'),
+        ]
 
 
     def __str__(self):
@@ -82,6 +150,8 @@ class Entry(models.Model):
     image_url     = models.CharField(max_length=512, blank=True, null=True)
     # tracking
     found         = models.DateTimeField(auto_now_add=True)
+    # hash of the fields and enclosures parsed from the feed, used to skip writing unchanged entries
+    fingerprint   = models.CharField(max_length=32, blank=True, null=True)
 
 
     @property
@@ -114,3 +184,58 @@ class Enclosure(models.Model):
     length = models.IntegerField(default=0)
     href   = models.CharField(max_length=512)
     type   = models.CharField(max_length=256)
+
+
+
+class FetchAttempt(models.Model):
+    """
+    One query of a source, written in batches by feeds.fetch.history and deleted once it is older than
+    `FEEDS_HISTORY_RETENTION_DAYS`, after it has been added to the source's `FetchDailyStats`
+    """
+    source         = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='fetch_attempts')
+    started        = models.DateTimeField(db_index=True)
+    # the http status code, or 600 for connection and parsing errors
+    status_code    = models.PositiveIntegerField(default=0)
+    # the seconds the query took
+    elapsed        = models.FloatField(default=0.0)
+    # the size in bytes of the response body
+    content_length = models.PositiveIntegerField(default=0)
+    # the seconds spent parsing the response, 0 if it was not parsed
+    parse_time     = models.FloatField(default=0.0)
+    # the full response was the same as the last one parsed, so it was not parsed again
+    unchanged      = models.BooleanField(default=False)
+    # the number of new entries found
+    new_entries    = models.PositiveIntegerField(default=0)
+
+
+    def __str__(self):
+        return f"{self.source_id} {self.started}: {self.status_code}"
+
+
+
+class FetchDailyStats(models.Model):
+    """The totals of a source's fetch attempts for one day, see feeds.fetch.history.rollup_fetch_history"""
+    source         = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='daily_stats')
+    day            = models.DateField()
+    attempts       = models.PositiveIntegerField(default=0)
+    # the 304 not modified responses
+    not_modified   = models.PositiveIntegerField(default=0)
+    # the full responses that were the same as the last one parsed
+    unchanged      = models.PositiveIntegerField(default=0)
+    # the attempts with a 400 or higher status code
+    errors         = models.PositiveIntegerField(default=0)
+    new_entries    = models.PositiveIntegerField(default=0)
+    content_length = models.PositiveBigIntegerField(default=0)
+    elapsed        = models.FloatField(default=0.0)
+    max_elapsed    = models.FloatField(default=0.0)
+    parse_time     = models.FloatField(default=0.0)
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'day'], name='feeds_fetchdailystats_source_day'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.source_id} {self.day}: {self.attempts} attempts"
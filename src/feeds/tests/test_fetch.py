@@ -0,0 +1,692 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, time, timezone as dt_timezone
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+import requests_mock
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from feeds.models import Source, FetchAttempt, FetchDailyStats
+from feeds.fetch import fetch_feed, fetch_feeds, create_parse_pool, parse_pool_broken, reschedule
+from feeds.fetch.session import get_session, fetch_session
+from feeds.fetch.throttle import HostThrottle, HostScheduler
+from feeds.fetch.queue import claim_due_sources, release_sources, next_claim_time
+from feeds.fetch.predict import record_arrivals, predict_time, predict_day, set_next_fetch, due_sources, next_due, fetch_jitter
+from feeds.fetch.policies import FixedIntervalPolicy, PredictivePolicy, AdaptivePolicy, get_policy
+from feeds.fetch.simulate import simulate_source, percentile
+from feeds.fetch.tiers import classify_tier, apply_cadence, tier_quotas
+from feeds.fetch.metrics import MetricsRegistry, metrics, stage_seconds, bytes_downloaded, entries_written
+from feeds.fetch.history import rollup_fetch_history, prune_fetch_history
+from feeds.fetch.synthetic import SyntheticFeedServer
+from feeds.management.commands.runfetcher import Command as RunFetcher
+from feeds.fetch.conditional import conditional_headers, request_etags, conditional_stats, conditional_summary
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def read_test_data(file_name:str) -> bytes:
+    """read the raw bytes of a test data file"""
+    with open(os.path.join(TEST_DATA_DIR, file_name), 'rb') as file:
+        return file.read()
+
+
+
+class TestFetchFeeds(TestCase):
+
+    def test_fetch_feeds_with_workers(self):
+        content = read_test_data('mastodon.xml')
+        sources = []
+        for i in range(5):
+            source = Source(feed_url=f'https://example.com/feed/{i}')
+            source.save()
+            sources.append(source)
+
+        with requests_mock.Mocker() as mock:
+            mock.get(requests_mock.ANY, content=content)
+            count = fetch_feeds(sources, workers=3)
+
+        self.assertEqual(count, 5)
+        for source in sources:
+            source.refresh_from_db()
+            self.assertEqual(source.status_code, 200)
+            self.assertIsNotNone(source.last_success)
+            self.assertGreater(source.entries.count(), 0)
+
+
+    def test_unchanged_content_is_not_parsed(self):
+        content = read_test_data('mastodon.xml')
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get(requests_mock.ANY, content=content)
+            fetch_feed(source)
+            self.assertIsNotNone(source.content_hash)
+            self.assertEqual(source.unchanged_count, 0)
+
+            with patch('feeds.fetch.update_feed') as update_feed:
+                fetch_feed(source)
+            update_feed.assert_not_called()
+
+        source.refresh_from_db()
+        self.assertEqual(source.unchanged_count, 1)
+
+
+
+    def test_json_feed_content_type(self):
+        # too much white space before the json to recognise it from the content alone
+        content = b'\n' * 100 + read_test_data('json_simple_two_entry.json')
+        source = Source(feed_url='https://example.com/feed.json')
+        source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get(requests_mock.ANY, content=content, headers={'Content-Type': 'application/feed+json; charset=utf-8'})
+            fetch_feed(source)
+
+        source.refresh_from_db()
+        self.assertEqual(source.content_type, 'application/feed+json; charset=utf-8')
+        self.assertEqual(source.entries.count(), 2)
+
+
+
+class TestSession(TestCase):
+
+    def test_fetch_session_is_shared_and_restored(self):
+        outer = get_session()
+
+        with fetch_session(pool_maxsize=20) as session:
+            self.assertIs(get_session(), session)
+            self.assertEqual(session.get_adapter('https://example.com')._pool_maxsize, 20)
+
+        self.assertIs(get_session(), outer)
+
+    def test_nested_fetch_session_is_reused(self):
+        with fetch_session(pool_maxsize=20) as session:
+            with fetch_session(pool_maxsize=5) as inner:
+                self.assertIs(inner, session)
+            # the inner block leaves the outer session open and current
+            self.assertIs(get_session(), session)
+            self.assertTrue(session.adapters)
+
+    def test_runfetcher_keeps_session_and_throttle(self):
+        for i in range(2):
+            Source(feed_url=f'https://example.com/feed/{i}').save()
+        calls = []
+
+        def fake_fetch_feeds(sources, throttle=None, **_kwargs):
+            calls.append((throttle, get_session()))
+            Source.objects.filter(pk__in=[source.pk for source in sources]).update(due_fetch=timezone.now() + timedelta(hours=1))
+            return len(sources)
+
+        with patch('feeds.management.commands.runfetcher.fetch_feeds', fake_fetch_feeds), patch('signal.signal'):
+            call_command('runfetcher', batch=1, max_batches=2, stdout=io.StringIO())
+
+        self.assertEqual(len(calls), 2)
+        self.assertIsNotNone(calls[0][0])
+        self.assertIs(calls[0][0], calls[1][0])
+        self.assertIs(calls[0][1], calls[1][1])
+
+
+
+class TestThrottle(TestCase):
+
+    def test_scheduler_takes_turns_between_hosts(self):
+        sources = [Source(feed_url=url) for url in (
+            'https://a.com/1', 'https://a.com/2', 'https://a.com/3', 'https://b.com/1', 'https://c.com/1',
+        )]
+        scheduler = HostScheduler(sources, HostThrottle(rate=0))
+
+        order = []
+        while scheduler:
+            source, _ = scheduler.next_source()
+            order.append(source.feed_url)
+
+        self.assertEqual(order, ['https://a.com/1', 'https://b.com/1', 'https://c.com/1', 'https://a.com/2', 'https://a.com/3'])
+
+    def test_scheduler_waits_for_throttled_host(self):
+        sources = [Source(feed_url='https://a.com/1'), Source(feed_url='https://a.com/2')]
+        scheduler = HostScheduler(sources, HostThrottle(rate=0.5, burst=1))
+
+        source, delay = scheduler.next_source()
+        self.assertEqual(source.feed_url, 'https://a.com/1')
+
+        source, delay = scheduler.next_source()
+        self.assertIsNone(source)
+        self.assertGreater(delay, 1.5)
+
+    def test_scheduler_drops_host_after_too_many_requests(self):
+        sources = [Source(feed_url='https://a.com/1'), Source(feed_url='https://a.com/2'), Source(feed_url='https://b.com/1')]
+        scheduler = HostScheduler(sources, HostThrottle(rate=0))
+
+        source, _ = scheduler.next_source()
+        source.status_code = 429
+        scheduler.record(source)
+
+        source, _ = scheduler.next_source()
+        self.assertEqual(source.feed_url, 'https://b.com/1')
+        self.assertFalse(scheduler)
+
+
+
+class TestQueue(TestCase):
+
+    def test_claims_do_not_overlap(self):
+        for i in range(3):
+            Source(feed_url=f'https://example.com/feed/{i}').save()
+
+        first = claim_due_sources(2, owner='worker-a')
+        second = claim_due_sources(2, owner='worker-b')
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({source.pk for source in first} & {source.pk for source in second})
+        self.assertEqual(claim_due_sources(owner='worker-c'), [])
+
+        # a fetched source is released, one that is still due keeps its claim until the lease runs out
+        Source.objects.filter(pk=first[0].pk).update(due_fetch=timezone.now() + timedelta(hours=1))
+        release_sources(first, owner='worker-a')
+        Source.objects.filter(pk=first[0].pk).update(due_fetch=timezone.now() - timedelta(hours=1))
+
+        claimed = claim_due_sources(owner='worker-c')
+        self.assertEqual([source.pk for source in claimed], [first[0].pk])
+
+
+    def test_next_claim_time_waits_for_leases(self):
+        now = timezone.now()
+        source = Source(feed_url='https://example.com/feed', due_fetch=now - timedelta(hours=1))
+        source.save()
+        Source(feed_url='https://example.com/later', due_fetch=now + timedelta(hours=2)).save()
+        self.assertEqual(next_claim_time(now), source.due_fetch)
+
+        # a failed source stays claimed while it is still due, so it can not be claimed until the lease runs out
+        claimed = claim_due_sources(owner='worker-a', lease_seconds=600)
+        expires = claimed[0].lease_expires
+        release_sources(claimed, owner='worker-a')
+        self.assertEqual(next_claim_time(now), expires)
+
+        with patch('feeds.management.commands.runfetcher.timezone.now', return_value=now):
+            self.assertGreater(RunFetcher.sleep_time(60), 59)
+
+
+    def test_due_queue(self):
+        now = timezone.now()
+        for i in range(4):
+            Source(feed_url=f'https://example.com/feed/{i}', due_fetch=now + timedelta(hours=2 * i - 3)).save()
+        Source(feed_url='https://example.com/dead', due_fetch=now - timedelta(days=1), live=False).save()
+
+        self.assertEqual([source.feed_url for source in due_sources()], ['https://example.com/feed/0', 'https://example.com/feed/1'])
+        self.assertEqual([source.feed_url for source in next_due(3)], [f'https://example.com/feed/{i}' for i in range(3)])
+
+        # the plan is only checked on SQLite, the other backends use another EXPLAIN syntax
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                sql, params = due_sources().query.sql_with_params()
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = ' '.join(str(row) for row in cursor.fetchall())
+            self.assertIn('feeds_source_live_due', plan)
+
+        # the backends without conditional indexes use an index of every source
+        self.assertIn(['live', 'due_fetch'], [index.fields for index in Source._meta.indexes if index.condition is None])
+
+    def test_jitter_spreads_sources(self):
+        sources = [Source(pk=pk, feed_url=f'https://example.com/feed/{pk}') for pk in range(1, 101)]
+        jitters = [fetch_jitter(source).total_seconds() for source in sources]
+
+        self.assertEqual(jitters, [fetch_jitter(source).total_seconds() for source in sources])
+        self.assertTrue(all(0 <= jitter < settings.FEEDS_FETCH_JITTER for jitter in jitters))
+        # every tenth of the window gets some of the sources
+        self.assertEqual(len({int(jitter * 10 // settings.FEEDS_FETCH_JITTER) for jitter in jitters}), 10)
+        self.assertEqual(fetch_jitter(Source(feed_url='https://example.com/new')), timedelta(0))
+
+
+
+class TestConditional(TestCase):
+
+    def test_no_validators_sends_no_headers(self):
+        self.assertEqual(conditional_headers(Source(feed_url='https://example.com/feed')), {})
+
+    def test_validators_are_sent(self):
+        source = Source(feed_url='https://example.com/feed', etag='W/"abc"', last_modified='Sat, 07 Jan 2023 15:08:27 GMT')
+        self.assertEqual(conditional_headers(source), {
+            'If-None-Match': 'W/"abc"',
+            'If-Modified-Since': 'Sat, 07 Jan 2023 15:08:27 GMT',
+        })
+
+    def test_compressed_etag_also_sends_original(self):
+        self.assertEqual(request_etags('"abc-gzip"'), ['"abc-gzip"', '"abc"'])
+
+    def test_not_modified_is_counted(self):
+        source = Source(feed_url='https://example.com/feed', etag='"abc"')
+        source.save()
+        conditional_stats.reset()
+
+        with requests_mock.Mocker() as mock:
+            mock.get('https://example.com/feed', status_code=304)
+            fetch_feed(source)
+            self.assertEqual(mock.last_request.headers['If-None-Match'], '"abc"')
+            self.assertNotIn('If-Modified-Since', mock.last_request.headers)
+
+        self.assertEqual(source.not_modified_count, 1)
+        self.assertEqual(source.full_response_count, 0)
+        self.assertEqual(conditional_stats.not_modified, 1)
+        self.assertEqual(conditional_summary()['hit_rate'], 1.0)
+
+
+
+class TestParsePool(TestCase):
+
+    def test_fetch_feeds_with_parse_pool(self):
+        content = read_test_data('podcast.xml')
+        sources = []
+        for i in range(3):
+            source = Source(feed_url=f'https://example.com/feed/{i}')
+            source.save()
+            sources.append(source)
+
+        with requests_mock.Mocker() as mock, create_parse_pool(2) as parse_pool:
+            mock.get(requests_mock.ANY, content=content)
+            count = fetch_feeds(sources, workers=2, parse_pool=parse_pool)
+
+        self.assertEqual(count, 3)
+        for source in sources:
+            source.refresh_from_db()
+            self.assertEqual(source.title, 'Accidental Tech Podcast')
+            self.assertEqual(source.entries.count(), 100)
+
+
+    def test_fetch_feeds_with_broken_parse_pool(self):
+        content = read_test_data('mastodon.xml')
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+
+        with create_parse_pool(1) as parse_pool:
+            self.assertFalse(parse_pool_broken(parse_pool))
+            # a parse process that dies breaks the pool, every later submit raises BrokenProcessPool
+            with self.assertRaises(BrokenProcessPool):
+                parse_pool.submit(os._exit, 1).result()
+            self.assertTrue(parse_pool_broken(parse_pool))
+
+            with requests_mock.Mocker() as mock:
+                mock.get(requests_mock.ANY, content=content)
+                count = fetch_feeds([source], workers=2, parse_pool=parse_pool)
+
+        # the feed is parsed on the main process instead
+        self.assertEqual(count, 1)
+        source.refresh_from_db()
+        self.assertEqual(source.status_code, 200)
+        self.assertGreater(source.due_fetch, timezone.now())
+        self.assertGreater(source.entries.count(), 0)
+        self.assertEqual(FetchAttempt.objects.filter(source=source).count(), 1)
+
+
+
+class TestPredict(TestCase):
+
+    def test_arrival_statistics(self):
+        source = Source(feed_url='https://example.com/feed')
+        record_arrivals(source, [
+            datetime(2025, 3, 3, 23, 0, tzinfo=dt_timezone.utc),
+            datetime(2025, 3, 4, 1, 0, tzinfo=dt_timezone.utc),
+        ])
+
+        self.assertEqual(source.arrival_count, 2)
+        self.assertEqual(source.arrival_weekdays, [1, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(source.arrival_first, datetime(2025, 3, 3, 23, 0, tzinfo=dt_timezone.utc))
+
+        # the mean time of day wraps around midnight
+        mean_time, deviation = predict_time(source)
+        self.assertIn(mean_time.hour, (0, 23))
+        self.assertLess(deviation, timedelta(hours=2))
+
+    def test_predict_day_from_weekdays(self):
+        source = Source(feed_url='https://example.com/feed')
+        # a month of entries, all on mondays
+        record_arrivals(source, [datetime(2025, 3, 3, 12, 0, tzinfo=dt_timezone.utc) + timedelta(weeks=week) for week in range(4)])
+
+        # a wednesday, so the next monday is 5 days later
+        self.assertEqual(predict_day(source, datetime(2025, 3, 26).date()), datetime(2025, 3, 31).date())
+
+    def test_set_next_fetch_does_not_query(self):
+        source = Source(feed_url='https://example.com/feed')
+        record_arrivals(source, [datetime(2025, 3, 3, 12, 0, tzinfo=dt_timezone.utc)])
+
+        with self.assertNumQueries(0):
+            set_next_fetch(source, datetime(2025, 3, 3, 18, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(source.due_fetch, datetime.combine(datetime(2025, 3, 4).date(), time(12), tzinfo=dt_timezone.utc))
+
+    def test_new_entries_are_recorded(self):
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get(requests_mock.ANY, content=read_test_data('podcast.xml'))
+            fetch_feed(source)
+
+        source.refresh_from_db()
+        self.assertEqual(source.arrival_count, 100)
+        self.assertEqual(sum(source.arrival_weekdays), 100)
+
+
+    def test_reschedule_in_turn(self):
+        now = datetime(2025, 3, 5, 15, 30, tzinfo=dt_timezone.utc)
+        source = Source(feed_url='https://example.com/feed')
+        record_arrivals(source, [datetime(2025, 3, 3, 12, 0, tzinfo=dt_timezone.utc)])
+        source.save()
+
+        self.assertEqual(reschedule.reschedule_sources(now=now, vectorize=False), 1)
+
+        expected = Source(**{field: getattr(source, field) for field in reschedule.PREDICT_FIELDS})
+        set_next_fetch(expected, now)
+        source.refresh_from_db()
+        self.assertEqual(source.due_fetch, expected.due_fetch + fetch_jitter(source))
+
+    @unittest.skipIf(reschedule.np is None, 'NumPy is not installed')
+    def test_vectorized_reschedule_matches_set_next_fetch(self):
+        now = datetime(2025, 3, 5, 15, 30, tzinfo=dt_timezone.utc)
+        sources = []
+        for i, (hour, days) in enumerate([(None, 0), (3, 1), (14, 1), (20, 3), (12, 30), (23, 60)]):
+            source = Source(feed_url=f'https://example.com/feed/{i}', min_interval=3600 * (i + 1))
+            if hour is not None:
+                record_arrivals(source, [now - timedelta(days=day, hours=hour) for day in range(0, days, 7 if days > 7 else 1)])
+            sources.append(source)
+
+        for source, due_fetch in zip(sources, reschedule.predict_due_times(sources, now)):
+            set_next_fetch(source, now)
+            self.assertAlmostEqual((source.due_fetch - due_fetch).total_seconds(), 0, places=3)
+
+
+
+class TestSimulate(TestCase):
+
+    def test_policies_are_compared(self):
+        start = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        arrivals = [start + timedelta(days=day, hours=12) for day in range(-14, 28)]
+        end = arrivals[-1]
+
+        fixed = simulate_source(FixedIntervalPolicy(3600), arrivals, start, end)
+        predictive = simulate_source(PredictivePolicy(), arrivals, start, end)
+
+        self.assertEqual(fixed.entries, 28)
+        self.assertEqual(predictive.entries, 28)
+        self.assertLessEqual(fixed.p95_latency, 3600)
+        self.assertLess(predictive.fetches, fixed.fetches)
+        self.assertEqual(fixed.fetches - fixed.wasted, 28)
+
+    def test_get_policy(self):
+        self.assertIsInstance(get_policy('fixed', interval=60), FixedIntervalPolicy)
+        self.assertIsInstance(get_policy('feeds.fetch.policies.PredictivePolicy'), PredictivePolicy)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 95), 0.0)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+
+
+    def test_adaptive_policy(self):
+        now = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        source = Source(feed_url='https://example.com/feed', min_interval=3600)
+        policy = AdaptivePolicy(backoff=2, step=1800, max_interval=4 * 3600)
+
+        # quiet fetches back off multiplicatively up to the max interval
+        self.assertEqual(policy.next_fetch(source, now, 0), now + timedelta(hours=2))
+        self.assertEqual(policy.next_fetch(source, now, 0), now + timedelta(hours=4))
+        self.assertEqual(policy.next_fetch(source, now, 0), now + timedelta(hours=4))
+
+        # new entries tighten additively down to the min interval
+        self.assertEqual(policy.next_fetch(source, now, 3), now + timedelta(hours=3.5))
+        for _ in range(10):
+            policy.next_fetch(source, now, 1)
+        self.assertEqual(source.fetch_interval, 3600)
+
+    @override_settings(FEEDS_FETCH_JITTER=0)
+    def test_source_policy_is_used(self):
+        source = Source(feed_url='https://example.com/feed', etag='"abc"', schedule_policy='adaptive', min_interval=3600)
+        source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get('https://example.com/feed', status_code=304)
+            fetch_feed(source)
+
+        source.refresh_from_db()
+        self.assertEqual(source.fetch_interval, 3600 * settings.FEEDS_ADAPTIVE_BACKOFF)
+        self.assertAlmostEqual((source.due_fetch - source.last_feched).total_seconds(), source.fetch_interval, delta=5)
+
+    @override_settings(FEEDS_FETCH_JITTER=0)
+    def test_due_time_is_after_the_fetch(self):
+        source = Source(feed_url='https://example.com/feed', etag='"abc"', schedule_policy='predictive', min_interval=1800)
+        source.save()
+        claimed = claim_due_sources(owner='worker-a')
+
+        # a prediction for earlier the same day
+        def earlier(_policy, _source, now, _new_entries):
+            return now - timedelta(hours=1)
+
+        with requests_mock.Mocker() as mock, patch.object(PredictivePolicy, 'next_fetch', earlier):
+            mock.get('https://example.com/feed', status_code=304)
+            fetch_feed(source)
+        release_sources(claimed, owner='worker-a')
+
+        source.refresh_from_db()
+        self.assertAlmostEqual((source.due_fetch - source.last_feched).total_seconds(), 1800, delta=5)
+        self.assertIsNone(source.lease_owner)
+
+
+
+class TestTiers(TestCase):
+
+    def test_classify_tier(self):
+        now = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        source = Source(feed_url='https://example.com/feed')
+        self.assertEqual(classify_tier(source, now), 'warm')
+
+        record_arrivals(source, [now - timedelta(hours=hours) for hours in range(0, 24 * 10, 6)])
+        source.last_new_entry = now - timedelta(hours=3)
+        self.assertEqual(classify_tier(source, now), 'hot')
+
+        source.last_new_entry = now - timedelta(days=10)
+        self.assertEqual(classify_tier(source, now), 'warm')
+
+        source.last_new_entry = now - timedelta(days=90)
+        self.assertEqual(classify_tier(source, now), 'cold')
+
+        source.last_new_entry = now - timedelta(hours=3)
+        source.error_count = settings.FEEDS_TIER_COLD_ERRORS
+        self.assertEqual(classify_tier(source, now), 'cold')
+
+    def test_cold_sources_are_checked_weekly(self):
+        now = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        source = Source(feed_url='https://example.com/feed', tier='cold')
+        self.assertEqual(apply_cadence(source, now + timedelta(hours=1), now), now + timedelta(days=7))
+
+        source.tier = 'warm'
+        self.assertEqual(apply_cadence(source, now + timedelta(hours=1), now), now + timedelta(hours=1))
+
+    def test_tier_quotas(self):
+        self.assertEqual(tier_quotas(10, {'hot': 20, 'warm': 20, 'cold': 20}), {'hot': 6, 'warm': 3, 'cold': 1})
+        # the share a tier can not use goes to the others
+        self.assertEqual(tier_quotas(10, {'hot': 1, 'warm': 20, 'cold': 20}), {'hot': 1, 'warm': 8, 'cold': 1})
+        self.assertEqual(tier_quotas(10, {'cold': 4}), {'cold': 4})
+
+    def test_claims_are_shared_between_tiers(self):
+        for tier in ('hot', 'warm', 'cold'):
+            for i in range(10):
+                Source(feed_url=f'https://example.com/{tier}/{i}', tier=tier).save()
+
+        claimed = claim_due_sources(10, owner='worker-a')
+        tiers = [source.tier for source in claimed]
+        self.assertEqual((tiers.count('hot'), tiers.count('warm'), tiers.count('cold')), (6, 3, 1))
+
+    def test_failing_source_turns_cold(self):
+        source = Source(feed_url='https://example.com/feed', error_count=settings.FEEDS_TIER_COLD_ERRORS - 1)
+        source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get('https://example.com/feed', status_code=503)
+            fetch_feed(source)
+
+        source.refresh_from_db()
+        self.assertEqual(source.tier, 'cold')
+        self.assertGreaterEqual(source.due_fetch, source.last_feched + timedelta(days=7))
+
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_fetch_stages_are_timed(self):
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+        content = read_test_data('podcast.xml')
+        recorded = []
+
+        def listener(name, amount, labels):
+            recorded.append((name, labels.get('stage')))
+
+        metrics.add_listener(listener)
+        try:
+            with requests_mock.Mocker() as mock:
+                mock.get('https://example.com/feed', content=content)
+                fetch_feed(source)
+        finally:
+            metrics.remove_listener(listener)
+
+        for stage in ('query', 'parse', 'entries', 'enclosures', 'schedule'):
+            self.assertEqual(stage_seconds.totals(stage=stage)[1], 1, stage)
+            self.assertIn(('feeds_fetch_stage_seconds', stage), recorded)
+        self.assertEqual(bytes_downloaded.values[()], len(content))
+        self.assertEqual(entries_written.values[('inserted',)], 100)
+
+        text = metrics.prometheus_text()
+        self.assertIn('# TYPE feeds_fetch_stage_seconds histogram', text)
+        self.assertIn('feeds_fetch_stage_seconds_count{stage="query"} 1', text)
+        self.assertIn('feeds_fetch_stage_seconds_bucket{stage="query",le="+Inf"} 1', text)
+        self.assertIn('feeds_fetches_total{status="200"} 1', text)
+        self.assertIn(f'feeds_fetch_bytes_total {len(content)}', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Test', ('name',), buckets=(1.0, 2.0))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            registry.record(histogram, value, name='a "b"')
+
+        self.assertEqual(registry.prometheus_text().splitlines()[2:], [
+            'test_seconds_bucket{name="a \\"b\\"",le="1"} 1',
+            'test_seconds_bucket{name="a \\"b\\"",le="2"} 3',
+            'test_seconds_bucket{name="a \\"b\\"",le="+Inf"} 4',
+            'test_seconds_sum{name="a \\"b\\""} 6.5',
+            'test_seconds_count{name="a \\"b\\""} 4',
+        ])
+
+    def test_metricsdump(self):
+        metrics.reset()
+        metrics.record(bytes_downloaded, 1234)
+
+        out = io.StringIO()
+        call_command('metricsdump', stdout=out)
+        self.assertIn('feeds_fetch_bytes_total 1234', out.getvalue())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'feeds.prom')
+            call_command('metricsdump', output=path)
+            with open(path, encoding='utf-8') as file:
+                self.assertEqual(file.read(), out.getvalue())
+
+
+
+class TestHistory(TestCase):
+
+    def test_attempts_are_recorded(self):
+        content = read_test_data('mastodon.xml')
+        sources = [Source(feed_url=f'https://example.com/feed/{i}') for i in range(3)]
+        for source in sources:
+            source.save()
+
+        with requests_mock.Mocker() as mock:
+            mock.get('https://example.com/feed/0', content=content)
+            mock.get('https://example.com/feed/1', status_code=304)
+            mock.get('https://example.com/feed/2', status_code=503)
+            fetch_feeds(sources, workers=2)
+
+        attempts = {attempt.source_id: attempt for attempt in FetchAttempt.objects.all()}
+        self.assertEqual(len(attempts), 3)
+
+        full = attempts[sources[0].pk]
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(full.content_length, len(content))
+        self.assertGreater(full.parse_time, 0)
+        self.assertGreater(full.new_entries, 0)
+        self.assertEqual(attempts[sources[1].pk].status_code, 304)
+        self.assertEqual(attempts[sources[2].pk].status_code, 503)
+
+    def test_rollup_and_prune(self):
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+        now = timezone.now()
+        FetchAttempt.objects.bulk_create([
+            FetchAttempt(source=source, started=now - timedelta(days=40), status_code=200, elapsed=2.0, content_length=1000, new_entries=2),
+            FetchAttempt(source=source, started=now, status_code=200, elapsed=1.0, content_length=500, new_entries=1),
+            FetchAttempt(source=source, started=now, status_code=304, elapsed=3.0),
+        ])
+
+        self.assertEqual(rollup_fetch_history(), 2)
+        today = FetchDailyStats.objects.get(source=source, day=timezone.localdate(now))
+        self.assertEqual((today.attempts, today.not_modified, today.errors), (2, 1, 0))
+        self.assertEqual((today.content_length, today.new_entries, today.elapsed, today.max_elapsed), (500, 1, 4.0, 3.0))
+
+        # rolling up again recalculates the last day rather than adding to it
+        FetchAttempt(source=source, started=now, status_code=500, elapsed=1.0).save()
+        self.assertEqual(rollup_fetch_history(), 1)
+        today.refresh_from_db()
+        self.assertEqual((today.attempts, today.errors), (3, 1))
+
+        self.assertEqual(prune_fetch_history(30), 1)
+        self.assertEqual(FetchAttempt.objects.count(), 3)
+        self.assertEqual(FetchDailyStats.objects.count(), 2)
+
+    def test_prune_in_batches(self):
+        source = Source(feed_url='https://example.com/feed')
+        source.save()
+        started = timezone.now() - timedelta(days=40)
+        FetchAttempt.objects.bulk_create([FetchAttempt(source=source, started=started, status_code=200) for _ in range(5)])
+
+        with patch('feeds.fetch.history.PRUNE_BATCH_SIZE', 2):
+            self.assertEqual(prune_fetch_history(30), 5)
+        self.assertFalse(FetchAttempt.objects.exists())
+
+
+
+class TestBenchmark(TestCase):
+
+    def test_synthetic_server_answers_not_modified(self):
+        with SyntheticFeedServer(entries=5) as server:
+            source = Source(feed_url=server.url('atom', 1))
+            source.save()
+            fetch_feed(source)
+            self.assertEqual(source.entries.count(), 5)
+
+            fetch_feed(source)
+            self.assertEqual(source.status_code, 304)
+
+            server.change(1.0)
+            fetch_feed(source)
+            self.assertEqual(source.status_code, 200)
+            self.assertEqual(source.entries.count(), 10)
+
+    def test_benchfeeds_leaves_no_sources(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchfeeds', feeds=6, rounds=2, entries=5, change_rate=0.5, output=output, stdout=io.StringIO())
+            with open(output, encoding='utf-8') as file:
+                results = json.load(file)
+
+        self.assertEqual([result['feeds'] for result in results['rounds']], [6, 6])
+        self.assertEqual(results['rounds'][1]['not_modified'], 3)
+        self.assertIn('query', results['stages'])
+        self.assertFalse(Source.objects.exists())
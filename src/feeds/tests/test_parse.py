@@ -1,10 +1,19 @@
 
+import io
+import json
 import os
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase, Client
 from django.conf import settings
 from django.utils import timezone
-from feeds.models import Source, Entry, Enclosure, WebProxy
-from feeds.fetch import parse
+from feeds.models import Source, Entry, Enclosure
+from feeds.fetch import parse, extract, fastparse, jsonfeed
+from feeds.fetch.synthetic import synthetic_feed
+from feeds.management.commands import benchparse
 
 TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
 
@@ -66,3 +75,226 @@ class TestParsing(TestCase):
 
         self.assertEqual(test_enclosure.type, 'youtube')
         self.assertEqual(test_enclosure.href, 'https://www.youtube.com/embed/?v=sWvHHM_4Eiw')
+
+    def test_update_entries_counts(self):
+        test_source = construct_feed('podcast.xml')
+        entry_count = test_source.entries.count()
+        self.assertGreater(entry_count, 0)
+
+        with open(os.path.join(TEST_DATA_DIR, 'podcast.xml'), 'r', encoding='utf-8') as file:
+            parsed_feed = extract.extract_feed(file.read())
+
+        enclosure_ids = set(Enclosure.objects.filter(entry__source=test_source).values_list('id', flat=True))
+        self.assertGreater(len(enclosure_ids), 0)
+
+        counts = parse.update_entries(test_source, parsed_feed.entries)
+
+        self.assertEqual(counts, parse.EntryCounts(inserted=0, updated=0, unchanged=entry_count))
+        self.assertEqual(test_source.entries.count(), entry_count)
+        self.assertEqual(set(Enclosure.objects.filter(entry__source=test_source).values_list('id', flat=True)), enclosure_ids)
+
+    def test_update_entries_in_batches(self):
+        test_source = Source()
+        test_source.save()
+        entries = extract.extract_feed(synthetic_feed('rss', 0, entries=20)).entries
+
+        # the guids are looked up a few at a time, so a large feed stays under the database's parameter limit
+        with patch.object(parse, 'BULK_BATCH_SIZE', 7):
+            self.assertEqual(parse.update_entries(test_source, entries), parse.EntryCounts(inserted=20, updated=0, unchanged=0))
+            self.assertEqual(parse.update_entries(test_source, entries), parse.EntryCounts(inserted=0, updated=0, unchanged=20))
+        self.assertEqual(test_source.entries.count(), 20)
+
+    def test_incremental_stops_at_known_entries(self):
+        test_source = construct_feed('podcast.xml')
+        self.assertIsNone(parse.known_fingerprints(test_source))
+
+        test_source.incremental = True
+        with open(os.path.join(TEST_DATA_DIR, 'podcast.xml'), 'rb') as file:
+            content = file.read()
+
+        parsed_feed = extract.extract_feed(content, known=parse.known_fingerprints(test_source))
+        self.assertEqual(len(parsed_feed.entries), settings.FEEDS_INCREMENTAL_STOP_AFTER)
+
+        # a changed entry at the top of the feed is still extracted
+        known = parse.known_fingerprints(test_source)
+        known[parsed_feed.entries[0].values['guid']] = 'changed'
+        self.assertEqual(len(extract.extract_feed(content, known=known).entries), settings.FEEDS_INCREMENTAL_STOP_AFTER + 1)
+
+    def test_max_entries(self):
+        with open(os.path.join(TEST_DATA_DIR, 'podcast.xml'), 'rb') as file:
+            content = file.read()
+
+        for engine in ('feedparser', 'fast'):
+            parsed_feed = extract.extract_feed(content, engine, max_entries=5)
+            self.assertEqual(len(parsed_feed.entries), 5)
+            self.assertEqual(parsed_feed.feed['title'], 'Accidental Tech Podcast')
+
+    def test_malformed_entry_date(self):
+        content = (
+            b'<?xml version="1.0"?><rss version="2.0"><channel><title>Dates</title>'
+            b'<item><guid>1</guid><title>good</title><pubDate>Sat, 07 Jan 2023 15:08:27 GMT</pubDate></item>'
+            b'<item><guid>2</guid><title>bad</title><pubDate>sometime last week</pubDate></item>'
+            b'</channel></rss>'
+        )
+        self.assertEqual(extract.parse_entry_date('2023-01-07T15:08:27'), datetime(2023, 1, 7, 15, 8, 27, tzinfo=dt_timezone.utc))
+        self.assertIsNone(extract.parse_entry_date('sometime last week'))
+
+        for engine in ('feedparser', 'fast'):
+            with self.settings(FEEDS_PARSER_ENGINE=engine):
+                test_source = Source(feed_url=f'https://example.com/{engine}')
+                test_source.save()
+                parse.update_feed(test_source, content)
+
+            self.assertNotEqual(test_source.status_code, parse.PARSING_ERROR_STATUS_CODE, engine)
+            self.assertEqual(test_source.entries.get(guid='1').created, datetime(2023, 1, 7, 15, 8, 27, tzinfo=dt_timezone.utc))
+            # the unreadable date is left to the model default
+            self.assertIsNotNone(test_source.entries.get(guid='2').created)
+
+    def test_sync_enclosures_diff(self):
+        test_source = Source()
+        test_source.save()
+        entry = Entry.objects.create(source=test_source, guid='1', body='')
+        kept = Enclosure.objects.create(entry=entry, href='https://example.com/a.mp3', type='audio/mpeg', length=10)
+        Enclosure.objects.create(entry=entry, href='https://example.com/old.mp3', type='audio/mpeg', length=10)
+
+        created, deleted = parse.sync_enclosures([(entry, [
+            ('https://example.com/a.mp3', 'audio/mpeg', 10),
+            ('https://example.com/b.mp3', 'audio/mpeg', 20),
+        ])])
+
+        self.assertEqual((created, deleted), (1, 1))
+        self.assertEqual(
+            set(entry.enclosures.values_list('href', flat=True)),
+            {'https://example.com/a.mp3', 'https://example.com/b.mp3'},
+        )
+        self.assertTrue(entry.enclosures.filter(pk=kept.pk).exists())
+
+
+
+class TestFastParse(TestCase):
+
+    def test_fast_parser_matches_feedparser(self):
+        for file_name in ('podcast.xml', 'mastodon.xml', 'youtube.html', 'sanitizer_img_attrs.xml'):
+            with open(os.path.join(TEST_DATA_DIR, file_name), 'rb') as file:
+                content = file.read()
+
+            self.assertIsNotNone(fastparse.parse_fast(content), file_name)
+            self.assertEqual(extract.extract_feed(content, 'fast'), extract.extract_feed(content, 'feedparser'), file_name)
+
+    def test_fast_parser_sanitizes(self):
+        with open(os.path.join(TEST_DATA_DIR, 'rss_xhtml_body.xml'), 'rb') as file:
+            parsed_data = fastparse.parse_fast(file.read())
+
+        self.assertEqual(parsed_data.entries[0]['content'][0]['value'], '<p>Example content</p>')
+
+    def test_sanitize_without_private_sanitizer(self):
+        html = '<p onclick="x()">Example <script>bad()</script><a href="javascript:x">link</a></p>'
+
+        # a feedparser release without the private sanitizer is sanitized through feedparser.parse instead
+        with patch.object(fastparse, '_sanitize_html', None):
+            self.assertEqual(fastparse.sanitize(html), '<p>Example <a href="">link</a></p>')
+        self.assertEqual(fastparse.sanitize(html), '<p>Example <a href="">link</a></p>')
+
+    def test_fast_parser_falls_back(self):
+        with open(os.path.join(TEST_DATA_DIR, 'cloudflare.html'), 'rb') as file:
+            content = file.read()
+
+        self.assertIsNone(fastparse.parse_fast(content))
+        self.assertEqual(extract.extract_feed(content, 'fast'), extract.extract_feed(content, 'feedparser'))
+
+
+
+class TestJSONFeed(TestCase):
+
+    def test_parse_podcast_json(self):
+        test_source = construct_feed('podcast.json')
+
+        self.assertEqual(test_source.title, "It's Been a Minute with Sam Sanders")
+        self.assertEqual(test_source.site_url, 'https://www.npr.org/podcasts/510317/its-been-a-minute-with-sam-sanders')
+        self.assertEqual(test_source.author, 'NPR')
+        self.assertEqual(test_source.entries.count(), 1)
+
+        test_entry = test_source.entries.first()
+        self.assertEqual(test_entry.guid, '734830514')
+        self.assertEqual(test_entry.title, 'Weekly Wrap: UFOs, Iran, Libra')
+        self.assertEqual(test_entry.created, datetime.fromisoformat('2019-06-21T16:27:41-04:00'))
+
+        test_enclosure = test_entry.enclosures.first()
+        self.assertEqual(test_enclosure.type, 'audio/mpeg')
+        self.assertTrue(test_enclosure.href.startswith('https://play.podtrac.com/npr-510317/'))
+
+    def test_json_feed_is_sanitized(self):
+        test_source = construct_feed('sanitizer_bad_comment.json')
+
+        self.assertEqual(test_source.title, 'safe')
+        self.assertEqual(test_source.entries.get(guid='1').body, '<p>Hello, world!</p>')
+
+    def test_json_feed_detection(self):
+        self.assertTrue(jsonfeed.is_json_feed(b'\n  {"version": "https://jsonfeed.org/version/1.1"}'))
+        self.assertTrue(jsonfeed.is_json_feed(b'', 'application/feed+json; charset=utf-8'))
+        self.assertFalse(jsonfeed.is_json_feed(b'<?xml version="1.0"?><rss></rss>'))
+
+
+
+class TestFieldMap(TestCase):
+
+    def test_compiled_paths(self):
+        data = {'content': [{'value': 'body'}], 'image': {'href': 'a.jpg'}}
+
+        self.assertEqual(extract.compile_path('content.0.value')(data), 'body')
+        self.assertIsNone(extract.compile_path('content.1.value')(data))
+        self.assertIsNone(extract.compile_path('image.0')(data))
+        self.assertEqual(extract.compile_path('image.href')(data), 'a.jpg')
+
+    def test_register_paths(self):
+        field_map = extract.FieldMap({'title': ('title',)})
+        field_map.register('title', 'media_title')
+        field_map.register('body', 'content.0.value')
+
+        self.assertEqual(field_map.extract({'media_title': 'media'}), {'title': 'media'})
+        self.assertEqual(field_map.extract({'title': 'title', 'media_title': 'media'})['title'], 'title')
+
+        field_map.register('title', 'media_title', first=True)
+        self.assertEqual(field_map.extract({'title': 'title', 'media_title': 'media', 'content': [{'value': 'x'}]}),
+                         {'title': 'media', 'body': 'x'})
+
+
+
+class TestBenchParse(TestCase):
+
+    def test_find_regressions(self):
+        baseline = {'a.xml': {'parse': 0.010, 'mapping': 0.0001}, 'gone.xml': {'parse': 0.001}}
+        results = {
+            'a.xml': {'parse': 0.020, 'mapping': 0.0002, 'entries_insert': 0.5},
+            'new.xml': {'parse': 1.0},
+        }
+
+        # mapping doubled but by less than the noise floor, the stages and files not in both are skipped
+        self.assertEqual(benchparse.find_regressions(results, baseline, 0.25), [('a.xml', 'parse', 0.010, 0.020)])
+        self.assertEqual(benchparse.find_regressions(results, baseline, 1.5), [])
+
+    def test_stages_against_baseline(self):
+        path = os.path.join(TEST_DATA_DIR, 'json_simple_two_entry.json')
+        with tempfile.TemporaryDirectory() as directory:
+            baseline_path = os.path.join(directory, 'baseline.json')
+            call_command('benchparse', path, stages_only=True, repeat=1, synthetic=[10],
+                         save_baseline=baseline_path, stdout=io.StringIO())
+
+            with open(baseline_path, encoding='utf-8') as file:
+                results = json.load(file)['results']
+            self.assertEqual(set(results), {'json_simple_two_entry.json', 'synthetic-rss-10', 'synthetic-atom-10', 'synthetic-json-10'})
+            self.assertEqual(set(results['synthetic-rss-10']), set(benchparse.STAGES))
+            # the benchmark's sources and entries are rolled back
+            self.assertFalse(Source.objects.filter(feed_url__startswith='https://benchparse.invalid/').exists())
+
+            # a baseline that every stage is far slower than
+            for timings in results.values():
+                for stage in timings:
+                    timings[stage] = 1e-9
+            with open(baseline_path, 'w', encoding='utf-8') as file:
+                json.dump({'repeat': 1, 'results': results}, file)
+
+            with self.assertRaises(CommandError):
+                call_command('benchparse', path, stages_only=True, repeat=1, synthetic=[10],
+                             baseline=baseline_path, stdout=io.StringIO(), stderr=io.StringIO())
+